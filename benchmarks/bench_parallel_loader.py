@@ -0,0 +1,44 @@
+"""Time get_pricing_dfs on a synthetic history with 1 to N worker processes.
+
+Usage:
+    poetry run python benchmarks/bench_parallel_loader.py --runs 10000 --coins 20 --max-workers 8
+"""
+import argparse
+import os
+from pathlib import Path
+import tempfile
+
+import pandas as pd
+
+from synthetic import Timer, write_pricing_history
+
+from crypto_tracker import get_pricing_dfs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10000)
+    parser.add_argument("--coins", type=int, default=20)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    worker_counts = sorted({1, *(2**i for i in range(1, args.max_workers.bit_length())), args.max_workers})
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pricing_data_dir = Path(tmp_dir)
+        write_pricing_history(pricing_data_dir, args.runs, args.coins, seed=args.seed)
+        for workers in worker_counts:
+            with Timer() as timer:
+                dfs = get_pricing_dfs(pricing_data_dir, workers=workers, chunk_size=args.chunk_size)
+            assert len(dfs) == args.runs
+            results.append({"workers": workers, "files": args.runs, "read_s": round(timer.seconds, 3)})
+
+    df_results = pd.DataFrame(results)
+    df_results["speedup"] = (df_results["read_s"].iloc[0] / df_results["read_s"]).round(2)
+    print(df_results.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Compare write time, read time and disk size of csv, parquet and feather pricing histories.
+
+Usage:
+    poetry run python benchmarks/bench_storage_formats.py --runs 10000 --coins 20
+"""
+import argparse
+import contextlib
+import io
+from pathlib import Path
+import tempfile
+
+import pandas as pd
+
+from synthetic import Timer, write_pricing_history
+
+from crypto_tracker import (
+    AVERAGE_DIFFERENCE_COLUMNS,
+    FILE_FORMATS,
+    calculate_average_difference,
+    get_pricing_dfs,
+)
+
+
+def bench_format(file_format: str, runs: int, n_coins: int, seed: int) -> dict:
+    """Write a synthetic history in one format, then read it back the way Part 4 does."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pricing_data_dir = Path(tmp_dir)
+        write_seconds = write_pricing_history(pricing_data_dir, runs, n_coins, file_format, seed)
+
+        with Timer() as read_timer:
+            dfs = get_pricing_dfs(pricing_data_dir, file_format, AVERAGE_DIFFERENCE_COLUMNS)
+            with contextlib.redirect_stdout(io.StringIO()):
+                calculate_average_difference(dfs)
+
+        disk_bytes = sum(path.stat().st_size for path in pricing_data_dir.glob(f"*{FILE_FORMATS[file_format]}"))
+
+    return {
+        "format": file_format,
+        "runs": runs,
+        "coins": n_coins,
+        "write_s": round(write_seconds, 3),
+        "read_s": round(read_timer.seconds, 3),
+        "disk_mb": round(disk_bytes / 1e6, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10000)
+    parser.add_argument("--coins", type=int, default=20)
+    parser.add_argument("--formats", nargs="+", default=list(FILE_FORMATS), choices=list(FILE_FORMATS))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = [bench_format(file_format, args.runs, args.coins, args.seed) for file_format in args.formats]
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
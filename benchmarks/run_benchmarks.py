@@ -0,0 +1,170 @@
+"""Time the tracker's public functions and run_process end to end on synthetic data, and record the
+results per commit so runs on different commits can be compared.
+
+Usage:
+    poetry run python benchmarks/run_benchmarks.py --coins 1000 5000 20000 --runs 10 1000 10000
+    poetry run python benchmarks/run_benchmarks.py --compare HEAD~1
+"""
+import argparse
+import contextlib
+from datetime import datetime
+import io
+import json
+from pathlib import Path
+import platform
+import statistics
+import subprocess
+import tempfile
+from unittest.mock import patch
+
+import pandas as pd
+
+from synthetic import Timer, make_api_response, write_pricing_history
+
+from crypto_tracker import (
+    AVERAGE_DIFFERENCE_COLUMNS,
+    analyze_bitcoin_relationship,
+    calculate_average_difference,
+    compact_pricing_files,
+    get_coin_universe,
+    get_pricing_data,
+    get_pricing_dfs,
+    load_history_store,
+    RunOptions,
+    run_process,
+    update_history_store,
+)
+
+ROOT_DIR = Path(__file__).resolve().parents[1]
+RESULTS_FILE = Path(__file__).resolve().parent / "results.jsonl"
+TRACKED_COINS = 20
+
+
+def git_commit(ref: str = "HEAD") -> str:
+    """Commit hash of ref, or "unknown" outside a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", ref], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def time_call(func, repeat: int) -> dict:
+    """Call func `repeat` times with its printing silenced and summarize the wall times."""
+    seconds = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()), Timer() as timer:
+            func()
+        seconds.append(timer.seconds)
+    return {"min_s": min(seconds), "median_s": statistics.median(seconds), "repeat": repeat}
+
+
+def bench_universe(n_coins: int, repeat: int, work_dir: Path) -> list:
+    """Benchmarks that scale with the size of the coin universe."""
+    api_response = make_api_response(n_coins)
+    coins_to_track_path = work_dir / "coins_to_track.csv"
+    pd.DataFrame({"Symbol": [coin["symbol"] for coin in api_response[:TRACKED_COINS]]}).to_csv(coins_to_track_path, index=False)
+    universe_file = work_dir / "coin_universe.csv"
+    analysis_file = work_dir / "bitcoin_relationship.csv"
+    pricing_data_dir = work_dir / "pricing_data"
+    pricing_data_dir.mkdir(exist_ok=True)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        df_universe = get_coin_universe(api_response, universe_file)
+        df_pricing = get_pricing_data(coins_to_track_path, df_universe, pricing_data_dir)
+
+    def end_to_end():
+        with patch("tracker.pipeline.get_api_response", return_value=api_response):
+            run_process("https://example.com/listings/latest", {}, universe_file, coins_to_track_path, pricing_data_dir, analysis_file, RunOptions(history_store_file=work_dir / "history_store.json"))
+
+    benchmarks = {
+        "get_coin_universe": lambda: get_coin_universe(api_response, universe_file),
+        "get_pricing_data": lambda: get_pricing_data(coins_to_track_path, df_universe, pricing_data_dir),
+        "analyze_bitcoin_relationship": lambda: analyze_bitcoin_relationship(df_pricing, analysis_file),
+        "analyze_bitcoin_relationship_full_universe": lambda: analyze_bitcoin_relationship(df_universe, analysis_file),
+        "run_process": end_to_end,
+    }
+    return [{"benchmark": name, "coins": n_coins, **time_call(func, repeat)} for name, func in benchmarks.items()]
+
+
+def bench_history(runs: int, repeat: int, work_dir: Path) -> list:
+    """Benchmarks that scale with the number of runs in the pricing history."""
+    pricing_data_dir = work_dir / f"history_{runs}"
+    pricing_data_dir.mkdir()
+    write_pricing_history(pricing_data_dir, runs, TRACKED_COINS)
+    dfs_pricing = get_pricing_dfs(pricing_data_dir, columns=AVERAGE_DIFFERENCE_COLUMNS)
+    ingested_files = update_history_store(pricing_data_dir, load_history_store(work_dir / "missing.json"))["ingested_files"]
+    assert len(ingested_files) == runs, f"update_history_store ingested {len(ingested_files)} of {runs} files"
+
+    benchmarks = {
+        "get_pricing_dfs": lambda: get_pricing_dfs(pricing_data_dir, columns=AVERAGE_DIFFERENCE_COLUMNS),
+        "calculate_average_difference": lambda: calculate_average_difference(dfs_pricing),
+        "update_history_store_rebuild": lambda: update_history_store(pricing_data_dir, load_history_store(work_dir / "missing.json")),
+    }
+    results = [{"benchmark": name, "runs": runs, **time_call(func, repeat)} for name, func in benchmarks.items()]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        compact_pricing_files(pricing_data_dir, before=datetime.max)
+    compacted_read = lambda: get_pricing_dfs(pricing_data_dir, columns=AVERAGE_DIFFERENCE_COLUMNS)
+    results.append({"benchmark": "get_pricing_dfs_compacted", "runs": runs, **time_call(compacted_read, repeat)})
+    return results
+
+
+def load_results(results_file: Path) -> pd.DataFrame:
+    if not results_file.exists():
+        return pd.DataFrame()
+    with open(results_file) as f:
+        return pd.DataFrame([json.loads(line) for line in f if line.strip()])
+
+
+def compare(results_file: Path, baseline_ref: str, current_ref: str):
+    """Print median times of current_ref next to baseline_ref for the benchmarks both recorded."""
+    df_results = load_results(results_file)
+    if df_results.empty:
+        print(f"No results recorded in {results_file}")
+        return
+    keys = ["benchmark", "coins", "runs"]
+    df_results[["coins", "runs"]] = df_results.reindex(columns=["coins", "runs"]).fillna(0).astype(int)
+    latest = df_results.sort_values("recorded_at").groupby(["commit"] + keys, as_index=False).last()
+    baseline = latest[latest["commit"] == git_commit(baseline_ref)][keys + ["median_s"]]
+    current = latest[latest["commit"] == git_commit(current_ref)][keys + ["median_s"]]
+    df_compare = baseline.merge(current, on=keys, suffixes=("_baseline", "_current"))
+    if df_compare.empty:
+        print(f"No benchmarks recorded for both {baseline_ref} and {current_ref}")
+        return
+    df_compare["ratio"] = (df_compare["median_s_current"] / df_compare["median_s_baseline"]).round(2)
+    print(df_compare.to_string(index=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--coins", type=int, nargs="*", default=[1000, 5000, 20000], help="Universe sizes to benchmark.")
+    parser.add_argument("--runs", type=int, nargs="*", default=[10, 1000], help="Pricing history sizes to benchmark.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--results-file", type=Path, default=RESULTS_FILE)
+    parser.add_argument("--compare", metavar="REF", help="Compare HEAD's recorded results against another commit's instead of running.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(args.results_file, args.compare, "HEAD")
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = Path(tmp_dir)
+        for n_coins in args.coins:
+            results.extend(bench_universe(n_coins, args.repeat, work_dir))
+        for runs in args.runs:
+            results.extend(bench_history(runs, args.repeat, work_dir))
+
+    context = {"commit": git_commit(), "recorded_at": datetime.now().isoformat(), "python": platform.python_version(), "pandas": pd.__version__}
+    with open(args.results_file, "a") as f:
+        for result in results:
+            f.write(json.dumps({**context, **result}) + "\n")
+    print(pd.DataFrame(results).to_string(index=False))
+    print(f"Results appended to {args.results_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Synthetic data generators shared by the benchmark scripts."""
+import contextlib
+from datetime import datetime, timedelta
+import io
+from pathlib import Path
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from crypto_tracker import FILE_FORMATS, safe_save_file_name, save_table, write_pricing_manifest  # noqa: E402
+
+HISTORY_START = datetime(2025, 1, 1)
+
+
+def make_pricing_run(n_coins: int, loaded_when: datetime, rng: np.random.Generator) -> pd.DataFrame:
+    """Build one synthetic pricing snapshot shaped like the output of get_pricing_data."""
+    symbols = ["BTC"] + [f"COIN{i}" for i in range(1, n_coins)]
+    return pd.DataFrame(
+        {
+            "id": np.arange(1, n_coins + 1),
+            "name": symbols,
+            "symbol": symbols,
+            "cmc_rank": np.arange(1, n_coins + 1),
+            "circulating_supply": rng.uniform(1e6, 1e9, n_coins),
+            "max_supply": rng.uniform(1e9, 1e10, n_coins),
+            "tags": [["mineable", "pow"]] * n_coins,
+            "platform": [None] * n_coins,
+            "percent_change_24h": rng.normal(0, 5, n_coins),
+            "LoadedWhen": loaded_when.isoformat(),
+            "IsTopCurrency": np.arange(1, n_coins + 1) <= 10,
+        }
+    )
+
+
+def make_api_response(n_coins: int, seed: int = 0, currencies: tuple = ("USD",)) -> list:
+    """Build a synthetic listings/latest "data" array with n_coins CoinMarketCap-shaped coins, BTC first."""
+    rng = np.random.default_rng(seed)
+    prices = rng.lognormal(0, 3, n_coins)
+    changes = rng.normal(0, 5, (n_coins, 7))
+    supplies = rng.uniform(1e6, 1e10, n_coins)
+    tag_pool = ["mineable", "pow", "pos", "defi", "smart-contracts", "layer-1", "meme", "stablecoin"]
+    coins = []
+    for i in range(n_coins):
+        symbol = "BTC" if i == 0 else f"COIN{i}"
+        quote = {
+            "price": float(prices[i]),
+            "volume_24h": float(prices[i] * supplies[i] * 0.01),
+            "volume_change_24h": float(changes[i, 0]),
+            "percent_change_1h": float(changes[i, 1]),
+            "percent_change_24h": float(changes[i, 2]),
+            "percent_change_7d": float(changes[i, 3]),
+            "percent_change_30d": float(changes[i, 4]),
+            "percent_change_60d": float(changes[i, 5]),
+            "percent_change_90d": float(changes[i, 6]),
+            "market_cap": float(prices[i] * supplies[i]),
+            "market_cap_dominance": 0.0,
+            "fully_diluted_market_cap": float(prices[i] * supplies[i] * 1.1),
+            "tvl": None,
+            "last_updated": "2025-01-20T23:01:00.000Z",
+        }
+        coins.append(
+            {
+                "id": i + 1,
+                "name": "Bitcoin" if i == 0 else f"Coin {i}",
+                "symbol": symbol,
+                "slug": symbol.lower(),
+                "num_market_pairs": int(rng.integers(1, 10000)),
+                "date_added": "2020-01-01T00:00:00.000Z",
+                "tags": [tag_pool[j] for j in range(len(tag_pool)) if (i >> j) & 1],
+                "max_supply": None if i % 3 else float(supplies[i] * 2),
+                "circulating_supply": float(supplies[i]),
+                "total_supply": float(supplies[i]),
+                "infinite_supply": bool(i % 3),
+                "platform": None if i % 2 else {"id": 1027, "name": "Ethereum", "symbol": "ETH", "slug": "ethereum", "token_address": f"0x{i:040x}"},
+                "cmc_rank": i + 1,
+                "self_reported_circulating_supply": None,
+                "self_reported_market_cap": None,
+                "tvl_ratio": None,
+                "last_updated": "2025-01-20T23:01:00.000Z",
+                "quote": {currency: dict(quote) for currency in currencies},
+            }
+        )
+    return coins
+
+
+def pricing_file_name(loaded_when: datetime, file_format: str) -> str:
+    """File name get_pricing_data would give a run at loaded_when."""
+    return safe_save_file_name(
+        f"pricing_data__{loaded_when.strftime('%Y_%m_%dT%H_%M_%S_%f')}{FILE_FORMATS[file_format]}"
+    )
+
+
+def write_pricing_history(
+    pricing_data_dir: Path,
+    runs: int,
+    n_coins: int,
+    file_format: str = "csv",
+    seed: int = 0,
+    run_interval: timedelta = timedelta(minutes=1),
+) -> float:
+    """Write `runs` synthetic pricing files, each with its manifest like get_pricing_data, into pricing_data_dir.
+    Returns the seconds spent in save_table."""
+    rng = np.random.default_rng(seed)
+    write_seconds = 0.0
+    for run in range(runs):
+        loaded_when = HISTORY_START + run * run_interval
+        df = make_pricing_run(n_coins, loaded_when, rng)
+        pricing_file = pricing_data_dir / pricing_file_name(loaded_when, file_format)
+        with contextlib.redirect_stdout(io.StringIO()), Timer() as timer:
+            save_table(df, pricing_file, file_format)
+        write_seconds += timer.seconds
+        write_pricing_manifest(pricing_file, df, file_format, loaded_when)
+    return write_seconds
+
+
+class Timer:
+    """Context manager measuring wall time with perf_counter."""
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self._start
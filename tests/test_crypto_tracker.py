@@ -1,24 +1,149 @@
+import asyncio
+from contextlib import closing
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
 from pathlib import Path
 import shutil
 import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
 from unittest.mock import patch, Mock
+from urllib.parse import parse_qs, urlparse
 
 import pytest
 import pandas as pd
+import requests
 
 from crypto_tracker import (
+    ApiClient,
+    ApiKeyPool,
+    ResponseCache,
+    parse_retry_after,
+    get_api_response,
+    get_api_response_paginated,
+    get_api_quotes,
+    TrackedQuoteFetcher,
+    FanOutFetcher,
     safe_save_file_name,
+    read_pricing_manifest,
+    is_valid_pricing_file,
+    read_table,
+    save_table,
+    decode_nested_columns,
     get_coin_universe,
+    get_coin_universe_streaming,
+    build_coin_universe,
+    UniverseSnapshots,
+    memory_report,
+    load_universe_snapshot,
+    save_universe_snapshot,
+    iter_api_coins,
+    iter_json_array,
     get_coins_to_track,
+    resolve_tracked_ids,
+    get_universe_signature,
+    load_universe_ids,
     is_top_currency,
     get_pricing_data,
     analyze_bitcoin_relationship,
+    analyze_relationships,
     get_pricing_dfs,
+    list_pricing_files,
+    compact_pricing_files,
+    save_pricing_data,
     calculate_average_difference,
-    run_process
+    load_history_store,
+    save_history_store,
+    update_history_store,
+    calculate_average_difference_from_store,
+    calculate_average_difference_sqlite,
+    PRICING_DATABASE_NAME,
+    RollingStatistics,
+    load_rolling_statistics,
+    save_rolling_statistics,
+    RunOptions,
+    fetch_coins,
+    run_process,
+    run_daemon,
+    run_pipeline_async,
+    update_average_difference,
+    PipelineMetrics,
+    load_config,
+    get_fan_out_fetcher,
+    main,
 )
 
 
+class StubCoinMarketCapHandler(BaseHTTPRequestHandler):
+    """Serves server.coins like the listings endpoint, honoring start, limit and convert, or like quotes/latest keyed by id"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        start = int(query.get("start", ["1"])[0])
+        limit = int(query.get("limit", ["100"])[0])
+        with self.server.lock:
+            self.server.requests_seen.append(query)
+            self.server.api_keys_seen.append(self.headers.get("X-CMC_PRO_API_KEY"))
+            failure = self.server.failures.pop(0) if self.server.failures else None
+        time.sleep(self.server.delay_seconds)
+        if failure is not None:
+            status_code, headers = failure
+            self.send_response(status_code)
+            for header, value in headers.items():
+                self.send_header(header, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        coins = self.server.coins
+        if "convert" in query:
+            currency = query["convert"][0]
+            coins = [{**coin, "quote": {currency: next(iter(coin["quote"].values()))}} if "quote" in coin else coin for coin in coins]
+        if url.path.endswith("/quotes/latest"):
+            # Unknown ids are left out, as with skip_invalid
+            coins_by_id = {str(coin["id"]): coin for coin in coins}
+            body = json.dumps({"status": {}, "data": {coin_id: coins_by_id[coin_id] for coin_id in query["id"][0].split(",") if coin_id in coins_by_id}}).encode()
+        else:
+            status = {"total_count": len(coins)} if self.server.report_total_count else {}
+            if self.server.credit_count is not None:
+                status["credit_count"] = self.server.credit_count
+            body = json.dumps({"status": status, "data": coins[start - 1 : start - 1 + limit]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_api_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubCoinMarketCapHandler)
+    server.coins = [{"id": rank * 10, "symbol": f"C{rank}", "cmc_rank": rank} for rank in range(1, 26)]
+    server.report_total_count = True
+    server.requests_seen = []
+    server.failures = []
+    server.api_keys_seen = []
+    server.delay_seconds = 0
+    server.credit_count = None
+    server.lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/v1/cryptocurrency/listings/latest"
+    server.quotes_url = f"http://127.0.0.1:{server.server_address[1]}/v1/cryptocurrency/quotes/latest"
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
 @pytest.fixture
 def mock_coin_universe_response():
     return [
@@ -267,6 +392,13 @@ def mock_pricing_data_dir_populated():
     shutil.rmtree(test_pricing_data_dir)
 
 
+@pytest.fixture
+def mock_history_store_file():
+    test_history_store_file = Path("test_pricing_history_store.json")
+    yield test_history_store_file
+    test_history_store_file.unlink(missing_ok=True)
+
+
 @pytest.fixture
 def mock_df_pricing():
     test_df_pricing = pd.DataFrame(
@@ -299,6 +431,124 @@ def mock_analysis_save_path():
     test_analysis_save_path.unlink(missing_ok=True)
 
 
+def test_get_api_response(stub_api_server):
+    """Checking a single call returns the API's default page"""
+    data = get_api_response(stub_api_server.url, {"Accepts": "application/json"})
+    assert len(data) == 25
+
+
+@pytest.mark.parametrize("report_total_count", [True, False])
+def test_get_api_response_paginated(stub_api_server, report_total_count):
+    """Checking every page is fetched and merged in rank order, with or without total_count"""
+    stub_api_server.report_total_count = report_total_count
+    data = get_api_response_paginated(stub_api_server.url, {}, page_size=4, max_workers=3)
+    assert [coin["cmc_rank"] for coin in data] == list(range(1, 26))
+    starts = sorted(int(query["start"][0]) for query in stub_api_server.requests_seen)
+    assert starts[:7] == [1, 5, 9, 13, 17, 21, 25]
+    assert all(query["limit"] == ["4"] for query in stub_api_server.requests_seen)
+
+
+def test_api_client_retries(stub_api_server):
+    """Checking transient 429/5xx responses are retried and show up in the metrics"""
+    stub_api_server.failures = [(429, {"Retry-After": "0"}), (503, {})]
+    client = ApiClient(backoff_base=0.01)
+    data = get_api_response(stub_api_server.url, {}, session=client)
+    assert len(data) == 25
+
+    metrics = client.metrics_summary()
+    assert metrics["requests"] == 3
+    assert metrics["retries"] == 2
+    assert metrics["status_codes"] == {"429": 1, "503": 1, "200": 1}
+    assert metrics["latency_max_seconds"] >= 0
+    client.close()
+
+
+def test_api_client_gives_up(stub_api_server):
+    """Checking the client stops after max_retries and the HTTPError reaches the caller"""
+    stub_api_server.failures = [(500, {})] * 3
+    client = ApiClient(max_retries=2, backoff_base=0.01)
+    try:
+        get_api_response(stub_api_server.url, {}, session=client)
+        assert False
+    except requests.exceptions.HTTPError:
+        assert True
+    assert client.metrics_summary()["failures"] == 1
+    client.close()
+
+
+def test_api_client_credit_budget(stub_api_server):
+    """Checking calls wait once the credit or request budget for the window is spent"""
+    client = ApiClient(credits_per_minute=2, budget_window_seconds=0.2)
+    for _ in range(3):
+        get_api_response(stub_api_server.url, {}, params={"limit": 200}, session=client)
+    metrics = client.metrics_summary()
+    assert metrics["credits_used"] == 3
+    assert metrics["budget_wait_seconds"] > 0
+
+    # The payload's credit_count replaces the estimate
+    stub_api_server.credit_count = 4
+    get_api_response(stub_api_server.url, {}, params={"limit": 200}, session=client)
+    assert client.metrics_summary()["credits_used"] == 7
+    client.close()
+
+    # The request rate limit counts calls, so two 25-credit pages fit in 30 requests a minute
+    client = ApiClient(requests_per_minute=30)
+    for _ in range(2):
+        get_api_response(stub_api_server.url, {}, params={"limit": 5000}, session=client)
+    assert client.metrics_summary()["budget_wait_seconds"] == 0
+    client = ApiClient(requests_per_minute=1, budget_window_seconds=0.2)
+    for _ in range(2):
+        get_api_response(stub_api_server.url, {}, params={"limit": 1}, session=client)
+    assert client.metrics_summary()["budget_wait_seconds"] > 0
+
+
+def test_response_cache(stub_api_server):
+    """Checking repeated calls within the TTL are served locally and the LRU evicts old keys"""
+    cache = ResponseCache(ttl_seconds=60, max_entries=2)
+    for _ in range(3):
+        get_api_response(stub_api_server.url, {}, session=None, cache=cache)
+    assert len(stub_api_server.requests_seen) == 1
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+    get_api_response(stub_api_server.url, {}, params={"start": 2}, cache=cache)
+    get_api_response(stub_api_server.url, {}, params={"start": 3}, cache=cache)
+    assert cache.stats()["evictions"] == 1
+    get_api_response(stub_api_server.url, {}, cache=cache)
+    assert len(stub_api_server.requests_seen) == 4
+
+    expired_cache = ResponseCache(ttl_seconds=0)
+    get_api_response(stub_api_server.url, {}, cache=expired_cache)
+    get_api_response(stub_api_server.url, {}, cache=expired_cache)
+    assert expired_cache.stats()["hits"] == 0
+
+
+def test_response_cache_on_disk(stub_api_server, tmp_path):
+    """Checking a second cache pointed at the same directory reuses the first one's response"""
+    get_api_response(stub_api_server.url, {}, cache=ResponseCache(cache_dir=tmp_path))
+    other_job_cache = ResponseCache(cache_dir=tmp_path)
+    data = get_api_response(stub_api_server.url, {}, cache=other_job_cache)
+    assert len(data) == 25
+    assert len(stub_api_server.requests_seen) == 1
+    assert other_job_cache.stats()["hits"] == 1
+
+    # Once its memory entry expires, a cache picks up what another job has since refreshed on disk
+    other_job_cache.ttl_seconds = 0.2
+    time.sleep(0.2)
+    get_api_response(stub_api_server.url, {}, cache=ResponseCache(ttl_seconds=0, cache_dir=tmp_path))
+    get_api_response(stub_api_server.url, {}, cache=other_job_cache)
+    assert len(stub_api_server.requests_seen) == 2
+    assert other_job_cache.stats()["hits"] == 2
+
+
+def test_parse_retry_after():
+    """Checking Retry-After can be seconds or an HTTP date"""
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert parse_retry_after("soon") is None
+
+
 def test_safe_save_file_name():
     """Testing to make sure there are no prohibitted characters in file names"""
     prohibitted_windows_characters = r'\/:*?"<>|'
@@ -323,6 +573,175 @@ def test_get_coin_universe(mock_coin_universe_response, mock_universe_file):
     assert "ETH" in df["symbol"].values
 
 
+@pytest.mark.parametrize("suffix", [".parquet", ".feather"])
+def test_get_coin_universe_columnar(mock_coin_universe_response, suffix):
+    """Checking columnar universe files keep typed columns and nested objects can be read back"""
+    pytest.importorskip("pyarrow")
+    universe_file = Path(f"test_coin_universe{suffix}")
+    try:
+        get_coin_universe(mock_coin_universe_response, universe_file)
+        df = decode_nested_columns(read_table(universe_file))
+        assert df["cmc_rank"].tolist() == [1, 2]
+        assert pd.api.types.is_float_dtype(df["max_supply"])
+        assert df["quote_USD_percent_change_24h"].iloc[0] == 0.69860286
+        assert pd.api.types.is_float_dtype(df["quote_USD_tvl"])
+        assert "mineable" in df["tags"].iloc[0]
+
+        df_projected = read_table(universe_file, columns=["symbol", "percent_change_24h"])
+        assert list(df_projected.columns) == ["symbol", "percent_change_24h"]
+    finally:
+        universe_file.unlink(missing_ok=True)
+
+
+def test_get_coin_universe_nested_columns_csv(mock_coin_universe_response, mock_universe_file):
+    """Checking nested objects in the csv are JSON and not Python reprs"""
+    get_coin_universe(mock_coin_universe_response, mock_universe_file)
+    df = decode_nested_columns(read_table(mock_universe_file))
+    assert df["tags"].iloc[1][0] == "pos"
+    assert df["platform"].iloc[0] is None
+
+
+def test_get_coin_universe_flattened_quote(mock_coin_universe_response, mock_universe_file):
+    """Checking quotes are flattened into typed columns for every convert currency"""
+    for coin in mock_coin_universe_response:
+        coin["quote"]["EUR"] = {**coin["quote"]["USD"], "price": coin["quote"]["USD"]["price"] * 0.9}
+    df = get_coin_universe(mock_coin_universe_response, mock_universe_file)
+
+    assert "quote" not in df.columns
+    assert df["quote_USD_price"].iloc[0] == 103325.80885486708
+    assert df["quote_EUR_price"].iloc[0] == pytest.approx(92993.22796938037)
+    assert df["num_market_pairs"].tolist() == [11869, 9842]
+    assert isinstance(df["symbol"].dtype, pd.CategoricalDtype)
+    assert all(df[col].dtype == "float64" for col in df.columns if col.startswith("quote_"))
+
+    df_eur = get_coin_universe(mock_coin_universe_response, mock_universe_file, currencies=["EUR"])
+    assert not any(col.startswith("quote_USD_") for col in df_eur.columns)
+
+    # A coin missing a currency gets NaN quotes, and percent_change_24h is only ever the USD change
+    del mock_coin_universe_response[1]["quote"]["EUR"]
+    df = build_coin_universe(mock_coin_universe_response, ["USD", "EUR"])
+    assert pd.isna(df["quote_EUR_price"].iloc[1])
+    assert df["percent_change_24h"].notna().all()
+    for coin in mock_coin_universe_response:
+        del coin["quote"]["USD"]
+    assert build_coin_universe(mock_coin_universe_response)["percent_change_24h"].isna().all()
+    try:
+        get_fan_out_fetcher({"convert": "EUR,GBP", "api_url": "", "page_size": None}, {}, ApiKeyPool())
+        assert False
+    except ValueError:
+        assert True
+
+
+def test_universe_snapshots(mock_coin_universe_response):
+    """Checking snapshots are compacted losslessly, share their strings and can be compared across runs"""
+    df = build_coin_universe(mock_coin_universe_response)
+    df["huge"] = [1e39, 1.0]
+    snapshots = UniverseSnapshots(max_snapshots=2)
+    first = snapshots.add(df, "2025-01-20T23:00:00")
+
+    assert first["id"].dtype == "int16" and first["cmc_rank"].dtype == "int8"
+    assert first["quote_USD_price"].dtype == "float64"
+    assert first["quote_USD_price"].iloc[0] == 103325.80885486708
+    assert first["quote_USD_volume_24h"].dtype == "float32"
+    assert first["huge"].dtype == "float64"
+    assert all(isinstance(first[col].dtype, pd.CategoricalDtype) for col in ["name", "slug", "tags", "platform"])
+    assert decode_nested_columns(first.astype({"tags": object}))["tags"].tolist() == df["tags"].tolist()
+    assert memory_report(first)["bytes"].sum() < memory_report(df)["bytes"].sum()
+
+    df_later = df.assign(percent_change_24h=df["percent_change_24h"] + 1)
+    second = snapshots.add(df_later, "2025-01-20T23:01:00")
+    assert second["tags"].cat.categories[0] is first["tags"].cat.categories[0]
+    comparison = snapshots.compare("percent_change_24h")
+    assert list(comparison.columns) == ["2025-01-20T23:00:00", "2025-01-20T23:01:00"]
+    assert (comparison.iloc[:, 1] - comparison.iloc[:, 0]).tolist() == pytest.approx([1, 1], rel=1e-5)
+
+    snapshots.add(df_later, "2025-01-20T23:02:00")
+    assert list(snapshots.snapshots) == ["2025-01-20T23:01:00", "2025-01-20T23:02:00"]
+    report = snapshots.memory_report().set_index("column")
+    assert report.loc["(shared strings)", "bytes"] > 0
+    assert report.loc["tags", "dtype"] == "category"
+
+
+def test_iter_json_array():
+    """Checking the streaming parser matches json.loads even when chunks split tokens"""
+    payload = {
+        "status": {"error_message": "\"data\": [not this]", "total_count": 3},
+        "data": [{"id": 1, "price": 103325.80885486708, "name": "Bitcoin \u00e9"}, {"id": 1027, "tags": []}, 12345],
+        "after": None,
+    }
+    raw = json.dumps(payload, ensure_ascii=False).encode()
+    for chunk_size in (1, 7, len(raw)):
+        chunks = [raw[i : i + chunk_size] for i in range(0, len(raw), chunk_size)]
+        assert list(iter_json_array(chunks, "data")) == payload["data"]
+
+    try:
+        list(iter_json_array([b'{"data": [{"id": 1}, {"id"']))
+        assert False
+    except ValueError:
+        assert True
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet"])
+def test_get_coin_universe_streaming(stub_api_server, mock_coin_universe_response, suffix):
+    """Checking the streamed universe file matches the batch one and only tracked rows are kept in memory"""
+    if suffix == ".parquet":
+        pytest.importorskip("pyarrow")
+    stub_api_server.coins = mock_coin_universe_response
+    universe_file = Path(f"test_coin_universe_streamed{suffix}")
+    batch_universe_file = Path(f"test_coin_universe_batch{suffix}")
+    try:
+        coins = iter_api_coins(stub_api_server.url, {}, page_size=1, chunk_size=16)
+        df_kept = get_coin_universe_streaming(coins, universe_file, keep_symbols={"ETH"}, batch_size=1)
+        assert df_kept["symbol"].tolist() == ["ETH"]
+        assert len(stub_api_server.requests_seen) == 3
+
+        get_coin_universe(mock_coin_universe_response, batch_universe_file)
+        pd.testing.assert_frame_equal(read_table(universe_file), read_table(batch_universe_file))
+
+        # A stream cut off mid-listing leaves the last complete universe in place
+        def interrupted_coins():
+            yield mock_coin_universe_response[0]
+            raise ConnectionError("stream cut off")
+
+        try:
+            get_coin_universe_streaming(interrupted_coins(), universe_file, batch_size=1)
+            assert False
+        except ConnectionError:
+            assert True
+        pd.testing.assert_frame_equal(read_table(universe_file), read_table(batch_universe_file))
+        assert not universe_file.with_name(universe_file.name + ".tmp").exists()
+    finally:
+        universe_file.unlink(missing_ok=True)
+        batch_universe_file.unlink(missing_ok=True)
+
+
+def test_get_coin_universe_reference_delta(mock_coin_universe_response, mock_universe_file, tmp_path):
+    """Checking the reference table is only rewritten when static fields change and the snapshot joins back"""
+    reference_file = tmp_path / "coin_reference.csv"
+    df_universe = get_coin_universe(mock_coin_universe_response, mock_universe_file, reference_path=reference_file)
+    assert reference_file.exists()
+    assert "tags" not in pd.read_csv(mock_universe_file).columns
+    assert "quote_USD_price" not in pd.read_csv(reference_file).columns
+    first_written = reference_file.stat().st_mtime_ns
+
+    reordered_response = list(reversed(mock_coin_universe_response))
+    reordered_response[0]["quote"]["USD"]["price"] = 3400.0
+    get_coin_universe(reordered_response, mock_universe_file, reference_path=reference_file)
+    assert reference_file.stat().st_mtime_ns == first_written
+    assert pd.read_csv(mock_universe_file)["quote_USD_price"].iloc[0] == 3400.0
+
+    reordered_response[0]["tags"] = reordered_response[0]["tags"] + ["layer-1"]
+    get_coin_universe(reordered_response, mock_universe_file, reference_path=reference_file)
+    assert "layer-1" in decode_nested_columns(pd.read_csv(reference_file))["tags"].iloc[1]
+
+    df_snapshot = load_universe_snapshot(reference_file, mock_universe_file)
+    assert df_snapshot["symbol"].tolist() == ["ETH", "BTC"]
+    assert set(df_snapshot.columns) == set(df_universe.columns)
+
+    df_market_only = df_universe[["id", "cmc_rank", "quote_USD_price"]]
+    assert save_universe_snapshot(df_market_only, tmp_path / "ids_only.csv", tmp_path / "market_only.csv")
+
+
 def test_get_coins_to_track(mock_coins_to_track_file):
     """Making sure the file to track coins exists and has at least BTC in it"""
     coins_to_track = get_coins_to_track(mock_coins_to_track_file)
@@ -350,6 +769,47 @@ def test_get_pricing_data(mock_coins_to_track_file, mock_df_universe, mock_prici
     assert len(pricing_data_dir_contents) > 0
 
 
+def test_get_pricing_data_symbol_collisions(tmp_path):
+    """Checking tracked symbols resolve to CMC ids under each collision policy and BTC is always its top coin"""
+    df_universe = pd.DataFrame(
+        [
+            {"id": 1, "symbol": "BTC", "name": "Bitcoin", "cmc_rank": 1, "percent_change_24h": 1.0},
+            {"id": 1027, "symbol": "ETH", "name": "Ethereum", "cmc_rank": 2, "percent_change_24h": 2.0},
+            {"id": 9001, "symbol": "ETH", "name": "Ether Clone", "cmc_rank": 800, "percent_change_24h": 3.0},
+            {"id": 9002, "symbol": "BTC", "name": "Bitcoin Clone", "cmc_rank": 900, "percent_change_24h": 4.0},
+        ]
+    )
+    coins_to_track_path = tmp_path / "coins_to_track.csv"
+    coins_to_track_path.write_text("Symbol\nETH\n")
+
+    df_pricing = get_pricing_data(coins_to_track_path, df_universe, tmp_path)
+    assert df_pricing["id"].tolist() == [1, 1027]
+    df_pricing = get_pricing_data(coins_to_track_path, df_universe.set_index("id"), tmp_path, symbol_collisions="all")
+    assert df_pricing.index.tolist() == [1, 1027, 9001]
+    try:
+        get_pricing_data(coins_to_track_path, df_universe, tmp_path, symbol_collisions="error")
+        assert False
+    except ValueError:
+        assert True
+
+    # The resolved ids are reused until the file changes
+    with patch("tracker.pricing.resolve_tracked_ids", wraps=resolve_tracked_ids) as mock_resolve:
+        get_pricing_data(coins_to_track_path, df_universe, tmp_path)
+        assert mock_resolve.call_count == 0
+        coins_to_track_path.write_text("Symbol\nETH\nSOL\n")
+        assert get_coins_to_track(coins_to_track_path) == ["ETH", "SOL"]
+        get_pricing_data(coins_to_track_path, df_universe, tmp_path)
+        assert mock_resolve.call_count == 1
+        # SOL isn't listed, which is only checked again once the universe's ids change
+        with patch("tracker.pricing.get_universe_signature", wraps=get_universe_signature) as mock_signature:
+            get_pricing_data(coins_to_track_path, df_universe, tmp_path)
+            assert mock_signature.call_count == 0  # the universe's ids were indexed and fingerprinted by the last call
+        assert mock_resolve.call_count == 1
+        assert load_universe_ids(df_universe)["ids"] is load_universe_ids(df_universe)["ids"]
+        get_pricing_data(coins_to_track_path, df_universe.iloc[:-1], tmp_path)
+        assert mock_resolve.call_count == 2
+
+
 def test_analyze_bitcoin_relationship(
     mock_df_pricing, mock_pricing_data_dir, mock_analysis_save_path
 ):
@@ -369,12 +829,228 @@ def test_analyze_bitcoin_relationship(
         assert True
 
 
+def test_columnar_formats_without_pyarrow(mock_coins_to_track_file, mock_df_universe, mock_pricing_data_dir):
+    """Checking parquet without pyarrow fails with a hint at the columnar extra"""
+    with patch("tracker.storage.importlib.util.find_spec", return_value=None):
+        try:
+            get_pricing_data(mock_coins_to_track_file, mock_df_universe, mock_pricing_data_dir, "parquet")
+            assert False
+        except ImportError as e:
+            assert "columnar" in str(e)
+        get_pricing_data(mock_coins_to_track_file, mock_df_universe, mock_pricing_data_dir)
+    assert len(list(mock_pricing_data_dir.glob("*.csv"))) == 1
+
+
+def test_get_pricing_data_parquet(mock_coins_to_track_file, mock_df_universe, mock_pricing_data_dir):
+    """Making sure pricing files can be written as parquet and read back with only the Part 4 columns"""
+    pytest.importorskip("pyarrow")
+    get_pricing_data(mock_coins_to_track_file, mock_df_universe, mock_pricing_data_dir, "parquet")
+    assert len(list(mock_pricing_data_dir.glob("*.parquet"))) == 1
+
+    dfs = get_pricing_dfs(mock_pricing_data_dir, "parquet", ["symbol", "percent_change_24h"])
+    assert len(dfs) == 1
+    assert list(dfs[0].columns) == ["symbol", "percent_change_24h"]
+    assert calculate_average_difference(dfs)["symbol"].tolist() == ["ETH"]
+
+
+def test_analyze_relationships(mock_df_pricing):
+    """Checking several reference coins are compared in one pass in both layouts with one timestamp"""
+    df_pricing = pd.concat(
+        [
+            mock_df_pricing,
+            pd.DataFrame([{"symbol": "SOL", "name": "Solana", "cmc_rank": 6, "percent_change_24h": -1.0}]),
+        ],
+        ignore_index=True,
+    )
+    df_long = analyze_relationships(df_pricing, ["BTC", "ETH"])
+    assert len(df_long) == 4
+    assert df_long["timestamp"].nunique() == 1
+    assert not (df_long["symbol"] == df_long["reference_symbol"]).any()
+    eth_vs_btc = df_long[(df_long["reference_symbol"] == "BTC") & (df_long["symbol"] == "ETH")]
+    assert round(eth_vs_btc["percent_change_diff"].iloc[0], 2) == 1.88
+    assert df_long[df_long["reference_symbol"] == "ETH"]["symbol"].tolist() == ["SOL", "BTC"]
+
+    df_wide = analyze_relationships(df_pricing, ["BTC", "ETH"], layout="wide")
+    assert list(df_wide.columns) == ["timestamp", "symbol", "name", "diff_vs_BTC", "diff_vs_ETH"]
+    assert df_wide["symbol"].tolist() == ["SOL", "ETH", "BTC"]
+    assert pd.isna(df_wide.loc[df_wide["symbol"] == "BTC", "diff_vs_BTC"]).all()
+
+    try:
+        analyze_relationships(df_pricing, ["DOGE"])
+        assert False
+    except ValueError:
+        assert True
+
+
 def test_get_pricing_dfs(mock_pricing_data_dir_populated):
     """Check if function can read csvs from directory into a list"""
     dfs = get_pricing_dfs(mock_pricing_data_dir_populated)
     assert len(dfs) == 2
 
 
+@pytest.mark.parametrize("file_format", ["csv", "parquet"])
+def test_get_pricing_dfs_partitioned(mock_pricing_data_dir, mock_df_pricing, file_format):
+    """Checking date partitions outside the window are never opened and the symbol filter applies"""
+    if file_format == "parquet":
+        pytest.importorskip("pyarrow")
+    suffix = ".csv" if file_format == "csv" else ".parquet"
+    for run_time in ["2025_01_20T11_00_00_000000", "2025_01_21T11_00_00_000000", "2025_01_22T11_00_00_000000"]:
+        partition_dir = mock_pricing_data_dir / f"date={run_time[:10].replace('_', '-')}"
+        partition_dir.mkdir()
+        save_table(mock_df_pricing, partition_dir / f"pricing_data__{run_time}{suffix}", file_format)
+    (mock_pricing_data_dir / "date=2025-01-19").mkdir()
+    (mock_pricing_data_dir / "date=2025-01-19" / f"pricing_data__2025_01_19T11_00_00_000000{suffix}").write_text("corrupt")
+
+    dfs = get_pricing_dfs(mock_pricing_data_dir, file_format, start=datetime(2025, 1, 20, 12), end=datetime(2025, 1, 22, 23))
+    assert len(dfs) == 2
+    dfs = get_pricing_dfs(mock_pricing_data_dir, file_format, start=datetime(2025, 1, 20), end=datetime(2025, 1, 21, 23), symbols=["ETH"])
+    assert [df["symbol"].tolist() for df in dfs] == [["ETH"], ["ETH"]]
+
+
+def test_get_pricing_data_partitioned(mock_coins_to_track_file, mock_df_universe, mock_pricing_data_dir, mock_history_store_file):
+    """Checking partitioned files land in a date directory and are still picked up by Part 4"""
+    get_pricing_data(mock_coins_to_track_file, mock_df_universe, mock_pricing_data_dir, partition_by_date=True)
+    partition_files = list(mock_pricing_data_dir.glob("date=*/*.csv"))
+    assert len(partition_files) == 1
+    assert partition_files[0].parent.name == f"date={datetime.now():%Y-%m-%d}"
+    assert len(get_pricing_dfs(mock_pricing_data_dir)) == 1
+    history_store = update_history_store(mock_pricing_data_dir, load_history_store(mock_history_store_file))
+    assert history_store["ingested_files"][0].startswith("date=")
+
+
+def test_save_table_atomic(mock_df_pricing, tmp_path):
+    """A write that fails part way shouldn't leave a partial file at the final path or its temp file behind"""
+    save_path = tmp_path / "pricing_data__2025_01_20T11_53_13_706530.csv"
+    with patch.object(pd.DataFrame, "to_csv", side_effect=OSError("disk full")):
+        try:
+            save_table(mock_df_pricing, save_path)
+            assert False
+        except OSError:
+            assert True
+    assert list(tmp_path.iterdir()) == []
+
+    save_table(mock_df_pricing, save_path)
+    assert [path.name for path in tmp_path.iterdir()] == [save_path.name]
+
+
+def test_pricing_manifest_validation(mock_coins_to_track_file, mock_df_universe, tmp_path):
+    """Checking each run writes a manifest and the validating reader skips unfinished and damaged files"""
+    for _ in range(3):
+        get_pricing_data(mock_coins_to_track_file, mock_df_universe, tmp_path)
+    pricing_files = list_pricing_files(tmp_path)
+    manifest = read_pricing_manifest(pricing_files[0])
+    assert manifest["rows"] == 2
+    assert manifest["bytes"] == pricing_files[0].stat().st_size
+
+    # An unfinished run (no manifest), a truncated file and a same-size corruption, plus a file from before manifests
+    pricing_files[0].with_name("pricing_data__2099_01_01T00_00_00_000000.csv").write_text("symbol,percent_change_24h\nBTC,1")
+    pricing_files[1].write_text(pricing_files[1].read_text()[:20])
+    corrupted = pricing_files[2].read_text().replace("ETH", "XRP")
+    pricing_files[2].write_text(corrupted)
+    pricing_files[0].with_name("pricing_data__2025_01_01T00_00_00_000000.csv").write_text("symbol,percent_change_24h\nBTC,1")
+
+    assert len(get_pricing_dfs(tmp_path)) == 5
+    assert len(get_pricing_dfs(tmp_path, validate="manifest")) == 3
+    assert len(get_pricing_dfs(tmp_path, validate="checksum")) == 2
+    assert [path.name for path in tmp_path.iterdir() if "manifest" in path.name] == ["manifests.jsonl"]
+    history_store = update_history_store(tmp_path, {"ingested_files": [], "aggregates": {}})
+    assert history_store["ingested_files"][0] == "pricing_data__2025_01_01T00_00_00_000000.csv"
+    assert len(history_store["ingested_files"]) == 3
+    # Ingested files aren't validated again
+    with patch("tracker.storage.is_valid_pricing_file", wraps=is_valid_pricing_file) as mock_is_valid:
+        update_history_store(tmp_path, history_store)
+    assert mock_is_valid.call_count == 2
+
+    # An index rewritten in place (same inode, as after a directory is recreated) must not be served from the cache
+    index_path = tmp_path / "manifests.jsonl"
+    index_lines = index_path.read_text().splitlines(keepends=True)
+    index_path.write_text("".join(index_lines[1:] + index_lines[:1]))
+    assert read_pricing_manifest(pricing_files[0]) == manifest
+    index_path.write_text(index_lines[2] * 3)
+    assert read_pricing_manifest(pricing_files[0]) is None
+
+
+def test_get_pricing_dfs_parallel(mock_pricing_data_dir_populated):
+    """Checking the process pool loader returns the same frames in the same order"""
+    dfs_serial = get_pricing_dfs(mock_pricing_data_dir_populated)
+    dfs_parallel = get_pricing_dfs(mock_pricing_data_dir_populated, workers=2, chunk_size=1)
+    assert len(dfs_parallel) == len(dfs_serial)
+    for df_serial, df_parallel in zip(dfs_serial, dfs_parallel):
+        pd.testing.assert_frame_equal(df_serial, df_parallel)
+
+
+def test_sqlite_backend(mock_coins_to_track_file, mock_pricing_data_dir_populated, tmp_path):
+    """Checking runs are appended to one indexed table and the SQL averages match the pandas ones"""
+    db_path = tmp_path / PRICING_DATABASE_NAME
+    for df_run in get_pricing_dfs(mock_pricing_data_dir_populated):
+        get_pricing_data(mock_coins_to_track_file, df_run, tmp_path, "sqlite")
+    assert [path.name for path in tmp_path.iterdir()] == [PRICING_DATABASE_NAME]
+
+    dfs = get_pricing_dfs(tmp_path, "sqlite")
+    assert len(dfs) == 2
+    assert "IsTopCurrency" in dfs[0].columns
+    dfs = get_pricing_dfs(tmp_path, "sqlite", ["symbol", "percent_change_24h"], symbols=["ETH"])
+    assert [df["symbol"].tolist() for df in dfs] == [["ETH"], ["ETH"]]
+    assert list(dfs[0].columns) == ["symbol", "percent_change_24h"]
+
+    df_average = calculate_average_difference_sqlite(db_path)
+    pd.testing.assert_frame_equal(df_average, calculate_average_difference(get_pricing_dfs(tmp_path, "sqlite")))
+    assert df_average["average_diff_vs_bitcoin"].iloc[0] == 15
+    try:
+        calculate_average_difference_sqlite(db_path, start=datetime(2100, 1, 1))
+        assert False
+    except ValueError:
+        assert True
+
+    with sqlite3.connect(db_path) as conn:
+        indexes = {row[1] for row in conn.execute("PRAGMA index_list(pricing_data)")}
+    conn.close()
+    assert indexes == {"idx_pricing_data_symbol", "idx_pricing_data_LoadedWhen"}
+
+
+@pytest.mark.parametrize("segment_format", ["csv", "parquet"])
+def test_compact_pricing_files(mock_df_pricing, tmp_path, segment_format):
+    """Checking compacted segments read back as the same runs, prune by window and aren't double counted"""
+    if segment_format == "parquet":
+        pytest.importorskip("pyarrow")
+    pricing_data_dir = tmp_path / "pricing_data"
+    pricing_data_dir.mkdir()
+    for run in range(6):
+        process_runtime = datetime(2025, 1, 1, 12) + timedelta(hours=9 * run)
+        df_run = mock_df_pricing.assign(percent_change_24h=mock_df_pricing["percent_change_24h"] + run, LoadedWhen=process_runtime.isoformat())
+        save_pricing_data(df_run, pricing_data_dir, process_runtime, partition_by_date=run % 2 == 0)
+    history_store = update_history_store(pricing_data_dir, load_history_store(tmp_path / "missing.json"))
+    dfs_before = get_pricing_dfs(pricing_data_dir)
+    raw_file = list_pricing_files(pricing_data_dir)[0]
+    raw_copy = raw_file.read_bytes()
+
+    segment_files = compact_pricing_files(pricing_data_dir, before=datetime(2025, 1, 3), segment_format=segment_format)
+    assert len(segment_files) == 2
+    assert len(list_pricing_files(pricing_data_dir)) == 2
+    assert not (pricing_data_dir / "date=2025-01-01").exists()
+
+    dfs_after = get_pricing_dfs(pricing_data_dir)
+    assert [df["LoadedWhen"].iloc[0] for df in dfs_after] == [df["LoadedWhen"].iloc[0] for df in dfs_before]
+    pd.testing.assert_frame_equal(
+        pd.concat(dfs_after)[["symbol", "percent_change_24h"]].reset_index(drop=True),
+        pd.concat(dfs_before)[["symbol", "percent_change_24h"]].reset_index(drop=True),
+        check_dtype=False,
+    )
+    assert len(get_pricing_dfs(pricing_data_dir, start=datetime(2025, 1, 1, 20), end=datetime(2025, 1, 2, 20))) == 3
+
+    # Neither the existing store nor one rebuilt from the compacted directory counts a run twice
+    aggregates = json.loads(json.dumps(history_store["aggregates"]))
+    assert update_history_store(pricing_data_dir, history_store)["aggregates"] == aggregates
+    assert update_history_store(pricing_data_dir, load_history_store(tmp_path / "missing.json"))["aggregates"] == aggregates
+
+    # A raw file left behind by an interrupted compaction is ignored, then cleaned up
+    raw_file.parent.mkdir(parents=True, exist_ok=True)
+    raw_file.write_bytes(raw_copy)
+    assert len(get_pricing_dfs(pricing_data_dir)) == 6
+    compact_pricing_files(pricing_data_dir, before=datetime(2025, 1, 3), segment_format=segment_format)
+    assert not raw_file.exists()
+
+
 def test_calculate_average_difference(mock_pricing_data_dir_populated):
     """Checking if function will take list, return df, and do the proper math"""
     dfs_pricing = get_pricing_dfs(mock_pricing_data_dir_populated)
@@ -382,6 +1058,102 @@ def test_calculate_average_difference(mock_pricing_data_dir_populated):
     assert df_average["average_diff_vs_bitcoin"].iloc[0] == 15
 
 
+def test_calculate_average_difference_stats():
+    """Checking the per-run aligned statistics compare each coin to bitcoin from the same run"""
+    dfs_pricing = [
+        pd.DataFrame(
+            [
+                {"symbol": "BTC", "percent_change_24h": 10, "LoadedWhen": "2025-01-20T11:00:00"},
+                {"symbol": "ETH", "percent_change_24h": 20, "LoadedWhen": "2025-01-20T11:00:00"},
+                {"symbol": "SOL", "percent_change_24h": 5, "LoadedWhen": "2025-01-20T11:00:00"},
+            ]
+        ),
+        pd.DataFrame(
+            [
+                {"symbol": "BTC", "percent_change_24h": 30, "LoadedWhen": "2025-01-20T12:00:00"},
+                {"symbol": "ETH", "percent_change_24h": 30, "LoadedWhen": "2025-01-20T12:00:00"},
+            ]
+        ),
+    ]
+    df_average = calculate_average_difference(dfs_pricing, include_stats=True)
+    assert df_average["symbol"].tolist() == ["ETH", "SOL"]
+    assert df_average["average_diff_vs_bitcoin"].tolist() == [5, -15]
+    assert df_average["aligned_diff_mean"].tolist() == [5, -5]
+    assert df_average["aligned_diff_median"].iloc[0] == 5
+    assert df_average["aligned_diff_std"].iloc[0] == pytest.approx(7.0710678)
+    assert df_average["aligned_diff_count"].tolist() == [2, 1]
+
+
+def test_rolling_statistics():
+    """Checking the incremental windows match a full pandas recompute over the last runs"""
+    btc_changes = [1.0, -2.0, 3.5, 0.5, -1.0, 2.0, 4.0]
+    eth_changes = [2.0, -1.0, 5.0, 1.5, -3.0, 2.5, 6.0]
+    dfs_pricing = [
+        pd.DataFrame(
+            [
+                {"symbol": "BTC", "percent_change_24h": btc_change, "LoadedWhen": f"2025-01-20T1{run}:00:00"},
+                {"symbol": "ETH", "percent_change_24h": eth_change, "LoadedWhen": f"2025-01-20T1{run}:00:00"},
+            ]
+        )
+        for run, (btc_change, eth_change) in enumerate(zip(btc_changes, eth_changes))
+    ]
+    df_stats = RollingStatistics.from_history(dfs_pricing, window=4, ewma_alpha=0.3).statistics()
+    eth = df_stats.set_index("symbol").loc["ETH"]
+
+    btc = pd.Series(btc_changes)
+    coin = pd.Series(eth_changes)
+    diff = coin - btc
+    assert eth["window_count"] == 4
+    assert eth["rolling_mean_diff"] == pytest.approx(diff.rolling(4).mean().iloc[-1])
+    assert eth["rolling_std_diff"] == pytest.approx(diff.rolling(4).std().iloc[-1])
+    assert eth["ewma_diff"] == pytest.approx(diff.ewm(alpha=0.3, adjust=False).mean().iloc[-1])
+    assert eth["rolling_corr_btc"] == pytest.approx(coin.rolling(4).corr(btc).iloc[-1])
+    assert eth["rolling_beta_btc"] == pytest.approx((coin.rolling(4).cov(btc) / btc.rolling(4).var()).iloc[-1])
+
+
+def test_rolling_statistics_precision_and_state(tmp_path):
+    """Checking large, close changes don't cancel out over many window expiries, and the state survives a save and load"""
+    offset = 1e6
+    btc_changes = [offset + math.sin(run) for run in range(500)]
+    eth_changes = [offset + math.cos(run) + 0.5 * math.sin(run) for run in range(500)]
+    rolling_statistics = RollingStatistics(window=5)
+    for btc_change, eth_change in zip(btc_changes, eth_changes):
+        rolling_statistics.update(pd.DataFrame([{"symbol": "BTC", "percent_change_24h": btc_change}, {"symbol": "ETH", "percent_change_24h": eth_change}]))
+    eth = rolling_statistics.statistics().set_index("symbol").loc["ETH"]
+
+    btc = pd.Series(btc_changes[-5:]) - offset
+    coin = pd.Series(eth_changes[-5:]) - offset
+    assert eth["rolling_std_diff"] == pytest.approx((coin - btc).std(), rel=1e-6)
+    assert eth["rolling_corr_btc"] == pytest.approx(coin.corr(btc), rel=1e-6)
+    assert eth["rolling_beta_btc"] == pytest.approx(coin.cov(btc) / btc.var(), rel=1e-6)
+
+    state_path = tmp_path / "rolling_statistics.json"
+    save_rolling_statistics(rolling_statistics, state_path)
+    restored = load_rolling_statistics(state_path, window=5)
+    pd.testing.assert_frame_equal(restored.statistics(), rolling_statistics.statistics(), rtol=1e-9)
+    assert restored.runs_seen == 500
+    assert load_rolling_statistics(state_path, window=2).statistics().set_index("symbol").loc["ETH", "window_count"] == 2
+    assert load_rolling_statistics(tmp_path / "missing.json").runs_seen == 0
+
+
+def test_rolling_statistics_window_expiry():
+    """Checking a coin that stops showing up drops out of the window but keeps its EWMA"""
+    rolling_statistics = RollingStatistics(window=2)
+    rolling_statistics.update(pd.DataFrame([{"symbol": "BTC", "percent_change_24h": 1.0}, {"symbol": "SOL", "percent_change_24h": 3.0}]))
+    for _ in range(2):
+        rolling_statistics.update(pd.DataFrame([{"symbol": "BTC", "percent_change_24h": 1.0}]))
+    sol = rolling_statistics.statistics().set_index("symbol").loc["SOL"]
+    assert sol["window_count"] == 0
+    assert pd.isna(sol["rolling_mean_diff"])
+    assert sol["ewma_diff"] == 2.0
+
+    try:
+        rolling_statistics.update(pd.DataFrame([{"symbol": "SOL", "percent_change_24h": 3.0}]))
+        assert False
+    except ValueError:
+        assert True
+
+
 def test_no_pricing_files_calculate_average():
     """If provided an empty list, the function should raise a ValueError"""
     try:
@@ -390,6 +1162,41 @@ def test_no_pricing_files_calculate_average():
     except ValueError:
         assert True
 
+def test_update_history_store(mock_pricing_data_dir_populated, mock_history_store_file):
+    """Checking the store only ingests new files and its averages match a full recompute"""
+    # The fixture's files predate manifests, so validation accepts them
+    history_store = update_history_store(mock_pricing_data_dir_populated, load_history_store(mock_history_store_file))
+    save_history_store(history_store, mock_history_store_file)
+    assert len(history_store["ingested_files"]) == 2
+    assert calculate_average_difference_from_store(history_store)["average_diff_vs_bitcoin"].iloc[0] == 15
+
+    pd.DataFrame(
+        [
+            {"symbol": "BTC", "name": "Bitcoin", "cmc_rank": 1, "percent_change_24h": 10},
+            {"symbol": "ETH", "name": "Ethereum", "cmc_rank": 2, "percent_change_24h": 40},
+        ]
+    ).to_csv(mock_pricing_data_dir_populated / "test_pricing_newest.csv", index=False)
+    history_store = update_history_store(mock_pricing_data_dir_populated, load_history_store(mock_history_store_file))
+    assert len(history_store["ingested_files"]) == 3
+    assert history_store["aggregates"]["ETH"] == {"sum": 90.0, "count": 3}
+
+    df_store = calculate_average_difference_from_store(history_store)
+    df_full = calculate_average_difference(get_pricing_dfs(mock_pricing_data_dir_populated))
+    pd.testing.assert_frame_equal(df_store, df_full, check_dtype=False)
+
+    update_history_store(mock_pricing_data_dir_populated, history_store)
+    assert history_store["aggregates"]["ETH"]["count"] == 3
+
+
+def test_no_bitcoin_history_store():
+    """If the store has no BTC history, the function should raise a ValueError"""
+    try:
+        calculate_average_difference_from_store({"ingested_files": [], "aggregates": {}})
+        assert False
+    except ValueError:
+        assert True
+
+
 def test_run_process(mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path):
     """Tests if process can run with variable, valid kwargs and not uncaught raise error"""
     sandbox_api_url = "https://sandbox-api.coinmarketcap.com/v1/cryptocurrency/listings/latest"
@@ -398,4 +1205,332 @@ def test_run_process(mock_universe_file, mock_coins_to_track_file, mock_pricing_
         "X-CMC_PRO_API_KEY": "b54bcf4d-1bca-4e8e-9a24-22ff2c3d462c",
     }
     
-    run_process(sandbox_api_url, sandbox_headers, mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path)
\ No newline at end of file
+    run_process(sandbox_api_url, sandbox_headers, mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path)
+
+
+def test_run_daemon(mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path, mock_history_store_file, mock_coin_universe_response):
+    """Checking the daemon ticks on schedule, keeps the history store in memory and stops on the stop event"""
+    stop_event = threading.Event()
+    calls = []
+
+    def fake_api_response(*args, **kwargs):
+        calls.append(kwargs["session"])
+        if len(calls) == 3:
+            stop_event.set()
+        return mock_coin_universe_response
+
+    with patch("tracker.pipeline.get_api_response", side_effect=fake_api_response), patch(
+        "tracker.pipeline.load_history_store", wraps=load_history_store
+    ) as mock_load_history_store:
+        ticks = run_daemon(
+            0.01,
+            "https://example.com/listings/latest",
+            {},
+            mock_universe_file,
+            mock_coins_to_track_file,
+            mock_pricing_data_dir,
+            mock_analysis_save_path,
+            options=RunOptions(history_store_file=mock_history_store_file),
+            stop_event=stop_event,
+        )
+
+    assert ticks == 3
+    assert len(set(map(id, calls))) == 1
+    assert mock_load_history_store.call_count == 1
+    assert len(load_history_store(mock_history_store_file)["ingested_files"]) == 3
+
+
+def test_get_api_quotes(stub_api_server):
+    """Checking tracked ids are fetched in batches and come back in rank order"""
+    coins = get_api_quotes(stub_api_server.quotes_url, {}, [250, 30, 10], batch_size=2)
+    assert [coin["id"] for coin in coins] == [10, 30, 250]
+    assert sorted(query["id"][0] for query in stub_api_server.requests_seen) == ["10", "250,30"]
+
+
+def test_fan_out_fetcher(stub_api_server, mock_coin_universe_response):
+    """Checking currencies are fetched concurrently over every key and joined on coin id"""
+    stub_api_server.coins = mock_coin_universe_response
+    stub_api_server.delay_seconds = 0.5
+    fetcher = FanOutFetcher(stub_api_server.url, {"Accepts": "application/json"}, ["EUR", "USD", "GBP"], api_keys=["key-a", "key-b"], page_size=100)
+    start = time.monotonic()
+    responses = fetcher.fetch()
+    elapsed = time.monotonic() - start
+    fetcher.close()
+
+    assert elapsed < 1.2
+    assert sorted(query["convert"][0] for query in stub_api_server.requests_seen) == ["EUR", "GBP", "USD"]
+    assert sorted(stub_api_server.api_keys_seen) == ["key-a", "key-a", "key-b"]
+    assert sorted(key for request in fetcher.request_log for key in request["keys"]) == [0, 0, 1]
+    assert all(request["seconds"] >= 0.5 and request["rows"] == 2 for request in fetcher.request_log)
+    assert [summary["requests"] for summary in fetcher.metrics_summary()["keys"]] == [2, 1]
+
+    df_universe = fetcher.build_universe(responses)
+    assert df_universe["id"].tolist() == [1, 1027]
+    for currency in ["EUR", "USD", "GBP"]:
+        assert df_universe[f"quote_{currency}_price"].iloc[0] == 103325.80885486708
+    assert df_universe.columns[-1] == "percent_change_24h"
+    assert isinstance(df_universe["symbol"].dtype, pd.CategoricalDtype)
+
+
+def test_api_key_pool(stub_api_server, mock_coin_universe_response):
+    """Checking the key cursor keeps rotating across calls and every request lands on its key's client"""
+    stub_api_server.coins = mock_coin_universe_response
+    with closing(ApiKeyPool(["key-a", "key-b", "key-a"])) as key_pool:
+        for _ in range(3):
+            get_api_response(stub_api_server.url, {"X-CMC_PRO_API_KEY": "ignored"}, session=key_pool)
+
+    assert stub_api_server.api_keys_seen == ["key-a", "key-b", "key-a"]
+    assert [summary["requests"] for summary in key_pool.metrics_summary()] == [2, 1]
+
+
+def test_run_daemon_cache_ttl(stub_api_server, mock_coin_universe_response, mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path):
+    """Checking scheduled ticks never replay a cached listing as a new run"""
+    stub_api_server.coins = mock_coin_universe_response
+    run_process_args = (stub_api_server.url, {}, mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path)
+    try:
+        run_daemon(0.05, *run_process_args, options=RunOptions(cache=ResponseCache(60)), max_ticks=3)
+        assert False
+    except ValueError:
+        assert True
+    assert stub_api_server.requests_seen == []
+
+    run_daemon(0.2, *run_process_args, options=RunOptions(cache=ResponseCache(0.1)), max_ticks=3)
+    assert len(stub_api_server.requests_seen) == 3
+
+
+def test_run_daemon_quotes(stub_api_server, mock_coin_universe_response, mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path, mock_history_store_file):
+    """Checking ticks between universe refreshes only ask quotes/latest for the tracked ids, and a failed quotes call forces a refresh"""
+    untracked_coin = {**mock_coin_universe_response[1], "id": 74, "symbol": "DOGE", "name": "Dogecoin", "slug": "dogecoin", "cmc_rank": 3}
+    stub_api_server.coins = mock_coin_universe_response + [untracked_coin]
+    quote_fetcher = TrackedQuoteFetcher(stub_api_server.quotes_url, universe_refresh_seconds=3600)
+
+    def fail_second_quotes_call(*args, **kwargs):
+        if len(stub_api_server.requests_seen) == 2:
+            stub_api_server.failures.append((400, {}))
+        return run_process(*args, **kwargs)
+
+    with patch("tracker.pipeline.run_process", side_effect=fail_second_quotes_call):
+        run_daemon(
+            0.01,
+            stub_api_server.url,
+            {},
+            mock_universe_file,
+            mock_coins_to_track_file,
+            mock_pricing_data_dir,
+            mock_analysis_save_path,
+            options=RunOptions(history_store_file=mock_history_store_file, quote_fetcher=quote_fetcher),
+            max_ticks=5,
+        )
+
+    endpoints = ["quotes" if "id" in query else "listings" for query in stub_api_server.requests_seen]
+    assert endpoints == ["listings", "quotes", "quotes", "listings", "quotes"]
+    assert stub_api_server.requests_seen[1]["id"] == ["1,1027"]
+    assert len(pd.read_csv(mock_universe_file)) == 3
+    assert len(list(mock_pricing_data_dir.glob("*.csv"))) == 4
+    assert pd.read_csv(sorted(mock_pricing_data_dir.glob("*.csv"))[-1])["symbol"].tolist() == ["BTC", "ETH"]
+
+
+def test_fan_out_quotes(stub_api_server, mock_coin_universe_response, mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path):
+    """Checking quote ticks use the fan-out currencies and keys, and a tracked id missing from quotes falls back to the full listing"""
+    stub_api_server.coins = mock_coin_universe_response
+    run_process_args = (stub_api_server.url, {}, mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path)
+    with closing(ApiKeyPool(["key-a", "key-b"])) as key_pool:
+        options = RunOptions(
+            session=key_pool,
+            quote_fetcher=TrackedQuoteFetcher(stub_api_server.quotes_url, universe_refresh_seconds=3600),
+            fan_out_fetcher=FanOutFetcher(stub_api_server.url, {}, ["EUR", "USD"], key_pool=key_pool),
+        )
+        run_process(*run_process_args, options)
+        api_response, full_listing = fetch_coins(*run_process_args[:2], mock_coins_to_track_file, options)
+        assert not full_listing
+        assert {currency: [coin["id"] for coin in coins] for currency, coins in api_response.items()} == {"EUR": [1, 1027], "USD": [1, 1027]}
+        assert sorted(query["convert"][0] for query in stub_api_server.requests_seen if "id" in query) == ["EUR", "USD"]
+        assert sorted(set(stub_api_server.api_keys_seen)) == ["key-a", "key-b"]
+
+        stub_api_server.coins = mock_coin_universe_response[1:]
+        api_response, full_listing = fetch_coins(*run_process_args[:2], mock_coins_to_track_file, options)
+
+    assert full_listing
+    assert [coin["id"] for coin in api_response["USD"]] == [1027]
+    assert options.quote_fetcher.refreshed_at is None
+
+
+def test_run_pipeline_async(mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path, mock_history_store_file, mock_coin_universe_response):
+    """Checking the next fetch overlaps a slow history update and every cycle still lands in the history store"""
+    fetch_times = []
+    history_times = []
+
+    def fake_api_response(*args, **kwargs):
+        fetch_times.append(time.monotonic())
+        return mock_coin_universe_response
+
+    def slow_update_average_difference(*args, **kwargs):
+        time.sleep(0.2)
+        history_times.append(time.monotonic())
+        return update_average_difference(*args, **kwargs)
+
+    with patch("tracker.pipeline.get_api_response", side_effect=fake_api_response), patch(
+        "tracker.pipeline.update_average_difference", side_effect=slow_update_average_difference
+    ):
+        history_store = asyncio.run(
+            run_pipeline_async(
+                "https://example.com/listings/latest",
+                {},
+                mock_universe_file,
+                mock_coins_to_track_file,
+                mock_pricing_data_dir,
+                mock_analysis_save_path,
+                RunOptions(history_store_file=mock_history_store_file),
+                cycles=3,
+            )
+        )
+
+    assert len(fetch_times) == 3
+    assert fetch_times[1] < history_times[0]
+    assert len(list(mock_pricing_data_dir.glob("*.csv"))) == 3
+    assert len(history_store["ingested_files"]) == 3
+    assert load_history_store(mock_history_store_file) == history_store
+    assert pd.read_csv(mock_analysis_save_path)["symbol"].tolist() == ["ETH"]
+
+
+def test_run_pipeline_async_options(stub_api_server, mock_coin_universe_response, mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path, mock_history_store_file):
+    """Checking the async pipeline honours quote ticks and rolling statistics, and rejects stage metrics"""
+    stub_api_server.coins = mock_coin_universe_response
+    options = RunOptions(
+        history_store_file=mock_history_store_file,
+        quote_fetcher=TrackedQuoteFetcher(stub_api_server.quotes_url, universe_refresh_seconds=3600),
+        rolling_statistics=RollingStatistics(window=5),
+    )
+    run_process_args = (stub_api_server.url, {}, mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path)
+    history_store = asyncio.run(run_pipeline_async(*run_process_args, options, cycles=3))
+
+    endpoints = ["quotes" if "id" in query else "listings" for query in stub_api_server.requests_seen]
+    assert endpoints == ["listings", "quotes", "quotes"]
+    assert options.rolling_statistics.runs_seen == 3
+    assert len(history_store["ingested_files"]) == 3
+
+    try:
+        asyncio.run(run_pipeline_async(*run_process_args, RunOptions(metrics=PipelineMetrics())))
+        assert False
+    except ValueError:
+        assert True
+    try:
+        main(["run", "--async", "--metrics-log", "stages.jsonl"])
+        assert False
+    except SystemExit:
+        assert True
+
+
+def test_run_process_streaming(stub_api_server, mock_coin_universe_response, mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path):
+    """Checking the streaming path feeds pricing and analysis with the tracked coins"""
+    stub_api_server.coins = mock_coin_universe_response
+    run_process(stub_api_server.url, {}, mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path, RunOptions(stream=True))
+    assert len(pd.read_csv(mock_universe_file)) == 2
+    assert len(list(mock_pricing_data_dir.glob("*.csv"))) == 1
+    assert pd.read_csv(mock_analysis_save_path)["symbol"].tolist() == ["ETH"]
+
+    # Options the streamed universe can't honour are refused instead of ignored
+    try:
+        run_process(stub_api_server.url, {}, mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path, RunOptions(stream=True, universe_reference_file=mock_universe_file.with_name("coin_reference.csv")))
+        assert False
+    except ValueError:
+        assert True
+
+
+def test_run_process_metrics(stub_api_server, mock_coin_universe_response, mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path, tmp_path, capsys):
+    """Checking every stage is measured, logged as JSON and written to the Prometheus textfile"""
+    stub_api_server.coins = mock_coin_universe_response
+    metrics = PipelineMetrics(log_path=tmp_path / "stages.jsonl", textfile_path=tmp_path / "crypto_tracker.prom", trace_memory=True)
+    run_process(stub_api_server.url, {}, mock_universe_file, mock_coins_to_track_file, mock_pricing_data_dir, mock_analysis_save_path, RunOptions(metrics=metrics))
+
+    stages = [record["stage"] for record in metrics.records]
+    assert stages == ["fetch", "universe", "pricing", "analysis", "history", "total"]
+    universe_record = metrics.records[1]
+    assert universe_record["rows"] == 2
+    assert universe_record["bytes"] == mock_universe_file.stat().st_size
+    assert universe_record["wall_seconds"] > 0
+    assert universe_record["cpu_seconds"] >= 0
+    assert universe_record["tracemalloc_peak_bytes"] > 0
+
+    logged = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{"event": "pipeline_stage"')]
+    assert [record["stage"] for record in logged] == stages
+    assert len((tmp_path / "stages.jsonl").read_text().splitlines()) == len(stages)
+    textfile = (tmp_path / "crypto_tracker.prom").read_text()
+    assert 'crypto_tracker_stage_wall_seconds{stage="fetch"}' in textfile
+    assert 'crypto_tracker_stage_rows{stage="pricing"} 2' in textfile
+
+
+def test_load_config(tmp_path):
+    """Checking environment variables override the config file, which overrides the defaults"""
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"page_size": 100, "file_format": "parquet", "api_key": "from-file"}))
+    config = load_config(config_path, {"CRYPTO_TRACKER_PAGE_SIZE": "200", "CRYPTO_TRACKER_PARTITION_BY_DATE": "false", "CMC_API_KEY": "from-env"})
+    assert config["page_size"] == 200
+    assert config["file_format"] == "parquet"
+    assert config["partition_by_date"] is False
+    assert config["api_key"] == "from-env"
+    assert config["requests_per_minute"] == 30
+    assert config["credits_per_minute"] == 0
+
+    config_path.write_text(json.dumps({"page_sise": 100}))
+    try:
+        load_config(config_path, {})
+        assert False
+    except ValueError:
+        assert True
+
+
+def test_cli_commands(mock_coin_universe_response, tmp_path, monkeypatch, capsys):
+    """Checking analyze, averages and health work off the files a fetch leaves in data_dir"""
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"data_dir": str(tmp_path), "partition_by_date": False}))
+    monkeypatch.setenv("CMC_API_KEY", "test-key")
+    assert main(["analyze", "--config", str(config_path)]) == 1
+
+    pd.DataFrame({"Symbol": ["BTC", "ETH"]}).to_csv(tmp_path / "coins_to_track.csv", index=False)
+    (tmp_path / "pricing_data").mkdir()
+    with patch("tracker.cli.get_api_response_paginated", return_value=mock_coin_universe_response):
+        assert main(["fetch", "--config", str(config_path)]) == 0
+    assert {"name", "symbol", "slug", "tags"} <= set(pd.read_csv(tmp_path / "coin_universe.csv").columns)
+    assert not (tmp_path / "coin_reference.csv").exists()
+
+    assert main(["analyze", "--config", str(config_path)]) == 0
+    assert pd.read_csv(tmp_path / "bitcoin_relationship.csv")["symbol"].tolist() == ["ETH"]
+    assert main(["averages", "--config", str(config_path)]) == 0
+    assert len(load_history_store(tmp_path / "pricing_history_store.json")["ingested_files"]) == 1
+
+    capsys.readouterr()
+    assert main(["health", "--config", str(config_path), "--max-age", "3600"]) == 0
+    assert json.loads(capsys.readouterr().out)["checks"]["last_run_fresh"] is True
+
+
+def test_cli_run_closes_client(stub_api_server, mock_coin_universe_response, tmp_path, monkeypatch, capsys):
+    """Checking `run` goes through every part against the configured API and closes its client"""
+    stub_api_server.coins = mock_coin_universe_response
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps({"data_dir": str(tmp_path), "api_url": stub_api_server.url, "partition_by_date": False}))
+    monkeypatch.setenv("CMC_API_KEY", "test-key")
+    pd.DataFrame({"Symbol": ["BTC", "ETH"]}).to_csv(tmp_path / "coins_to_track.csv", index=False)
+
+    with patch.object(ApiClient, "close", autospec=True) as mock_close:
+        assert main(["run", "--config", str(config_path)]) == 0
+
+    assert mock_close.call_count == 1
+    assert pd.read_csv(tmp_path / "bitcoin_relationship.csv")["symbol"].tolist() == ["ETH"]
+    assert len(load_history_store(tmp_path / "pricing_history_store.json")["ingested_files"]) == 1
+
+    # Rolling statistics carry on from the state saved by the previous run
+    monkeypatch.setenv("CRYPTO_TRACKER_ROLLING_WINDOW", "5")
+    monkeypatch.setenv("CRYPTO_TRACKER_UNIVERSE_SNAPSHOTS", "3")
+    for _ in range(2):
+        assert main(["run", "--config", str(config_path)]) == 0
+    assert load_rolling_statistics(tmp_path / "rolling_statistics.json", window=5).runs_seen == 2
+    assert "percent_change_24h across the last 1 universe snapshots" in capsys.readouterr().out
+
+
+def test_cli_health_skips_heavy_imports(tmp_path):
+    """Checking importing the module and running health never imports pandas or requests"""
+    code = "import sys, crypto_tracker; crypto_tracker.main(['health']); print('pandas' in sys.modules, 'requests' in sys.modules)"
+    env = {**os.environ, "CRYPTO_TRACKER_DATA_DIR": str(tmp_path)}
+    result = subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).resolve().parents[1], env=env, capture_output=True, text=True)
+    assert result.stdout.splitlines()[-1] == "False False"
@@ -0,0 +1 @@
+"""CoinMarketCap price tracker. crypto_tracker.py is the entry point and re-exports the public functions."""
@@ -0,0 +1,78 @@
+"""Part 3: each run's relationship between bitcoin (or other reference coins) and the tracked coins."""
+from __future__ import annotations
+
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+from tracker.lazy import pd
+from tracker.storage import save_table
+
+
+# Part 3: You should use the data you’ve loaded to produce a csv that tracks the relationship
+# between bitcoin and the coins we are analyzing. The csv should have these columns:
+#       a. Timestamp of the analysis.
+#       b. The difference in 24H percent change between bitcoin and the currency we’re
+#          evaluating.
+#       c. Sorted from smallest difference to largest.
+def analyze_relationships(
+    df_pricing: pd.DataFrame,
+    reference_symbols: List[str],
+    layout: str = "long",
+    save_path: Optional[Path] = None,
+) -> pd.DataFrame:
+    """Compare every coin's 24H percent change against one or more reference coins, in a long or wide layout."""
+    if layout not in ("long", "wide"):
+        raise ValueError(f"Unsupported layout {layout}. Expected 'long' or 'wide'")
+    first_rows = df_pricing.drop_duplicates(subset="symbol").set_index("symbol")["percent_change_24h"]
+    missing_symbols = [symbol for symbol in reference_symbols if symbol not in first_rows.index]
+    if missing_symbols:
+        raise ValueError(f"Reference coins not found in pricing data: {missing_symbols}")
+
+    analysis_time = datetime.now().isoformat()
+    symbols = df_pricing["symbol"].to_numpy(dtype=object)
+    names = df_pricing["name"].to_numpy(dtype=object)
+    reference_changes = first_rows.loc[reference_symbols].to_numpy(dtype="float64")
+    diffs = df_pricing["percent_change_24h"].to_numpy(dtype="float64")[:, None] - reference_changes[None, :]
+    is_self = symbols[:, None] == pd.Index(reference_symbols).to_numpy(dtype=object)[None, :]
+
+    if layout == "wide":
+        diffs[is_self] = float("nan")
+        df_results = pd.DataFrame(
+            diffs, columns=[f"diff_vs_{symbol}" for symbol in reference_symbols]
+        )
+        df_results.insert(0, "timestamp", analysis_time)
+        df_results.insert(1, "symbol", symbols)
+        df_results.insert(2, "name", names)
+        df_results = df_results.sort_values(by=f"diff_vs_{reference_symbols[0]}")
+    else:
+        n_references = len(reference_symbols)
+        df_results = pd.DataFrame(
+            {
+                "timestamp": analysis_time,
+                "reference_symbol": list(reference_symbols) * len(symbols),
+                "symbol": symbols.repeat(n_references),
+                "name": names.repeat(n_references),
+                "percent_change_diff": diffs.ravel(),
+            }
+        )[~is_self.ravel()]
+        df_results = df_results.sort_values(by=["reference_symbol", "percent_change_diff"])
+
+    df_results = df_results.reset_index(drop=True)
+    if save_path is not None:
+        save_table(df_results, save_path)
+        print(f"Relationship analysis saved to {save_path}")
+    return df_results
+
+
+def analyze_bitcoin_relationship(
+    df_pricing: pd.DataFrame, save_path: Path
+) -> pd.DataFrame:
+    """Analyze the relationship between bitcoin and other coins."""
+    if not (df_pricing["symbol"] == "BTC").any():
+        raise ValueError
+
+    df_results = analyze_relationships(df_pricing, ["BTC"]).drop(columns="reference_symbol")
+    save_table(df_results, save_path)
+    print(f"Bitcoin relationship analysis saved to {save_path}")
+    return df_results
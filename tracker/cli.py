@@ -0,0 +1,352 @@
+"""Command line interface: layered config and one subcommand per part of the tracker."""
+from __future__ import annotations
+
+import argparse
+from contextlib import closing
+import cProfile
+from datetime import datetime, timedelta
+import json
+import os
+from pathlib import Path
+import sys
+from typing import Any, Dict, List, Optional
+
+from tracker.analysis import analyze_bitcoin_relationship
+from tracker.fetch import ApiKeyPool, FanOutFetcher, ResponseCache, TrackedQuoteFetcher, get_api_response_paginated
+from tracker.history import load_rolling_statistics, update_average_difference
+from tracker.pipeline import PipelineMetrics, RunOptions, run_daemon, run_pipeline_async, run_process
+from tracker.pricing import get_pricing_data
+from tracker.storage import (
+    PRICING_DATABASE_NAME,
+    PRICING_VALIDATION_LEVELS,
+    SEGMENT_SUFFIXES,
+    compact_pricing_files,
+    get_pricing_dfs,
+    get_pricing_file_runtime,
+    list_pricing_files,
+    read_table,
+)
+from tracker.universe import UniverseSnapshots, get_coin_universe, save_coin_universe
+
+
+# CLI: config is layered defaults < JSON config file < environment variables
+DEFAULT_CONFIG = {
+    "api_url": "https://pro-api.coinmarketcap.com/v1/cryptocurrency/listings/latest",
+    "api_key": None,
+    "requests_per_minute": 30,  # Basic plan rate limit, per API key
+    "credits_per_minute": 0,  # With N > 0, also cap the credits spent per minute and key (a 5000-coin page costs 25)
+    "cache_ttl_seconds": 60,  # Listings refresh about once a minute, so jobs within that window can share a response
+    "data_dir": str(Path(__file__).parent.parent),
+    "page_size": 5000,  # CoinMarketCap's maximum listing page size
+    "file_format": "csv",  # "parquet" or "feather" for typed, columnar pricing files (requires pyarrow), "sqlite" for one indexed database
+    "partition_by_date": True,  # Write pricing files into pricing_data/date=YYYY-MM-DD/ so date ranges only open their partitions
+    "symbol_collisions": "highest_rank",  # Or "all" / "error" for tracked symbols shared by several coins
+    "quotes_url": "https://pro-api.coinmarketcap.com/v1/cryptocurrency/quotes/latest",
+    "universe_refresh_seconds": 0,  # With N > 0, fetch the full listing every N seconds and only the tracked coins' quotes in between
+    "convert": "USD",  # Comma separated quote currencies, each fetched as its own concurrent request
+    "api_keys": None,  # Comma separated extra API keys; requests are spread over them, each with its own credit budget
+    "split_universe_reference": False,  # Keep static coin fields in coin_reference.csv and only market data in coin_universe.csv
+    "stream_universe": False,  # Parse and write the listing in batches as it downloads. Not with convert currencies, api_keys, universe_refresh_seconds or split_universe_reference
+    "universe_snapshots": 0,  # With N > 0, keep the last N universes in memory (compact, prices at full precision) and compare them at the end
+    "rolling_window": 0,  # With N > 0, keep rolling statistics vs. bitcoin over the last N runs in rolling_statistics.json
+}
+CONFIG_ENV_PREFIX = "CRYPTO_TRACKER_"
+API_KEY_ENV = "CMC_API_KEY"
+CLI_COMMANDS = ["run", "fetch", "analyze", "averages", "compact", "health"]
+
+
+def parse_config_value(key: str, value: str) -> Any:
+    """Helper function to cast an environment variable to the type of the config default it overrides."""
+    default = DEFAULT_CONFIG[key]
+    if isinstance(default, bool):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(value)
+    return value
+
+
+def load_config(config_path: Optional[Path] = None, environ: Optional[Dict[str, str]] = None) -> Dict:
+    """Helper function to layer the defaults, a JSON config file and CRYPTO_TRACKER_<KEY> environment variables."""
+    environ = os.environ if environ is None else environ
+    config = dict(DEFAULT_CONFIG)
+    config_path = config_path or environ.get(f"{CONFIG_ENV_PREFIX}CONFIG")
+    if config_path:
+        with open(config_path, "r") as f:
+            file_config = json.load(f)
+        unknown_keys = set(file_config) - set(DEFAULT_CONFIG)
+        if unknown_keys:
+            raise ValueError(f"Unknown config keys in {config_path}: {sorted(unknown_keys)}")
+        config.update(file_config)
+    for key in DEFAULT_CONFIG:
+        env_name = f"{CONFIG_ENV_PREFIX}{key.upper()}"
+        if env_name in environ:
+            config[key] = parse_config_value(key, environ[env_name])
+    if environ.get(API_KEY_ENV):
+        config["api_key"] = environ[API_KEY_ENV]
+    if not config["api_key"] and Path("secrets.json").exists():
+        with open("secrets.json", "r") as f:
+            config["api_key"] = json.load(f)["api_key"]
+    return config
+
+
+def parse_list_setting(value: Any) -> List[str]:
+    """Helper function to read a list setting given as a JSON list or as a comma separated string."""
+    if not value:
+        return []
+    items = value.split(",") if isinstance(value, str) else value
+    return [item.strip() for item in items if item.strip()]
+
+
+def get_key_pool(config: Dict) -> ApiKeyPool:
+    """Helper function to build the one ApiKeyPool every request of a command goes through, api_key first."""
+    api_keys = [config["api_key"], *parse_list_setting(config["api_keys"])]
+    return ApiKeyPool(api_keys, config["credits_per_minute"] or None, config["requests_per_minute"] or None)
+
+
+def get_fan_out_fetcher(config: Dict, headers: Dict, key_pool: ApiKeyPool) -> Optional[FanOutFetcher]:
+    """Helper function to build a FanOutFetcher when the config asks for other currencies than USD or several API keys."""
+    currencies = parse_list_setting(config["convert"]) or ["USD"]
+    if "USD" not in currencies:
+        raise ValueError(f"convert must include USD, which percent_change_24h is taken from for Parts 3 and 4, got {currencies}")
+    if currencies == ["USD"] and len(key_pool.clients) == 1:
+        return None
+    return FanOutFetcher(config["api_url"], headers, currencies, page_size=config["page_size"], key_pool=key_pool)
+
+
+def get_config_paths(config: Dict) -> Dict[str, Optional[Path]]:
+    """Helper function to lay out the tracker's input and output files under the configured data_dir."""
+    data_dir = Path(config["data_dir"])
+    return {
+        "coins_to_track": data_dir / "coins_to_track.csv",
+        "universe": data_dir / "coin_universe.csv",
+        "universe_reference": data_dir / "coin_reference.csv" if config["split_universe_reference"] else None,
+        "pricing_data_dir": data_dir / "pricing_data",
+        "analysis": data_dir / "bitcoin_relationship.csv",
+        "history_store": data_dir / "pricing_history_store.json",
+        "rolling_statistics": data_dir / "rolling_statistics.json",
+        "api_cache_dir": data_dir / ".api_cache",
+    }
+
+
+def get_api_headers(config: Dict) -> Dict:
+    """Helper function to build the CoinMarketCap request headers, failing early when no key is configured."""
+    if not config["api_key"]:
+        raise ValueError(f"No API key configured. Set ${API_KEY_ENV}, api_key in the config file or secrets.json")
+    return {
+        "Accepts": "application/json",
+        "X-CMC_PRO_API_KEY": config["api_key"],
+    }
+
+
+def command_run(args: argparse.Namespace, config: Dict) -> int:
+    """Run all four parts once, or every --interval seconds."""
+    paths = get_config_paths(config)
+    headers = get_api_headers(config)
+    paths["pricing_data_dir"].mkdir(parents=True, exist_ok=True)
+
+    cache_ttl_seconds = config["cache_ttl_seconds"]
+    if args.interval is not None:
+        # Each tick must fetch a new listing, so a cached one has to expire well before the next tick
+        cache_ttl_seconds = min(cache_ttl_seconds, args.interval / 2)
+    cache = ResponseCache(ttl_seconds=cache_ttl_seconds, cache_dir=paths["api_cache_dir"])
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+
+    run_process_args = (
+        config["api_url"],
+        headers,
+        paths["universe"],
+        paths["coins_to_track"],
+        paths["pricing_data_dir"],
+        paths["analysis"],
+    )
+    with closing(get_key_pool(config)) as key_pool:
+        options = RunOptions(
+            history_store_file=paths["history_store"],
+            file_format=config["file_format"],
+            page_size=config["page_size"],
+            partition_by_date=config["partition_by_date"],
+            universe_reference_file=paths["universe_reference"],
+            symbol_collisions=config["symbol_collisions"],
+            stream=config["stream_universe"],
+            session=key_pool,
+            cache=cache,
+            fan_out_fetcher=get_fan_out_fetcher(config, headers, key_pool),
+        )
+        if config["universe_refresh_seconds"] > 0:
+            options.quote_fetcher = TrackedQuoteFetcher(config["quotes_url"], config["universe_refresh_seconds"])
+        if config["universe_snapshots"] > 0:
+            options.universe_snapshots = UniverseSnapshots(max_snapshots=config["universe_snapshots"])
+        if config["rolling_window"] > 0:
+            options.rolling_statistics = load_rolling_statistics(paths["rolling_statistics"], config["rolling_window"])
+            options.rolling_statistics_file = paths["rolling_statistics"]
+        if args.use_async:
+            import asyncio
+
+            cycles = 1 if args.interval is None else None
+            asyncio.run(run_pipeline_async(*run_process_args, options=options, cycles=cycles, interval_seconds=args.interval or 0.0))
+        else:
+            options.metrics = PipelineMetrics(args.metrics_log, args.metrics_textfile, args.trace_memory)
+            if args.interval is None:
+                run_process(*run_process_args, options=options)
+            else:
+                run_daemon(args.interval, *run_process_args, options=options)
+
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print(f"Profile saved to {args.profile}. Inspect it with: python -m pstats {args.profile}")
+        print(f"API client metrics per key: {key_pool.metrics_summary()}")
+        if options.fan_out_fetcher is not None:
+            print(f"Fan-out requests: {options.fan_out_fetcher.request_log}")
+        print(f"API cache stats: {cache.stats()}")
+        if options.universe_snapshots is not None:
+            print(f"percent_change_24h across the last {len(options.universe_snapshots.snapshots)} universe snapshots:")
+            print(options.universe_snapshots.compare("percent_change_24h"))
+            print(options.universe_snapshots.memory_report())
+    return 0
+
+
+def command_fetch(args: argparse.Namespace, config: Dict) -> int:
+    """Parts 1 and 2 only: fetch the listing, save the universe and this run's pricing file."""
+    paths = get_config_paths(config)
+    headers = get_api_headers(config)
+    paths["pricing_data_dir"].mkdir(parents=True, exist_ok=True)
+
+    cache = ResponseCache(ttl_seconds=config["cache_ttl_seconds"], cache_dir=paths["api_cache_dir"])
+    with closing(get_key_pool(config)) as key_pool:
+        fan_out_fetcher = get_fan_out_fetcher(config, headers, key_pool)
+        if fan_out_fetcher is not None:
+            df_universe = fan_out_fetcher.build_universe(fan_out_fetcher.fetch(cache=cache))
+        else:
+            api_response = get_api_response_paginated(config["api_url"], headers, config["page_size"], session=key_pool, cache=cache)
+    if fan_out_fetcher is not None:
+        save_coin_universe(df_universe, paths["universe"], paths["universe_reference"])
+    else:
+        df_universe = get_coin_universe(api_response, paths["universe"], reference_path=paths["universe_reference"])
+    get_pricing_data(paths["coins_to_track"], df_universe, paths["pricing_data_dir"], config["file_format"], config["partition_by_date"], config["symbol_collisions"])
+    return 0
+
+
+def command_analyze(args: argparse.Namespace, config: Dict) -> int:
+    """Part 3 only, on the latest pricing run already on disk."""
+    paths = get_config_paths(config)
+    file_format = config["file_format"]
+    if file_format == "sqlite":
+        dfs_pricing = get_pricing_dfs(paths["pricing_data_dir"], file_format)
+    else:
+        pricing_files = list_pricing_files(paths["pricing_data_dir"], file_format)
+        dfs_pricing = [read_table(pricing_files[-1], file_format)] if pricing_files else []
+    if not dfs_pricing:
+        print(f"No pricing runs found in {paths['pricing_data_dir']}. Run `fetch` first.")
+        return 1
+    print(analyze_bitcoin_relationship(dfs_pricing[-1], paths["analysis"]))
+    return 0
+
+
+def command_averages(args: argparse.Namespace, config: Dict) -> int:
+    """Part 4 only: average 24H percent change vs. bitcoin over every stored run."""
+    paths = get_config_paths(config)
+    history_store_file = None if args.no_store else paths["history_store"]
+    validate = None if args.validate == "none" else args.validate
+    update_average_difference(paths["pricing_data_dir"], config["file_format"], history_store_file, workers=args.workers, validate=validate)
+    return 0
+
+
+def command_compact(args: argparse.Namespace, config: Dict) -> int:
+    """Merge pricing files from before the last --keep-days days into one compressed segment per day."""
+    paths = get_config_paths(config)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    before = today - timedelta(days=args.keep_days - 1)
+    segment_files = compact_pricing_files(paths["pricing_data_dir"], config["file_format"], before, args.segment_format)
+    print(f"Wrote {len(segment_files)} segment(s)")
+    return 0
+
+
+def command_health(args: argparse.Namespace, config: Dict) -> int:
+    """Cheap liveness check for cron and container probes. Prints a JSON status and exits 1 when unhealthy."""
+    paths = get_config_paths(config)
+    pricing_data_dir = paths["pricing_data_dir"]
+    last_run = None
+    if config["file_format"] == "sqlite":
+        db_path = pricing_data_dir / PRICING_DATABASE_NAME
+        if db_path.exists():
+            last_run = datetime.fromtimestamp(db_path.stat().st_mtime)
+    elif pricing_data_dir.is_dir():
+        pricing_files = list_pricing_files(pricing_data_dir, config["file_format"])
+        if pricing_files:
+            last_run = get_pricing_file_runtime(pricing_files[-1])
+    last_run_age_seconds = (datetime.now() - last_run).total_seconds() if last_run is not None else None
+
+    checks = {
+        "api_key": bool(config["api_key"]),
+        "coins_to_track": paths["coins_to_track"].exists(),
+        "pricing_data_dir": pricing_data_dir.is_dir(),
+    }
+    if args.max_age is not None:
+        checks["last_run_fresh"] = last_run_age_seconds is not None and last_run_age_seconds <= args.max_age
+    status = {
+        "healthy": all(checks.values()),
+        "checks": checks,
+        "last_run": last_run.isoformat() if last_run is not None else None,
+        "last_run_age_seconds": last_run_age_seconds,
+    }
+    print(json.dumps(status))
+    return 0 if status["healthy"] else 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Helper function to build the CLI. `run` is the default command so `python crypto_tracker.py --interval 60` keeps working."""
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument("--config", type=Path, help=f"JSON config file (default ${CONFIG_ENV_PREFIX}CONFIG). {CONFIG_ENV_PREFIX}<KEY> environment variables override it.")
+
+    parser = argparse.ArgumentParser(description="Track CoinMarketCap prices against bitcoin.")
+    subparsers = parser.add_subparsers(dest="command", metavar="{" + ",".join(CLI_COMMANDS) + "}")
+
+    run_parser = subparsers.add_parser("run", parents=[config_parser], help="Run every part once, or on a schedule (default).")
+    run_parser.add_argument("--interval", type=float, help="Keep running and poll every INTERVAL seconds instead of running once.")
+    run_parser.add_argument("--async", dest="use_async", action="store_true", help="Overlap each fetch with the previous run's writes and history update. Can't be combined with the stage metrics options.")
+    run_parser.add_argument("--metrics-log", type=Path, help="Append per-stage JSON metrics to this file.")
+    run_parser.add_argument("--metrics-textfile", type=Path, help="Write per-stage metrics to this Prometheus textfile.")
+    run_parser.add_argument("--trace-memory", action="store_true", help="Measure each stage's peak Python allocation with tracemalloc.")
+    run_parser.add_argument("--profile", type=Path, help="Dump a cProfile of the run to this file.")
+    run_parser.set_defaults(handler=command_run)
+
+    fetch_parser = subparsers.add_parser("fetch", parents=[config_parser], help="Fetch the listing and save the universe and pricing data.")
+    fetch_parser.set_defaults(handler=command_fetch)
+
+    analyze_parser = subparsers.add_parser("analyze", parents=[config_parser], help="Compare the latest pricing run against bitcoin.")
+    analyze_parser.set_defaults(handler=command_analyze)
+
+    averages_parser = subparsers.add_parser("averages", parents=[config_parser], help="Average 24H percent change vs. bitcoin over every run.")
+    averages_parser.add_argument("--no-store", action="store_true", help="Re-read every pricing file instead of updating the history store.")
+    averages_parser.add_argument("--workers", type=int, help="With --no-store, parse pricing files on this many processes.")
+    averages_parser.add_argument("--validate", choices=PRICING_VALIDATION_LEVELS + ["none"], default="manifest", help="Skip pricing files that fail their run manifest: size only (default), full checksum, or none to read every file.")
+    averages_parser.set_defaults(handler=command_averages)
+
+    compact_parser = subparsers.add_parser("compact", parents=[config_parser], help="Merge older per-run pricing files into compressed daily segments.")
+    compact_parser.add_argument("--keep-days", type=int, default=1, help="Days, counting today, whose runs stay as raw files (default 1: compact everything before today).")
+    compact_parser.add_argument("--segment-format", choices=list(SEGMENT_SUFFIXES), help="Format of the segments (default: file_format).")
+    compact_parser.set_defaults(handler=command_compact)
+
+    health_parser = subparsers.add_parser("health", parents=[config_parser], help="Check config and data freshness without importing pandas.")
+    health_parser.add_argument("--max-age", type=float, help="Unhealthy when the latest pricing run is older than MAX_AGE seconds.")
+    health_parser.set_defaults(handler=command_health)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = build_parser()
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in CLI_COMMANDS + ["-h", "--help"]:
+        argv = ["run", *argv]
+    args = parser.parse_args(argv)
+    if getattr(args, "use_async", False) and (args.metrics_log or args.metrics_textfile or args.trace_memory):
+        parser.error("--async doesn't record stage metrics, drop --metrics-log, --metrics-textfile and --trace-memory")
+    try:
+        config = load_config(args.config)
+        return args.handler(args, config)
+    except (KeyError, ValueError, OSError, ImportError) as e:  # requests' RequestException is an OSError; ImportError is a missing optional extra
+        print(f"{args.command} failed: {e!r}")
+        return 1
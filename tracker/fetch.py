@@ -0,0 +1,605 @@
+"""Fetching from the CoinMarketCap API: the retrying client, the response cache, paginated, streamed and
+quotes/latest requests, and the fetchers run_process can use instead of a single listing call."""
+from __future__ import annotations
+
+import codecs
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from functools import partial
+import hashlib
+import json
+import math
+import os
+from pathlib import Path
+import random
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from tracker.lazy import pd, requests
+from tracker.pricing import load_tracked_coins, select_tracked_coins
+from tracker.universe import build_coin_universe, merge_currency_universes
+
+
+def create_session(pool_size: int = 10) -> requests.Session:
+    """Helper function to build a keep-alive session with a connection pool sized for concurrent fetches."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def parse_retry_after(retry_after: Optional[str]) -> Optional[float]:
+    """Helper function to read a Retry-After header given either in seconds or as an HTTP date."""
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def estimate_credits(params: Optional[dict]) -> int:
+    """Helper function to estimate a call's credits: 1 per 200 listed coins or per 100 quoted ids."""
+    params = params or {}
+    if "id" in params:
+        return max(1, -(-len(str(params["id"]).split(",")) // 100))
+    limit = int(params.get("limit", 100))
+    return max(1, -(-limit // 200))
+
+
+class ApiClient:
+    """Pooled session with retries, jittered backoff and per-minute request and credit budgets, usable wherever a session is."""
+
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        session: Optional[requests.Session] = None,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        credits_per_minute: Optional[int] = None,
+        budget_window_seconds: float = 60.0,
+        pool_size: int = 10,
+        requests_per_minute: Optional[int] = None,
+    ):
+        self.session = session or create_session(pool_size)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.credits_per_minute = credits_per_minute
+        self.requests_per_minute = requests_per_minute  # The API's rate limit counts calls, whatever they cost in credits
+        self.budget_window_seconds = budget_window_seconds
+        self.metrics = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "credits_used": 0,
+            "budget_wait_seconds": 0.0,
+            "status_codes": {},
+        }
+        self.latencies = deque(maxlen=1000)
+        self._credit_log = deque()
+        self._lock = threading.Lock()
+
+    def get(self, url: str, headers: Optional[dict] = None, params: Optional[dict] = None, **kwargs) -> requests.Response:
+        """Send a GET request, retrying transient failures. The response's settle_credits() charges what the call really cost."""
+        credits = estimate_credits(params)
+        for attempt in range(self.max_retries + 1):
+            credit_entry = self._wait_for_credits(credits)
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, headers=headers, params=params, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._record(None, time.monotonic() - start)
+                if attempt == self.max_retries:
+                    self._increment("failures")
+                    raise
+                delay = self._backoff(attempt)
+            else:
+                self._record(response.status_code, time.monotonic() - start)
+                response.settle_credits = partial(self.settle_credits, credit_entry)
+                if response.status_code not in self.RETRY_STATUS_CODES:
+                    return response
+                if attempt == self.max_retries:
+                    self._increment("failures")
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                delay = self._backoff(attempt) if retry_after is None else min(retry_after, self.backoff_max)
+            self._increment("retries")
+            time.sleep(delay)
+
+    def settle_credits(self, credit_entry: List, credit_count: int):
+        """Charge a call's credit_count from its payload in place of the estimate it was let through with."""
+        with self._lock:
+            self.metrics["credits_used"] += credit_count - credit_entry[1]
+            credit_entry[1] = credit_count
+
+    def close(self):
+        self.session.close()
+
+    def metrics_summary(self) -> Dict:
+        """Counters plus latency statistics for the calls made so far."""
+        with self._lock:
+            latencies = sorted(self.latencies)
+            summary = {**self.metrics, "status_codes": dict(self.metrics["status_codes"])}
+        if latencies:
+            summary["latency_mean_seconds"] = sum(latencies) / len(latencies)
+            summary["latency_p50_seconds"] = latencies[len(latencies) // 2]
+            summary["latency_max_seconds"] = latencies[-1]
+        return summary
+
+    def _backoff(self, attempt: int) -> float:
+        # Full jitter keeps concurrent page fetches from retrying in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def _increment(self, metric: str):
+        with self._lock:
+            self.metrics[metric] += 1
+
+    def _record(self, status_code: Optional[int], latency: float):
+        with self._lock:
+            self.metrics["requests"] += 1
+            key = str(status_code) if status_code is not None else "connection_error"
+            self.metrics["status_codes"][key] = self.metrics["status_codes"].get(key, 0) + 1
+            self.latencies.append(latency)
+
+    def _wait_for_credits(self, credits: int) -> List:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._credit_log and now - self._credit_log[0][0] >= self.budget_window_seconds:
+                    self._credit_log.popleft()
+                spent = sum(spent_credits for _, spent_credits in self._credit_log)
+                # A single call over budget is let through on an empty window rather than blocking forever
+                within_credits = self.credits_per_minute is None or spent + credits <= self.credits_per_minute
+                within_requests = self.requests_per_minute is None or len(self._credit_log) < self.requests_per_minute
+                if not self._credit_log or (within_credits and within_requests):
+                    credit_entry = [now, credits]
+                    self._credit_log.append(credit_entry)
+                    self.metrics["credits_used"] += credits
+                    return credit_entry
+                wait = self.budget_window_seconds - (now - self._credit_log[0][0])
+                self.metrics["budget_wait_seconds"] += wait
+            time.sleep(wait)
+
+
+class ResponseCache:
+    """LRU cache of API payloads keyed on URL + params, in memory and optionally on disk, fresh for ttl_seconds."""
+
+    def __init__(self, ttl_seconds: float = 60.0, max_entries: int = 32, cache_dir: Optional[Path] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(api_url: str, params: Optional[dict] = None) -> str:
+        key_source = json.dumps([api_url, sorted((params or {}).items())], default=str)
+        return hashlib.sha256(key_source.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Return a fresh cached payload, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            # Another process may have refreshed the disk entry since it was loaded into memory
+            if (entry is None or time.time() - entry[0] >= self.ttl_seconds) and self.cache_dir is not None:
+                disk_entry = self._read_disk_entry(key)
+                if disk_entry is not None and (entry is None or disk_entry[0] > entry[0]):
+                    entry = disk_entry
+                    self._store(key, entry)
+            if entry is not None and time.time() - entry[0] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: str, payload: Dict):
+        entry = (time.time(), payload)
+        with self._lock:
+            self._store(key, entry)
+            if self.cache_dir is not None:
+                self._write_disk_entry(key, entry)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self._entries)}
+
+    def _store(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _read_disk_entry(self, key: str) -> Optional[tuple]:
+        path = self.cache_dir / f"{key}.json"
+        try:
+            with open(path, "r") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return cached["stored_at"], cached["payload"]
+
+    def _write_disk_entry(self, key: str, entry: tuple):
+        path = self.cache_dir / f"{key}.json"
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"stored_at": entry[0], "payload": entry[1]}, f)
+        os.replace(tmp_path, path)
+        cached_paths = sorted(self.cache_dir.glob("*.json"), key=lambda cached_path: cached_path.stat().st_mtime)
+        for stale_path in cached_paths[: max(0, len(cached_paths) - self.max_entries)]:
+            stale_path.unlink(missing_ok=True)
+
+
+def get_api_payload(api_url: str, headers: dict, params: Optional[dict] = None, session: Optional[requests.Session] = None, cache: Optional[ResponseCache] = None) -> Dict:
+    """Helper function to get the full JSON payload (status and data) of an API call, served from cache when fresh."""
+    if cache is not None:
+        cache_key = ResponseCache.make_key(api_url, params)
+        payload = cache.get(cache_key)
+        if payload is not None:
+            return payload
+    response = (session or requests).get(api_url, headers=headers, params=params)
+    response.raise_for_status()
+    payload = response.json()
+    # ApiClient lets the call through on an estimate; the payload's status says what it really cost
+    credit_count = (payload.get("status") or {}).get("credit_count")
+    if credit_count is not None and hasattr(response, "settle_credits"):
+        response.settle_credits(credit_count)
+    if cache is not None:
+        cache.set(cache_key, payload)
+    return payload
+
+
+def get_api_response(api_url: str, headers: dict, params: Optional[dict] = None, session: Optional[requests.Session] = None, cache: Optional[ResponseCache] = None) -> List[Dict]:
+    """Helper function to seperate API call from API response processing"""
+    data = get_api_payload(api_url, headers, params, session, cache)["data"]
+    return data
+
+
+def get_api_response_paginated(
+    api_url: str,
+    headers: dict,
+    page_size: int = 5000,
+    max_workers: int = 4,
+    params: Optional[dict] = None,
+    session: Optional[requests.Session] = None,
+    cache: Optional[ResponseCache] = None,
+) -> List[Dict]:
+    """Helper function to fetch every page of a listing endpoint with bounded concurrency, merged in cmc_rank order."""
+    owns_session = session is None
+    session = session or ApiClient(pool_size=max_workers)
+
+    def fetch_page(start: int) -> Dict:
+        return get_api_payload(api_url, headers, {**(params or {}), "start": start, "limit": page_size}, session, cache)
+
+    try:
+        first_page = fetch_page(1)
+        pages = [first_page["data"]]
+        total_count = first_page.get("status", {}).get("total_count")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            if total_count is not None:
+                starts = range(1 + page_size, total_count + 1, page_size)
+                pages.extend(page["data"] for page in executor.map(fetch_page, starts))
+            else:
+                next_start = 1 + page_size
+                while len(pages[-1]) == page_size:
+                    starts = range(next_start, next_start + max_workers * page_size, page_size)
+                    for page in executor.map(fetch_page, starts):
+                        pages.append(page["data"])
+                        if len(page["data"]) < page_size:
+                            break
+                    next_start = starts[-1] + page_size
+    finally:
+        if owns_session:
+            session.close()
+
+    # Ranks can shift between page requests, so a coin may show up on two pages
+    coins_by_id = {}
+    for page in pages:
+        for coin in page:
+            coins_by_id.setdefault(coin["id"], coin)
+    return sorted(coins_by_id.values(), key=lambda coin: (coin.get("cmc_rank") is None, coin.get("cmc_rank") or 0))
+
+
+def get_api_quotes(
+    quotes_url: str,
+    headers: dict,
+    ids: List[int],
+    batch_size: int = 100,
+    max_workers: int = 4,
+    params: Optional[dict] = None,
+    session: Optional[requests.Session] = None,
+    cache: Optional[ResponseCache] = None,
+) -> List[Dict]:
+    """Helper function to fetch the latest quotes of specific CMC ids, batch_size ids per call, in cmc_rank order."""
+    batches = [ids[i : i + batch_size] for i in range(0, len(ids), batch_size)]
+
+    def fetch_batch(batch: List[int]) -> Dict:
+        return get_api_payload(quotes_url, headers, {**(params or {}), "id": ",".join(map(str, batch))}, session, cache)["data"]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        batches_data = list(executor.map(fetch_batch, batches))
+
+    coins_by_id = {}
+    for data in batches_data:
+        # Coins are keyed by id; symbol lookups on the v2 endpoint map each key to a list of coins instead
+        for value in data.values():
+            for coin in value if isinstance(value, list) else [value]:
+                coins_by_id.setdefault(coin["id"], coin)
+    return sorted(coins_by_id.values(), key=lambda coin: coin.get("cmc_rank") or math.inf)
+
+
+class ApiKeyPool:
+    """Session stand-in that sends each request with the next API key in turn, through that key's own ApiClient and budget."""
+
+    def __init__(self, api_keys: Optional[List[str]] = None, credits_per_minute: Optional[int] = None, requests_per_minute: Optional[int] = None):
+        # None keeps whatever key the request's headers carry
+        self.api_keys = list(dict.fromkeys(api_keys or [])) or [None]
+        self.clients = [ApiClient(credits_per_minute=credits_per_minute, requests_per_minute=requests_per_minute) for _ in self.api_keys]
+        self._cursor = 0
+        self._lock = threading.Lock()
+
+    def get(self, url: str, headers: Optional[dict] = None, **kwargs) -> requests.Response:
+        return self.get_with_key(url, headers, **kwargs)[1]
+
+    def get_with_key(self, url: str, headers: Optional[dict] = None, **kwargs) -> Tuple[int, requests.Response]:
+        """Send a GET request with the next key. Returns the key's position along with the response."""
+        with self._lock:
+            key_number = self._cursor
+            self._cursor = (self._cursor + 1) % len(self.clients)
+        api_key = self.api_keys[key_number]
+        if api_key is not None:
+            headers = {**(headers or {}), "X-CMC_PRO_API_KEY": api_key}
+        return key_number, self.clients[key_number].get(url, headers=headers, **kwargs)
+
+    def metrics_summary(self) -> List[Dict]:
+        return [client.metrics_summary() for client in self.clients]
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+
+
+class KeyTrackingSession:
+    """Session stand-in over an ApiKeyPool that records the position of every key its requests go out with."""
+
+    def __init__(self, key_pool: ApiKeyPool):
+        self.key_pool = key_pool
+        self.keys: List[int] = []
+
+    def get(self, url: str, headers: Optional[dict] = None, **kwargs) -> requests.Response:
+        key_number, response = self.key_pool.get_with_key(url, headers, **kwargs)
+        self.keys.append(key_number)
+        return response
+
+
+class FanOutFetcher:
+    """Fetches the listing in several convert currencies concurrently, spreading every request over an ApiKeyPool."""
+
+    def __init__(
+        self,
+        api_url: str,
+        headers: dict,
+        currencies: List[str],
+        api_keys: Optional[List[str]] = None,
+        credits_per_minute: Optional[int] = None,
+        page_size: Optional[int] = None,
+        key_pool: Optional[ApiKeyPool] = None,
+    ):
+        self.api_url = api_url
+        self.headers = dict(headers)
+        self.currencies = list(currencies)
+        self.page_size = page_size
+        self.owns_key_pool = key_pool is None
+        self.key_pool = key_pool or ApiKeyPool(api_keys, credits_per_minute)
+        self.request_log: List[Dict] = []
+
+    def fetch(self, params: Optional[dict] = None, cache: Optional[ResponseCache] = None) -> Dict[str, List[Dict]]:
+        """Fetch every currency's listing at once. Returns the coins per currency."""
+
+        def fetch_currency(currency: str) -> Tuple[List[Dict], Dict]:
+            request_params = {**(params or {}), "convert": currency}
+            start = time.monotonic()
+            session = KeyTrackingSession(self.key_pool)
+            if self.page_size is None:
+                coins = get_api_response(self.api_url, self.headers, request_params, session, cache)
+            else:
+                coins = get_api_response_paginated(self.api_url, self.headers, self.page_size, params=request_params, session=session, cache=cache)
+            # Keys are logged by position so they never end up in logs
+            return coins, {"currency": currency, "keys": sorted(set(session.keys)), "seconds": time.monotonic() - start, "rows": len(coins)}
+
+        with ThreadPoolExecutor(max_workers=len(self.currencies)) as executor:
+            results = list(executor.map(fetch_currency, self.currencies))
+        self.request_log = [request for _, request in results]
+        for request in self.request_log:
+            keys = ", ".join(f"#{key}" for key in request["keys"]) or "none (cached)"
+            print(f"Fetched {request['rows']} coins in {request['currency']} with API key {keys} in {request['seconds']:.3f}s")
+        return {currency: coins for currency, (coins, _) in zip(self.currencies, results)}
+
+    def build_universe(self, responses: Dict[str, List[Dict]]) -> pd.DataFrame:
+        """Build one universe with quote columns for every currency out of fetch()'s listings."""
+        return merge_currency_universes({currency: build_coin_universe(coins, [currency]) for currency, coins in responses.items()})
+
+    def metrics_summary(self) -> Dict:
+        """The last fetch's per-request latencies plus each key's ApiClient metrics."""
+        return {"requests": list(self.request_log), "keys": self.key_pool.metrics_summary()}
+
+    def close(self):
+        if self.owns_key_pool:
+            self.key_pool.close()
+
+
+def iter_json_array(chunks: Iterable[bytes], key: str = "data") -> Iterator[Any]:
+    """Yield the elements of the array under a top level key of a JSON object as the bytes arrive."""
+    decoder = json.JSONDecoder()
+    utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def read_more() -> bool:
+        nonlocal buffer, pos, eof
+        for chunk in chunks:
+            if chunk:
+                buffer = buffer[pos:] + utf8_decoder.decode(chunk)
+                pos = 0
+                return True
+        eof = True
+        buffer = buffer[pos:] + utf8_decoder.decode(b"", final=True)
+        pos = 0
+        return False
+
+    def next_token() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not read_more():
+                raise ValueError("Unexpected end of JSON stream")
+
+    def decode_value() -> Any:
+        # A value at the end of the buffer may be cut off mid-chunk, so wait for more input or EOF
+        nonlocal pos
+        next_token()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                if end < len(buffer) or eof:
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            read_more()
+
+    def expect(token: str):
+        nonlocal pos
+        if next_token() != token:
+            raise ValueError(f"Expected {token!r} in JSON stream, found {buffer[pos]!r}")
+        pos += 1
+
+    expect("{")
+    while next_token() != "}":
+        current_key = decode_value()
+        expect(":")
+        if current_key != key:
+            decode_value()
+        else:
+            expect("[")
+            while next_token() != "]":
+                yield decode_value()
+                if next_token() == ",":
+                    pos += 1
+            pos += 1
+        if next_token() == ",":
+            pos += 1
+
+
+def iter_api_coins(
+    api_url: str,
+    headers: dict,
+    params: Optional[dict] = None,
+    session: Optional[requests.Session] = None,
+    page_size: Optional[int] = None,
+    chunk_size: int = 64 * 1024,
+) -> Iterator[Dict]:
+    """Helper function to stream coins from a listing endpoint one at a time, page by page until a short page."""
+    start = 1
+    seen_ids = set()
+    while True:
+        page_params = dict(params or {})
+        if page_size is not None:
+            page_params.update({"start": start, "limit": page_size})
+        response = (session or requests).get(api_url, headers=headers, params=page_params, stream=True)
+        try:
+            response.raise_for_status()
+            page_count = 0
+            for coin in iter_json_array(response.iter_content(chunk_size=chunk_size), "data"):
+                page_count += 1
+                # Ranks can shift between page requests, so a coin may show up on two pages
+                if coin["id"] not in seen_ids:
+                    seen_ids.add(coin["id"])
+                    yield coin
+        finally:
+            response.close()
+        if page_size is None or page_count < page_size:
+            return
+        start += page_size
+
+
+class TrackedQuoteFetcher:
+    """Fetches only the tracked ids from quotes/latest between full listing refreshes. Reuse one instance across ticks."""
+
+    def __init__(self, quotes_url: str, universe_refresh_seconds: float = 86400, batch_size: int = 100):
+        self.quotes_url = quotes_url
+        self.universe_refresh_seconds = universe_refresh_seconds
+        self.batch_size = batch_size
+        self.tracked_ids: List[int] = []
+        self.tracked_signature = None
+        self.refreshed_at: Optional[float] = None
+
+    def needs_refresh(self, coins_to_track_path: Path) -> bool:
+        """Whether this tick should fetch the full listing: first tick, no tracked ids, refresh interval elapsed or tracked coins changed."""
+        return (
+            self.refreshed_at is None
+            or not self.tracked_ids
+            or time.monotonic() - self.refreshed_at >= self.universe_refresh_seconds
+            or load_tracked_coins(coins_to_track_path)["signature"] != self.tracked_signature
+        )
+
+    def refresh(self, coins_to_track_path: Path, df_universe: pd.DataFrame, symbol_collisions: str = "highest_rank"):
+        """Resolve the tracked ids against a freshly fetched full universe."""
+        df_tracked = select_tracked_coins(coins_to_track_path, df_universe, symbol_collisions)
+        tracked_ids = df_tracked["id"] if "id" in df_tracked.columns else df_tracked.index
+        self.tracked_ids = [int(coin_id) for coin_id in tracked_ids]
+        self.tracked_signature = load_tracked_coins(coins_to_track_path)["signature"]
+        self.refreshed_at = time.monotonic()
+
+    def fetch(
+        self,
+        headers: dict,
+        session: Optional[requests.Session] = None,
+        cache: Optional[ResponseCache] = None,
+        currencies: Optional[List[str]] = None,
+    ) -> Optional[Union[List[Dict], Dict[str, List[Dict]]]]:
+        """Fetch the tracked coins' quotes, per convert currency like FanOutFetcher.fetch when currencies are given. Returns None
+        and forces a full refresh when a tracked id is missing; a failed call forces one next tick, in case a coin was delisted."""
+
+        def fetch_currency(currency: Optional[str]) -> List[Dict]:
+            params = {"convert": currency} if currency is not None else None
+            return get_api_quotes(self.quotes_url, headers, self.tracked_ids, self.batch_size, params=params, session=session, cache=cache)
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(currencies or [None])) as executor:
+                responses = dict(zip(currencies or [None], executor.map(fetch_currency, currencies or [None])))
+        except (requests.exceptions.RequestException, KeyError):
+            self.refreshed_at = None
+            raise
+        for coins in responses.values():
+            missing_ids = set(self.tracked_ids) - {coin["id"] for coin in coins}
+            if missing_ids:
+                print(f"Quotes missing for tracked ids {sorted(missing_ids)}, fetching the full listing instead")
+                self.refreshed_at = None
+                return None
+        return responses if currencies is not None else responses[None]
@@ -0,0 +1,354 @@
+"""Part 4: averages vs. bitcoin across runs, the incremental history store and rolling statistics."""
+from __future__ import annotations
+
+from collections import deque
+from contextlib import closing
+from datetime import datetime
+import json
+import math
+from pathlib import Path
+import sqlite3
+from typing import Dict, List, Optional, Tuple
+
+from tracker.lazy import pd
+from tracker.storage import (
+    PRICING_DATABASE_NAME,
+    PRICING_TABLE,
+    atomic_path,
+    get_pricing_dfs,
+    list_pricing_files,
+    list_segment_files,
+    quote_identifier,
+    read_pricing_manifest,
+    read_segment,
+    read_table,
+)
+
+
+# Part 4: Write a python function to output the average 24H percent change vs bitcoin for each
+# currency over each run by parsing through the files you’ve generated.
+# Part 4 only needs these columns, so columnar formats can skip reading the rest of each file
+AVERAGE_DIFFERENCE_COLUMNS = ["symbol", "percent_change_24h"]
+
+
+def calculate_average_difference(dfs_pricing: List[pd.DataFrame], include_stats: bool = False) -> pd.DataFrame:
+    """Calculate the average 24H percent change difference vs. bitcoin."""
+    all_data = pd.concat(dfs_pricing, ignore_index=True)
+    symbol_changes = all_data.groupby("symbol", sort=False, observed=True)["percent_change_24h"]
+    symbol_means = symbol_changes.mean()
+    if "BTC" not in symbol_means.index:
+        raise ValueError
+
+    bitcoin_change = symbol_means["BTC"]
+    is_not_bitcoin = symbol_means.index != "BTC"
+    df_averages = pd.DataFrame(
+        {
+            "symbol": symbol_means.index[is_not_bitcoin],
+            "average_diff_vs_bitcoin": symbol_means.to_numpy()[is_not_bitcoin] - bitcoin_change,
+        }
+    )
+
+    if include_stats:
+        if "LoadedWhen" not in all_data.columns:
+            raise ValueError("LoadedWhen is needed to align bitcoin per run")
+        is_bitcoin = all_data["symbol"] == "BTC"
+        bitcoin_by_run = all_data[is_bitcoin].groupby("LoadedWhen")["percent_change_24h"].first()
+        aligned_diff = all_data["percent_change_24h"] - all_data["LoadedWhen"].map(bitcoin_by_run)
+        df_stats = (
+            aligned_diff[~is_bitcoin]
+            .groupby(all_data.loc[~is_bitcoin, "symbol"], sort=False, observed=True)
+            .agg(["mean", "median", "std", "count"])
+            .add_prefix("aligned_diff_")
+        )
+        df_averages = df_averages.merge(df_stats, left_on="symbol", right_index=True, how="left")
+
+    print(df_averages)
+    return df_averages
+
+
+def calculate_average_difference_sqlite(db_path: Path, start: Optional[datetime] = None, end: Optional[datetime] = None) -> pd.DataFrame:
+    """Calculate the average 24H percent change difference vs. bitcoin inside SQLite, optionally over a LoadedWhen window."""
+    conditions, params = [], []
+    if start is not None:
+        conditions.append('"LoadedWhen" >= ?')
+        params.append(start.isoformat())
+    if end is not None:
+        conditions.append('"LoadedWhen" <= ?')
+        params.append(end.isoformat())
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    query = f"""
+        SELECT "symbol", AVG("percent_change_24h") AS avg_change
+        FROM {quote_identifier(PRICING_TABLE)}{where}
+        GROUP BY "symbol"
+        ORDER BY MIN(rowid)
+    """
+    with closing(sqlite3.connect(db_path)) as conn:
+        df_means = pd.read_sql_query(query, conn, params=params)
+    is_bitcoin = df_means["symbol"] == "BTC"
+    if not is_bitcoin.any():
+        raise ValueError
+
+    bitcoin_change = df_means.loc[is_bitcoin, "avg_change"].iloc[0]
+    df_averages = pd.DataFrame(
+        {
+            "symbol": df_means.loc[~is_bitcoin, "symbol"].to_numpy(),
+            "average_diff_vs_bitcoin": df_means.loc[~is_bitcoin, "avg_change"].to_numpy() - bitcoin_change,
+        }
+    )
+    print(df_averages)
+    return df_averages
+
+
+# Part 4 (incremental): the history store keeps the ingested file names and a per-symbol sum and count
+def load_history_store(history_store_path: Path) -> Dict:
+    """Helper function to load the history store, or start an empty one on the first run."""
+    if not history_store_path.exists():
+        return {"ingested_files": [], "aggregates": {}}
+    with open(history_store_path, "r") as f:
+        return json.load(f)
+
+
+def save_history_store(history_store: Dict, history_store_path: Path):
+    """Helper function to save the history store. Written atomically so a crash can't truncate it."""
+    with atomic_path(history_store_path) as tmp_path:
+        with open(tmp_path, "w") as f:
+            json.dump(history_store, f)
+    print(f"History store saved to {history_store_path}")
+
+
+def update_history_store(pricing_data_dir: Path, history_store: Dict, file_format: str = "csv", validate: Optional[str] = "manifest") -> Dict:
+    """Ingest pricing files that aren't in the store yet into the running per-symbol aggregates."""
+    ingested_files = set(history_store["ingested_files"])
+    aggregates = history_store["aggregates"]
+
+    def ingest(df_new: pd.DataFrame, ingested_file: str):
+        grouped = df_new.groupby("symbol", sort=False, observed=True)["percent_change_24h"].agg(["sum", "count"])
+        for symbol, change_sum, change_count in zip(grouped.index, grouped["sum"], grouped["count"]):
+            aggregate = aggregates.setdefault(symbol, {"sum": 0.0, "count": 0})
+            aggregate["sum"] += float(change_sum)
+            aggregate["count"] += int(change_count)
+        history_store["ingested_files"].append(ingested_file)
+        ingested_files.add(ingested_file)
+
+    # Segments first, so sources ingested from a segment skip their raw file below
+    ingested_count = 0
+    for segment_file in list_segment_files(pricing_data_dir, validate=validate):
+        segment_name = segment_file.relative_to(pricing_data_dir).as_posix()
+        if segment_name in ingested_files:
+            continue
+        new_sources = set((read_pricing_manifest(segment_file) or {}).get("sources", [])) - ingested_files
+        if new_sources:
+            for source_file, df_run in read_segment(segment_file, AVERAGE_DIFFERENCE_COLUMNS, sources=new_sources):
+                ingest(df_run, source_file)
+                ingested_count += 1
+        history_store["ingested_files"].append(segment_name)
+        ingested_files.add(segment_name)
+
+    new_paths = list_pricing_files(pricing_data_dir, file_format, validate=validate, exclude=ingested_files)
+    for path in new_paths:
+        ingest(read_table(path, file_format, AVERAGE_DIFFERENCE_COLUMNS), path.relative_to(pricing_data_dir).as_posix())
+
+    print(f"Ingested {ingested_count + len(new_paths)} new pricing files into the history store")
+    return history_store
+
+
+def calculate_average_difference_from_store(history_store: Dict) -> pd.DataFrame:
+    """Calculate the average 24H percent change difference vs. bitcoin from the running aggregates."""
+    aggregates = history_store["aggregates"]
+    if aggregates.get("BTC", {"count": 0})["count"] == 0:
+        raise ValueError
+
+    def mean(aggregate: Dict) -> float:
+        return aggregate["sum"] / aggregate["count"] if aggregate["count"] else float("nan")
+
+    bitcoin_change = mean(aggregates["BTC"])
+    df_averages = pd.DataFrame(
+        [
+            {
+                "symbol": symbol,
+                "average_diff_vs_bitcoin": mean(aggregate) - bitcoin_change,
+            }
+            for symbol, aggregate in aggregates.items()
+            if symbol != "BTC"
+        ],
+        columns=["symbol", "average_diff_vs_bitcoin"],
+    )
+    print(df_averages)
+    return df_averages
+
+
+def update_average_difference(
+    pricing_data_dir: Path,
+    file_format: str = "csv",
+    history_store_file: Optional[Path] = None,
+    history_store: Optional[Dict] = None,
+    workers: Optional[int] = None,
+    validate: Optional[str] = "manifest",
+) -> Tuple[pd.DataFrame, Optional[Dict]]:
+    """Helper function to bring Part 4 up to date with sqlite, the history store or a full rescan of the pricing files."""
+    if file_format == "sqlite":
+        return calculate_average_difference_sqlite(pricing_data_dir / PRICING_DATABASE_NAME), history_store
+    if history_store_file is None:
+        dfs_pricing = get_pricing_dfs(pricing_data_dir, file_format, AVERAGE_DIFFERENCE_COLUMNS, workers=workers, validate=validate)
+        return calculate_average_difference(dfs_pricing), history_store
+    if history_store is None:
+        history_store = load_history_store(history_store_file)
+    history_store = update_history_store(pricing_data_dir, history_store, file_format, validate)
+    save_history_store(history_store, history_store_file)
+    return calculate_average_difference_from_store(history_store), history_store
+
+
+class RollingStatistics:
+    """Rolling and time-weighted statistics of each coin vs. bitcoin, updated one run at a time."""
+
+    def __init__(self, window: int = 30, ewma_alpha: float = 0.1):
+        if window < 1:
+            raise ValueError("window must be at least one run")
+        self.window = window
+        self.ewma_alpha = ewma_alpha
+        self.runs_seen = 0
+        self.last_loaded_when = None
+        # symbol -> deque of (run_index, bitcoin_change, coin_change) inside the window
+        self._observations: Dict[str, deque] = {}
+        # symbol -> [count, mean_x, mean_y, m2_x, m2_y, c_xy] with x bitcoin's change and y the coin's. Welford's
+        # updates keep these accurate where raw sums of squares would cancel out on large, close values
+        self._moments: Dict[str, List[float]] = {}
+        self._ewma: Dict[str, float] = {}
+
+    @classmethod
+    def from_history(cls, dfs_pricing: List[pd.DataFrame], window: int = 30, ewma_alpha: float = 0.1) -> "RollingStatistics":
+        """Replay a pricing history run by run (grouped on LoadedWhen) to warm up the windows."""
+        rolling_statistics = cls(window, ewma_alpha)
+        all_data = pd.concat(dfs_pricing, ignore_index=True)
+        for _, df_run in all_data.groupby("LoadedWhen", sort=True):
+            rolling_statistics.update(df_run)
+        return rolling_statistics
+
+    def to_dict(self) -> Dict:
+        """JSON-serialisable state: the windows' observations and the EWMAs. The moments are rebuilt from the windows."""
+        return {
+            "window": self.window,
+            "ewma_alpha": self.ewma_alpha,
+            "runs_seen": self.runs_seen,
+            "last_loaded_when": None if self.last_loaded_when is None else str(self.last_loaded_when),
+            "observations": {symbol: [list(observation) for observation in observations] for symbol, observations in self._observations.items()},
+            "ewma": dict(self._ewma),
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict, window: Optional[int] = None) -> "RollingStatistics":
+        """Restore to_dict()'s state, optionally into a different window size."""
+        rolling_statistics = cls(window or state["window"], state["ewma_alpha"])
+        rolling_statistics.runs_seen = state["runs_seen"]
+        rolling_statistics.last_loaded_when = state["last_loaded_when"]
+        rolling_statistics._ewma = dict(state["ewma"])
+        oldest_run_in_window = rolling_statistics.runs_seen - rolling_statistics.window
+        for symbol in state["ewma"]:
+            rolling_statistics._moments[symbol] = [0, 0.0, 0.0, 0.0, 0.0, 0.0]
+            observations = rolling_statistics._observations[symbol] = deque()
+            for run_index, bitcoin_change, change in state["observations"].get(symbol, []):
+                if run_index >= oldest_run_in_window:
+                    observations.append((run_index, bitcoin_change, change))
+                    rolling_statistics._add(symbol, bitcoin_change, change)
+        return rolling_statistics
+
+    def update(self, df_run: pd.DataFrame):
+        """Add one run's pricing rows (e.g. what get_pricing_data returns) to the windows."""
+        df_run = df_run.drop_duplicates(subset="symbol")
+        is_bitcoin = df_run["symbol"] == "BTC"
+        if not is_bitcoin.any():
+            raise ValueError
+        bitcoin_change = float(df_run.loc[is_bitcoin, "percent_change_24h"].iloc[0])
+        run_index = self.runs_seen
+        self.runs_seen += 1
+        if "LoadedWhen" in df_run.columns:
+            self.last_loaded_when = df_run["LoadedWhen"].iloc[0]
+
+        if not math.isnan(bitcoin_change):
+            for symbol, change in zip(df_run.loc[~is_bitcoin, "symbol"], df_run.loc[~is_bitcoin, "percent_change_24h"]):
+                change = float(change)
+                if math.isnan(change):
+                    continue
+                self._observations.setdefault(symbol, deque()).append((run_index, bitcoin_change, change))
+                self._add(symbol, bitcoin_change, change)
+                diff = change - bitcoin_change
+                previous_ewma = self._ewma.get(symbol)
+                self._ewma[symbol] = diff if previous_ewma is None else self.ewma_alpha * diff + (1 - self.ewma_alpha) * previous_ewma
+
+        oldest_run_in_window = run_index - self.window + 1
+        for symbol, observations in self._observations.items():
+            while observations and observations[0][0] < oldest_run_in_window:
+                _, old_bitcoin_change, old_change = observations.popleft()
+                self._remove(symbol, old_bitcoin_change, old_change)
+
+    def statistics(self) -> pd.DataFrame:
+        """Current value of every statistic per coin. Coins with no runs left in the window get NaN except for the EWMA."""
+        rows = []
+        for symbol, (count, mean_x, mean_y, m2_x, m2_y, c_xy) in self._moments.items():
+            nan = float("nan")
+            mean_diff = mean_y - mean_x if count else nan
+            if count > 1:
+                var_x = max(m2_x, 0.0) / (count - 1)
+                var_y = max(m2_y, 0.0) / (count - 1)
+                cov_xy = c_xy / (count - 1)
+                var_diff = max(var_x + var_y - 2 * cov_xy, 0.0)
+                std_diff = math.sqrt(var_diff)
+                corr = cov_xy / math.sqrt(var_x * var_y) if var_x > 0 and var_y > 0 else nan
+                beta = cov_xy / var_x if var_x > 0 else nan
+            else:
+                std_diff = corr = beta = nan
+            rows.append(
+                {
+                    "symbol": symbol,
+                    "window_count": int(count),
+                    "rolling_mean_diff": mean_diff,
+                    "rolling_std_diff": std_diff,
+                    "ewma_diff": self._ewma.get(symbol, nan),
+                    "rolling_corr_btc": corr,
+                    "rolling_beta_btc": beta,
+                }
+            )
+        return pd.DataFrame(
+            rows,
+            columns=["symbol", "window_count", "rolling_mean_diff", "rolling_std_diff", "ewma_diff", "rolling_corr_btc", "rolling_beta_btc"],
+        )
+
+    def _add(self, symbol: str, x: float, y: float):
+        moments = self._moments.setdefault(symbol, [0, 0.0, 0.0, 0.0, 0.0, 0.0])
+        moments[0] += 1
+        dx = x - moments[1]
+        dy = y - moments[2]
+        moments[1] += dx / moments[0]
+        moments[2] += dy / moments[0]
+        moments[3] += dx * (x - moments[1])
+        moments[4] += dy * (y - moments[2])
+        moments[5] += dx * (y - moments[2])
+
+    def _remove(self, symbol: str, x: float, y: float):
+        moments = self._moments[symbol]
+        if moments[0] <= 1:
+            moments[:] = [0, 0.0, 0.0, 0.0, 0.0, 0.0]
+            return
+        moments[0] -= 1
+        dx = x - moments[1]
+        dy = y - moments[2]
+        moments[1] -= dx / moments[0]
+        moments[2] -= dy / moments[0]
+        moments[3] -= dx * (x - moments[1])
+        moments[4] -= dy * (y - moments[2])
+        moments[5] -= dx * (y - moments[2])
+
+
+def load_rolling_statistics(rolling_statistics_path: Path, window: int = 30, ewma_alpha: float = 0.1) -> RollingStatistics:
+    """Helper function to load the saved rolling statistics, or start empty ones on the first run."""
+    if not rolling_statistics_path.exists():
+        return RollingStatistics(window, ewma_alpha)
+    with open(rolling_statistics_path, "r") as f:
+        return RollingStatistics.from_dict(json.load(f), window)
+
+
+def save_rolling_statistics(rolling_statistics: RollingStatistics, rolling_statistics_path: Path):
+    """Helper function to save the rolling statistics' state. Written atomically like the history store."""
+    with atomic_path(rolling_statistics_path) as tmp_path:
+        with open(tmp_path, "w") as f:
+            json.dump(rolling_statistics.to_dict(), f)
@@ -0,0 +1,20 @@
+"""Lazily imported heavy dependencies shared by the tracker modules."""
+import importlib
+
+
+class LazyModule:
+    """Stand-in for a heavy module that imports it on first attribute access, so CLI commands that never
+    touch pandas or requests (health, --help) don't pay for importing them."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr: str):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+requests = LazyModule("requests")
+pd = LazyModule("pandas")
@@ -0,0 +1,461 @@
+"""run_process and the ways of running it repeatedly: the polling daemon and the asyncio pipeline."""
+from __future__ import annotations
+
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from tracker.analysis import analyze_bitcoin_relationship
+from tracker.fetch import ApiClient, FanOutFetcher, ResponseCache, TrackedQuoteFetcher, get_api_response, get_api_response_paginated, iter_api_coins
+from tracker.history import (
+    AVERAGE_DIFFERENCE_COLUMNS,
+    RollingStatistics,
+    calculate_average_difference,
+    calculate_average_difference_from_store,
+    calculate_average_difference_sqlite,
+    load_history_store,
+    save_history_store,
+    save_rolling_statistics,
+    update_average_difference,
+    update_history_store,
+)
+from tracker.lazy import pd, requests
+from tracker.pricing import build_pricing_data, get_coins_to_track, get_pricing_data, save_pricing_data
+from tracker.storage import PRICING_DATABASE_NAME, get_pricing_dfs
+from tracker.universe import UniverseSnapshots, build_coin_universe, get_coin_universe_streaming, save_coin_universe
+
+
+def file_size(path: Path) -> Optional[int]:
+    """Helper function for the size of a file, or None when it doesn't exist."""
+    try:
+        return path.stat().st_size
+    except OSError:
+        return None
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Helper function for the process's peak resident set size so far (not available on Windows)."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024  # bytes on macOS, kilobytes on Linux
+
+
+@contextmanager
+def null_stage(name: str) -> Iterator[Dict]:
+    """Stand-in for PipelineMetrics.stage when a run isn't instrumented."""
+    yield {"stage": name, "rows": None, "bytes": None}
+
+
+class PipelineMetrics:
+    """Per-stage wall time, CPU time, peak memory, rows and bytes, logged as JSON lines and optionally a Prometheus textfile."""
+
+    def __init__(self, log_path: Optional[Path] = None, textfile_path: Optional[Path] = None, trace_memory: bool = False):
+        self.log_path = log_path
+        self.textfile_path = textfile_path
+        self.trace_memory = trace_memory
+        self.records = []
+        self._run_start = None
+        self._started_tracemalloc = False
+
+    def begin_run(self):
+        self.records = []
+        self._run_start = (time.perf_counter(), time.process_time())
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def end_run(self):
+        wall_start, cpu_start = self._run_start or (time.perf_counter(), time.process_time())
+        self._emit(
+            {
+                "stage": "total",
+                "wall_seconds": time.perf_counter() - wall_start,
+                "cpu_seconds": time.process_time() - cpu_start,
+                "peak_rss_bytes": peak_rss_bytes(),
+                "rows": None,
+                "bytes": None,
+            }
+        )
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        if self.textfile_path is not None:
+            self.write_prometheus_textfile(self.textfile_path)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Dict]:
+        """Measure a block. The block can fill in the yielded record's rows and bytes."""
+        record = {"stage": name, "rows": None, "bytes": None}
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = time.perf_counter() - wall_start
+            record["cpu_seconds"] = time.process_time() - cpu_start
+            record["peak_rss_bytes"] = peak_rss_bytes()
+            if self.trace_memory and tracemalloc.is_tracing():
+                record["tracemalloc_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+            self._emit(record)
+
+    def write_prometheus_textfile(self, textfile_path: Path):
+        """Write the last run's stages as gauges, atomically so the collector never reads half a file."""
+        gauges = {
+            "wall_seconds": "Wall clock seconds spent in the stage",
+            "cpu_seconds": "CPU seconds spent in the stage",
+            "peak_rss_bytes": "Peak resident set size of the process by the end of the stage",
+            "tracemalloc_peak_bytes": "Peak traced Python allocation during the stage",
+            "rows": "Rows processed by the stage",
+            "bytes": "Bytes written by the stage",
+        }
+        lines = []
+        for field, help_text in gauges.items():
+            samples = [record for record in self.records if record.get(field) is not None]
+            if not samples:
+                continue
+            metric_name = f"crypto_tracker_stage_{field}"
+            lines.append(f"# HELP {metric_name} {help_text}")
+            lines.append(f"# TYPE {metric_name} gauge")
+            lines.extend(f'{metric_name}{{stage="{record["stage"]}"}} {record[field]}' for record in samples)
+        tmp_path = textfile_path.with_name(textfile_path.name + ".tmp")
+        tmp_path.write_text("\n".join(lines) + "\n")
+        os.replace(tmp_path, textfile_path)
+
+    def _emit(self, record: Dict):
+        self.records.append(record)
+        log_line = json.dumps({"event": "pipeline_stage", "time": datetime.now().isoformat(), **record})
+        print(log_line)
+        if self.log_path is not None:
+            with open(self.log_path, "a") as f:
+                f.write(log_line + "\n")
+
+
+@dataclass
+class RunOptions:
+    """Everything run_process can be configured with besides its input and output paths."""
+
+    history_store_file: Optional[Path] = None  # Incremental Part 4; every pricing file is re-read when None
+    file_format: str = "csv"
+    page_size: Optional[int] = None  # Fetch the listing page by page
+    partition_by_date: bool = False
+    universe_reference_file: Optional[Path] = None  # Static coin fields go here, only when they change
+    symbol_collisions: str = "highest_rank"
+    validate: Optional[str] = "manifest"  # History reads skip pricing files failing their manifest (None reads every file)
+    stream: bool = False  # Parse and write the universe in batches, bypassing the cache (see check_stream_options)
+    session: Optional[requests.Session] = None
+    cache: Optional[ResponseCache] = None
+    metrics: Optional[PipelineMetrics] = None
+    rolling_statistics: Optional[RollingStatistics] = None
+    rolling_statistics_file: Optional[Path] = None  # Saved here after every update when set
+    quote_fetcher: Optional[TrackedQuoteFetcher] = None
+    fan_out_fetcher: Optional[FanOutFetcher] = None
+    universe_snapshots: Optional[UniverseSnapshots] = None
+
+
+def fetch_coins(api_url: str, headers: dict, coins_to_track_path: Path, options: RunOptions) -> Tuple[Any, bool]:
+    """Helper function to fetch this run's coins: a full listing, or the tracked coins' quotes between universe refreshes
+    when none of them is missing. Returns the coins (per currency from a fan_out_fetcher) and whether they're a full listing."""
+    if options.quote_fetcher is not None and not options.quote_fetcher.needs_refresh(coins_to_track_path):
+        fan_out_fetcher = options.fan_out_fetcher
+        if fan_out_fetcher is None:
+            coins = options.quote_fetcher.fetch(headers, session=options.session, cache=options.cache)
+        else:
+            # Same currencies, headers and keys as the listing, so quote ticks keep its columns and credit budgets
+            coins = options.quote_fetcher.fetch(fan_out_fetcher.headers, session=fan_out_fetcher.key_pool, cache=options.cache, currencies=fan_out_fetcher.currencies)
+        if coins is not None:
+            return coins, False
+    if options.fan_out_fetcher is not None:
+        return options.fan_out_fetcher.fetch(cache=options.cache), True
+    if options.page_size is None:
+        return get_api_response(api_url, headers, session=options.session, cache=options.cache), True
+    return get_api_response_paginated(api_url, headers, options.page_size, session=options.session, cache=options.cache), True
+
+
+def build_universe(api_response: Any, coins_to_track_path: Path, full_listing: bool, options: RunOptions) -> pd.DataFrame:
+    """Helper function to turn fetch_coins' coins into the universe, resolving the tracked ids again after a full listing."""
+    if isinstance(api_response, dict):
+        df_universe = options.fan_out_fetcher.build_universe(api_response)
+    else:
+        df_universe = build_coin_universe(api_response)
+    if full_listing and options.quote_fetcher is not None:
+        options.quote_fetcher.refresh(coins_to_track_path, df_universe, options.symbol_collisions)
+    return df_universe
+
+
+def check_stream_options(options: RunOptions):
+    """Helper function to refuse options a streamed universe would silently ignore: it's one USD listing written whole to universe_file."""
+    if not options.stream:
+        return
+    unsupported = {
+        "universe_reference_file": options.universe_reference_file,
+        "quote_fetcher": options.quote_fetcher,
+        "fan_out_fetcher": options.fan_out_fetcher,
+    }
+    unsupported = [name for name, value in unsupported.items() if value is not None]
+    if unsupported:
+        raise ValueError(f"Streaming the universe doesn't support {unsupported}")
+
+
+def run_process(api_url: str, headers: dict, universe_file: Path, coins_to_track_path: Path, pricing_data_dir: Path, analysis_file: Path, options: Optional[RunOptions] = None, history_store: Optional[Dict] = None) -> Optional[Dict]:
+    """A wrapper to call all steps in the tracking process. Returns the history store so callers can pass it back in."""
+    options = options or RunOptions()
+    check_stream_options(options)
+    metrics = options.metrics
+    stage = metrics.stage if metrics is not None else null_stage
+    if metrics is not None:
+        metrics.begin_run()
+    try:
+        if options.stream:
+            with stage("fetch_and_universe") as record:
+                coins = iter_api_coins(api_url, headers, session=options.session, page_size=options.page_size)
+                keep_symbols = set(get_coins_to_track(coins_to_track_path)) | {"BTC"}
+                df_universe = get_coin_universe_streaming(coins, universe_file, keep_symbols)
+                record["bytes"] = file_size(universe_file)
+        else:
+            with stage("fetch") as record:
+                api_response, full_listing = fetch_coins(api_url, headers, coins_to_track_path, options)
+                record["rows"] = sum(map(len, api_response.values())) if isinstance(api_response, dict) else len(api_response)
+            with stage("universe") as record:
+                df_universe = build_universe(api_response, coins_to_track_path, full_listing, options)
+                if full_listing:
+                    save_coin_universe(df_universe, universe_file, options.universe_reference_file)
+                    record["bytes"] = file_size(universe_file)
+                record["rows"] = len(df_universe)
+        if options.universe_snapshots is not None:
+            options.universe_snapshots.add(df_universe)
+        with stage("pricing") as record:
+            df_pricing = get_pricing_data(coins_to_track_path, df_universe, pricing_data_dir, options.file_format, options.partition_by_date, options.symbol_collisions)
+            record["rows"] = len(df_pricing)
+        if options.rolling_statistics is not None:
+            with stage("rolling_statistics") as record:
+                options.rolling_statistics.update(df_pricing)
+                print(options.rolling_statistics.statistics())
+                if options.rolling_statistics_file is not None:
+                    save_rolling_statistics(options.rolling_statistics, options.rolling_statistics_file)
+                record["rows"] = len(df_pricing)
+        with stage("analysis") as record:
+            df_results = analyze_bitcoin_relationship(df_pricing, analysis_file)
+            record["rows"] = len(df_results)
+            record["bytes"] = file_size(analysis_file)
+    except requests.exceptions.RequestException as e:
+        print(f"API Request failed: {e}")
+    except KeyError as e:
+        print(f"KeyError raised. API schema may have changed. {e}")
+    except ValueError as e:
+        print(f"Bitcoin data not found in pricing call. {e}")
+    except OSError as e:
+        print(f"There was an issue saving the file. {e}")
+
+    try:
+        with stage("history") as record:
+            if options.file_format == "sqlite":
+                df_averages = calculate_average_difference_sqlite(pricing_data_dir / PRICING_DATABASE_NAME)
+            elif options.history_store_file is None:
+                dfs_pricing = get_pricing_dfs(pricing_data_dir, options.file_format, AVERAGE_DIFFERENCE_COLUMNS, validate=options.validate)
+                record["rows"] = sum(len(df) for df in dfs_pricing)
+                df_averages = calculate_average_difference(dfs_pricing)
+            else:
+                if history_store is None:
+                    history_store = load_history_store(options.history_store_file)
+                history_store = update_history_store(pricing_data_dir, history_store, options.file_format, options.validate)
+                save_history_store(history_store, options.history_store_file)
+                df_averages = calculate_average_difference_from_store(history_store)
+            record["rows"] = record["rows"] or len(df_averages)
+    except ValueError as e:
+        print(f"Bitcoin data not found across pricing files. {e}")
+    if metrics is not None:
+        metrics.end_run()
+    return history_store
+
+
+def check_cache_ttl(cache: Optional[ResponseCache], interval_seconds: float):
+    """Helper function to refuse a cache that would hand the next scheduled tick the previous tick's listing as a new run."""
+    if cache is not None and cache.ttl_seconds >= interval_seconds:
+        raise ValueError(f"cache_ttl_seconds ({cache.ttl_seconds}) must be shorter than the {interval_seconds}s interval, or ticks replay cached listings")
+
+
+def run_daemon(interval_seconds: float, *run_process_args, options: Optional[RunOptions] = None, history_store: Optional[Dict] = None, stop_event: Optional[threading.Event] = None, max_ticks: Optional[int] = None) -> int:
+    """Call run_process every interval_seconds until SIGTERM/SIGINT (or stop_event), keeping the session, cache and history store."""
+    stop_event = stop_event or threading.Event()
+    previous_handlers = {}
+    if threading.current_thread() is threading.main_thread():
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            previous_handlers[signal_number] = signal.signal(signal_number, lambda *_: stop_event.set())
+
+    options = options or RunOptions()
+    check_cache_ttl(options.cache, interval_seconds)
+    owns_session = options.session is None
+    if owns_session:
+        options = replace(options, session=ApiClient())
+
+    ticks = 0
+    next_tick = time.monotonic()
+    try:
+        while not stop_event.is_set():
+            history_store = run_process(*run_process_args, options=options, history_store=history_store)
+            ticks += 1
+            if max_ticks is not None and ticks >= max_ticks:
+                break
+
+            # Ticks follow a fixed schedule, and an overrunning tick skips the slots it missed
+            next_tick += interval_seconds
+            now = time.monotonic()
+            if now > next_tick:
+                skipped_ticks = int((now - next_tick) // interval_seconds) + 1
+                next_tick += skipped_ticks * interval_seconds
+                print(f"Tick overran the {interval_seconds}s interval, skipping {skipped_ticks} tick(s)")
+            stop_event.wait(next_tick - now)
+    finally:
+        for signal_number, handler in previous_handlers.items():
+            signal.signal(signal_number, handler)
+        if owns_session:
+            options.session.close()
+    print(f"Daemon stopped after {ticks} tick(s)")
+    return ticks
+
+
+# Async pipeline: fetch, transform/write and history run as three tasks joined by bounded queues
+async def run_pipeline_async(
+    api_url: str,
+    headers: dict,
+    universe_file: Path,
+    coins_to_track_path: Path,
+    pricing_data_dir: Path,
+    analysis_file: Path,
+    options: Optional[RunOptions] = None,
+    history_store: Optional[Dict] = None,
+    cycles: Optional[int] = 1,
+    interval_seconds: float = 0.0,
+    queue_size: int = 1,
+    stop_event: Optional[asyncio.Event] = None,
+) -> Optional[Dict]:
+    """Run `cycles` fetches (forever when None) through the pipeline, starting one at most every interval_seconds."""
+    import asyncio  # Only this pipeline needs it, so it stays off the CLI's startup path
+
+    options = options or RunOptions()
+    if options.stream or options.metrics is not None:
+        raise ValueError("The async pipeline doesn't support stream or metrics, use run_process or run_daemon for them")
+    if cycles != 1:
+        check_cache_ttl(options.cache, interval_seconds)
+    stop_event = stop_event or asyncio.Event()
+    fetched = asyncio.Queue(maxsize=queue_size)
+    written = asyncio.Queue(maxsize=queue_size)
+    owns_session = options.session is None and cycles != 1
+    if owns_session:
+        options = replace(options, session=ApiClient())
+    loop = asyncio.get_running_loop()
+    handled_signals = []
+    if cycles is None and threading.current_thread() is threading.main_thread():
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signal_number, stop_event.set)
+                handled_signals.append(signal_number)
+            except NotImplementedError:  # Windows event loops
+                pass
+
+    def fetch_universe() -> Tuple[pd.DataFrame, bool]:
+        api_response, full_listing = fetch_coins(api_url, headers, coins_to_track_path, options)
+        return build_universe(api_response, coins_to_track_path, full_listing, options), full_listing
+
+    async def fetch_stage():
+        cycle = 0
+        next_fetch = time.monotonic()
+        while not stop_event.is_set() and (cycles is None or cycle < cycles):
+            cycle += 1
+            started = time.monotonic()
+            try:
+                df_universe, full_listing = await asyncio.to_thread(fetch_universe)
+            except requests.exceptions.RequestException as e:
+                print(f"API Request failed: {e}")
+            except KeyError as e:
+                print(f"KeyError raised. API schema may have changed. {e}")
+            except ValueError as e:
+                print(f"Bitcoin data not found in pricing call. {e}")
+            else:
+                await fetched.put((cycle, started, df_universe, full_listing))
+
+            next_fetch = max(next_fetch + interval_seconds, time.monotonic())
+            if cycles is None or cycle < cycles:
+                try:
+                    await asyncio.wait_for(stop_event.wait(), next_fetch - time.monotonic())
+                except asyncio.TimeoutError:
+                    pass
+        await fetched.put(None)
+
+    async def transform_stage():
+        while True:
+            item = await fetched.get()
+            if item is None:
+                break
+            cycle, started, df_universe, full_listing = item
+            try:
+                process_runtime = datetime.now()
+                if options.universe_snapshots is not None:
+                    await asyncio.to_thread(options.universe_snapshots.add, df_universe)
+                df_pricing = await asyncio.to_thread(build_pricing_data, coins_to_track_path, df_universe, process_runtime, options.symbol_collisions)
+                if options.rolling_statistics is not None:
+                    await asyncio.to_thread(options.rolling_statistics.update, df_pricing)
+                    print(options.rolling_statistics.statistics())
+                    if options.rolling_statistics_file is not None:
+                        await asyncio.to_thread(save_rolling_statistics, options.rolling_statistics, options.rolling_statistics_file)
+                writes = [
+                    asyncio.to_thread(save_pricing_data, df_pricing, pricing_data_dir, process_runtime, options.file_format, options.partition_by_date),
+                    asyncio.to_thread(analyze_bitcoin_relationship, df_pricing, analysis_file),
+                ]
+                if full_listing:
+                    writes.append(asyncio.to_thread(save_coin_universe, df_universe, universe_file, options.universe_reference_file))
+                await asyncio.gather(*writes)
+            except KeyError as e:
+                print(f"KeyError raised. API schema may have changed. {e}")
+            except ValueError as e:
+                print(f"Bitcoin data not found in pricing call. {e}")
+            except OSError as e:
+                print(f"There was an issue saving the file. {e}")
+            else:
+                await written.put((cycle, started))
+        await written.put(None)
+
+    async def history_stage():
+        nonlocal history_store
+        done = False
+        while not done:
+            batch = [await written.get()]
+            while not written.empty():
+                batch.append(written.get_nowait())
+            done = batch[-1] is None
+            batch = [item for item in batch if item is not None]
+            if not batch:
+                continue
+            # Only runs with a manifest are ingested, so a file the next cycle is still writing waits for the next update
+            validate = options.validate or "manifest"
+            try:
+                _, history_store = await asyncio.to_thread(update_average_difference, pricing_data_dir, options.file_format, options.history_store_file, history_store, validate=validate)
+            except ValueError as e:
+                print(f"Bitcoin data not found across pricing files. {e}")
+            for cycle, started in batch:
+                print(f"Cycle {cycle} finished {time.monotonic() - started:.3f}s after its fetch started")
+
+    try:
+        await asyncio.gather(fetch_stage(), transform_stage(), history_stage())
+    finally:
+        for signal_number in handled_signals:
+            loop.remove_signal_handler(signal_number)
+        if owns_session:
+            options.session.close()
+    return history_store
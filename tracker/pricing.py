@@ -0,0 +1,169 @@
+"""Part 2: resolving the tracked coins and saving each run's pricing file."""
+from __future__ import annotations
+
+import csv
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+import weakref
+
+from tracker.lazy import pd
+from tracker.storage import (
+    FILE_FORMATS,
+    PRICING_DATABASE_NAME,
+    PRICING_TABLE,
+    encode_nested_columns,
+    safe_save_file_name,
+    save_sqlite,
+    save_table,
+    write_pricing_manifest,
+)
+
+
+# Part 2: Read coins_to_track.csv and get pricing data for each coin. Store the pricing data in a
+# csv. Each time your process runs a new csv should be generated and a timestamp
+# should be appended to the file name.
+#       a. When you load the data, add a “LoadedWhen” column with the current date time.
+#       b . When you load the data, add an “IsTopCurrency” column that is true when the
+#       cmc_rank is less than or equal to 10, false otherwise.
+# Symbols aren't unique, so tracked symbols are resolved to CMC ids under one of these policies
+SYMBOL_COLLISION_POLICIES = ["highest_rank", "all", "error"]
+# coins_to_track.csv contents and resolved ids, re-read only when the file's mtime or size changes
+TRACKED_COINS_CACHE: Dict[Path, Dict] = {}
+# Each live universe's ids as an Index (with pandas' hash table) and signature, keyed by id() of the universe DataFrame
+UNIVERSE_IDS_CACHE: Dict[int, Dict] = {}
+
+
+def load_tracked_coins(coins_to_track_path: Path) -> Dict:
+    """Helper function to read the tracked symbols, from the cache unless the file changed since the last read."""
+    file_stat = coins_to_track_path.stat()
+    signature = (file_stat.st_mtime_ns, file_stat.st_size)
+    cache_key = coins_to_track_path.resolve()
+    tracked_coins = TRACKED_COINS_CACHE.get(cache_key)
+    if tracked_coins is None or tracked_coins["signature"] != signature:
+        # This read could be replaced with a "safe_read" helper function to get expected
+        # and would be appropriate for larger workloads where failures during the process should be logged
+        with open(coins_to_track_path, "r", newline="") as f:
+            symbols = [(row["Symbol"] or "").strip() for row in csv.DictReader(f)]
+        tracked_coins = {"signature": signature, "symbols": [symbol for symbol in symbols if symbol], "resolved_ids": {}}
+        TRACKED_COINS_CACHE[cache_key] = tracked_coins
+    return tracked_coins
+
+
+def get_coins_to_track(coins_to_track_path: Path) -> List[str]:
+    """Helper function to get all the coin symbols of interest."""
+    return list(load_tracked_coins(coins_to_track_path)["symbols"])
+
+
+def resolve_tracked_ids(symbols: List[str], df_universe: pd.DataFrame, symbol_collisions: str = "highest_rank") -> Dict:
+    """Helper function to map tracked symbols (and BTC) to CMC ids under a symbol collision policy."""
+    if symbol_collisions not in SYMBOL_COLLISION_POLICIES:
+        raise ValueError(f"Unsupported symbol collision policy {symbol_collisions}. Expected one of {SYMBOL_COLLISION_POLICIES}")
+    tracked_symbols = set(symbols) | {"BTC"}
+    df_tracked = df_universe[df_universe["symbol"].isin(tracked_symbols)]
+    df_candidates = pd.DataFrame(
+        {
+            "id": (df_tracked["id"] if "id" in df_tracked.columns else df_tracked.index).to_numpy(),
+            "symbol": df_tracked["symbol"].to_numpy(dtype=object),
+            "cmc_rank": df_tracked["cmc_rank"].to_numpy(),
+        }
+    ).sort_values("cmc_rank", kind="stable")
+    is_bitcoin = df_candidates["symbol"] == "BTC"
+
+    collided_symbols = sorted(df_candidates.loc[df_candidates["symbol"].duplicated() & ~is_bitcoin, "symbol"].unique())
+    if collided_symbols and symbol_collisions == "error":
+        raise ValueError(f"Tracked symbols shared by several coins: {collided_symbols}")
+    if symbol_collisions == "all":
+        ids = df_candidates.loc[~is_bitcoin, "id"].tolist() + df_candidates.loc[is_bitcoin, "id"].head(1).tolist()
+    else:
+        ids = df_candidates.drop_duplicates(subset="symbol")["id"].tolist()
+    return {"ids": [int(coin_id) for coin_id in ids], "complete": tracked_symbols <= set(df_candidates["symbol"])}
+
+
+def get_universe_signature(universe_ids: pd.Index) -> tuple:
+    """Helper function to fingerprint a universe's set of ids, whatever their order."""
+    return len(universe_ids), int(pd.util.hash_array(universe_ids.to_numpy()).sum())
+
+
+def load_universe_ids(df_universe: pd.DataFrame) -> Dict:
+    """Helper function to index a universe's ids once, so later selections from the same universe only look up the tracked ids."""
+    cache_key = id(df_universe)
+    universe_ids = UNIVERSE_IDS_CACHE.get(cache_key)
+    if universe_ids is None or universe_ids["universe"]() is not df_universe or len(universe_ids["ids"]) != len(df_universe):
+        universe_ids = {
+            # Dropped with the universe, so a later DataFrame reusing its id() can't pick up stale ids
+            "universe": weakref.ref(df_universe, lambda _: UNIVERSE_IDS_CACHE.pop(cache_key, None)),
+            "ids": df_universe.index if df_universe.index.name == "id" else pd.Index(df_universe["id"]),
+            "signature": None,
+        }
+        UNIVERSE_IDS_CACHE[cache_key] = universe_ids
+    return universe_ids
+
+
+def select_tracked_coins(coins_to_track_path: Path, df_universe: pd.DataFrame, symbol_collisions: str = "highest_rank") -> pd.DataFrame:
+    """Helper function to pick the tracked coins out of the universe by CMC id, in universe order."""
+    tracked_coins = load_tracked_coins(coins_to_track_path)
+    universe_ids = load_universe_ids(df_universe)
+
+    def universe_signature() -> tuple:
+        if universe_ids["signature"] is None:
+            universe_ids["signature"] = get_universe_signature(universe_ids["ids"])
+        return universe_ids["signature"]
+
+    resolved = tracked_coins["resolved_ids"].get(symbol_collisions)
+    positions = universe_ids["ids"].get_indexer(resolved["ids"]) if resolved is not None else None
+    is_stale = positions is None or (positions < 0).any()
+    if not is_stale and not resolved["complete"]:
+        # A symbol missing from the universe is only looked up again once the universe's ids change
+        is_stale = resolved["universe_signature"] != universe_signature()
+    if is_stale:
+        resolved = resolve_tracked_ids(tracked_coins["symbols"], df_universe, symbol_collisions)
+        if not resolved["complete"]:
+            resolved["universe_signature"] = universe_signature()
+        tracked_coins["resolved_ids"][symbol_collisions] = resolved
+        positions = universe_ids["ids"].get_indexer(resolved["ids"])
+    return df_universe.iloc[sorted(positions)].copy()
+
+
+def is_top_currency(cmc_rank: int) -> bool:
+    """Helper function to rank top currencies to track."""
+    return cmc_rank <= 10
+
+
+def build_pricing_data(coins_to_track_path: Path, df_universe: pd.DataFrame, process_runtime: datetime, symbol_collisions: str = "highest_rank") -> pd.DataFrame:
+    """Helper function to select this run's pricing rows for the tracked coins without saving them."""
+    if "id" in df_universe.columns or df_universe.index.name == "id":
+        df_pricing = select_tracked_coins(coins_to_track_path, df_universe, symbol_collisions)
+    else:  # Universes without CMC ids can only be matched on symbol
+        coin_ids = get_coins_to_track(coins_to_track_path)
+        df_pricing = df_universe[
+            (df_universe["symbol"].isin(coin_ids)) | (df_universe["symbol"] == "BTC")
+        ].copy()  # to make sure BTC is always included
+    df_pricing["LoadedWhen"] = process_runtime.isoformat()
+    df_pricing["IsTopCurrency"] = df_pricing["cmc_rank"].map(is_top_currency)
+    return df_pricing
+
+
+def save_pricing_data(df_pricing: pd.DataFrame, save_dir: Path, process_runtime: datetime, file_format: str = "csv", partition_by_date: bool = False):
+    """Helper function to save one run's pricing rows and their manifest, named after the run."""
+    if file_format == "sqlite":
+        save_sqlite(encode_nested_columns(df_pricing), save_dir / PRICING_DATABASE_NAME, PRICING_TABLE)
+        print(f"Coin pricing saved to {save_dir / PRICING_DATABASE_NAME}")
+        return
+
+    process_runtime_file_safe = process_runtime.strftime("%Y_%m_%dT%H_%M_%S_%f") # to make a safe timestamp for file name
+    if partition_by_date:
+        save_dir = save_dir / f"date={process_runtime.strftime('%Y-%m-%d')}"
+        save_dir.mkdir(parents=True, exist_ok=True)
+    save_path = save_dir / safe_save_file_name(f"pricing_data__{process_runtime_file_safe}{FILE_FORMATS[file_format]}")
+    save_table(df_pricing, save_path, file_format)
+    write_pricing_manifest(save_path, df_pricing, file_format, process_runtime)
+    print(f"Coin pricing saved to {save_dir}")
+
+
+def get_pricing_data(coins_to_track_path: Path, df_universe: pd.DataFrame, save_dir: Path, file_format: str = "csv", partition_by_date: bool = False, symbol_collisions: str = "highest_rank") -> pd.DataFrame:
+    """Get and store pricing data for coins."""
+    process_runtime = datetime.now()
+    df_pricing = build_pricing_data(coins_to_track_path, df_universe, process_runtime, symbol_collisions)
+    save_pricing_data(df_pricing, save_dir, process_runtime, file_format, partition_by_date)
+    return df_pricing
@@ -0,0 +1,637 @@
+"""Table formats, crash safe writes, run manifests and the pricing history layout on disk."""
+from __future__ import annotations
+
+from contextlib import closing, contextmanager
+from datetime import datetime
+from functools import partial
+import hashlib
+import importlib.util
+import json
+import os
+from pathlib import Path
+import sqlite3
+import threading
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Set, Tuple
+
+from tracker.lazy import pd
+
+
+def safe_save_file_name(file_name: str) -> str:
+    """Helper function to ensure safe file names on cross platform saves."""
+    prohibitted_windows_characters = r'\/:*?"<>|'
+    if any(char in file_name for char in prohibitted_windows_characters):
+        safe_save_name = file_name
+        for char in prohibitted_windows_characters:
+            if char in safe_save_name:
+                safe_save_name = safe_save_name.replace(char, "_")
+        return safe_save_name
+    else:
+        return file_name
+
+
+# Supported table formats and their file suffixes. Parquet and Feather need pyarrow installed.
+FILE_FORMATS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+PYARROW_FORMATS = ["parquet", "feather"]
+
+# Nested API objects are stored as JSON strings so every format shares the same flat schema
+NESTED_COLUMNS = ["tags", "platform", "quote"]
+
+# Explicit dtypes for known columns, so an all-None column (e.g. max_supply) keeps its type between files
+TABLE_SCHEMA = {
+    "id": "Int64",
+    "name": "string",
+    "symbol": "string",
+    "slug": "string",
+    "cmc_rank": "Int64",
+    "num_market_pairs": "float64",
+    "circulating_supply": "float64",
+    "total_supply": "float64",
+    "max_supply": "float64",
+    "infinite_supply": "boolean",
+    "last_updated": "string",
+    "date_added": "string",
+    "tags": "string",
+    "platform": "string",
+    "self_reported_circulating_supply": "float64",
+    "self_reported_market_cap": "float64",
+    "quote": "string",
+    "percent_change_24h": "float64",
+    "LoadedWhen": "string",
+    "IsTopCurrency": "boolean",
+    "source_file": "string",
+}
+
+
+# Optional SQLite backend: every run is appended to one indexed table and Part 4 aggregates in SQL
+SQLITE_SUFFIX = ".sqlite"
+PRICING_DATABASE_NAME = "pricing_data.sqlite"
+PRICING_TABLE = "pricing_data"
+SQLITE_INDEXED_COLUMNS = ["symbol", "LoadedWhen"]
+
+
+def get_file_format(save_path: Path) -> str:
+    """Helper function to infer a table format from a file suffix."""
+    if save_path.suffix == SQLITE_SUFFIX:
+        return "sqlite"
+    for file_format, suffix in FILE_FORMATS.items():
+        if save_path.suffix == suffix:
+            return file_format
+    raise ValueError(f"Unsupported file format for {save_path}. Expected one of {list(FILE_FORMATS.values()) + [SQLITE_SUFFIX]}")
+
+
+def encode_nested_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Helper function to serialize nested API objects to JSON strings before saving."""
+    df = df.copy()
+    for col in NESTED_COLUMNS:
+        if col in df.columns:
+            df[col] = [value if isinstance(value, str) else json.dumps(value) for value in df[col]]
+    return df
+
+
+def decode_nested_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Helper function to turn the JSON strings written by encode_nested_columns back into objects."""
+    df = df.copy()
+    for col in NESTED_COLUMNS:
+        if col in df.columns:
+            df[col] = [json.loads(value) if isinstance(value, str) else None for value in df[col]]
+    return df
+
+
+def apply_table_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """Helper function to cast known columns to their schema dtypes."""
+    schema = {col: dtype for col, dtype in TABLE_SCHEMA.items() if col in df.columns}
+    schema.update({col: "float64" for col in df.columns if col.startswith("quote_")})
+    return df.astype(schema).reset_index(drop=True)
+
+
+@contextmanager
+def atomic_path(final_path: Path) -> Iterator[Path]:
+    """Helper function for crash safe writes: yields a temp path, then fsyncs it and renames it over final_path."""
+    tmp_path = final_path.with_name(final_path.name + ".tmp")
+    try:
+        yield tmp_path
+        with open(tmp_path, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, final_path)
+        fsync_directory(final_path.parent)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def fsync_directory(directory: Path):
+    """Helper function to flush a directory entry (e.g. a rename) to disk. Windows can't open directories, so it's skipped there."""
+    if os.name == "nt":
+        return
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def require_pyarrow(file_format: str):
+    """Helper function to fail with an install hint when a columnar format is used without pyarrow."""
+    if file_format in PYARROW_FORMATS and importlib.util.find_spec("pyarrow") is None:
+        raise ImportError(f"The {file_format} format needs pyarrow. Install the `columnar` extra with `poetry install --extras columnar`, or `pip install pyarrow`")
+
+
+def save_table(df: pd.DataFrame, save_path: Path, file_format: Optional[str] = None, compression: Optional[str] = None):
+    """Helper function to atomically save a table as csv, parquet, feather or sqlite, inferred from the suffix by default."""
+    file_format = file_format or get_file_format(save_path)
+    require_pyarrow(file_format)
+    df = encode_nested_columns(df)
+    compression_kwargs = {"compression": compression} if compression is not None else {}
+    if file_format == "sqlite":
+        save_sqlite(df, save_path, save_path.stem, replace=True)
+    elif file_format in FILE_FORMATS:
+        with atomic_path(save_path) as tmp_path:
+            if file_format == "csv":
+                df.to_csv(tmp_path, index=False, **compression_kwargs)
+            elif file_format == "parquet":
+                apply_table_schema(df).to_parquet(tmp_path, index=False, **compression_kwargs)
+            else:
+                apply_table_schema(df).to_feather(tmp_path, **compression_kwargs)
+    else:
+        raise ValueError(f"Unsupported file format {file_format}. Expected one of {list(FILE_FORMATS)}")
+    print(f"File saved to {save_path}")
+
+
+def read_table(path: Path, file_format: Optional[str] = None, columns: Optional[List[str]] = None, symbols: Optional[List[str]] = None) -> pd.DataFrame:
+    """Helper function to read a table saved by save_table, optionally only loading some columns and symbols."""
+    file_format = file_format or get_file_format(path)
+    require_pyarrow(file_format)
+    if file_format == "csv":
+        df = pd.read_csv(path, usecols=columns)
+    elif file_format == "parquet":
+        filters = [("symbol", "in", list(symbols))] if symbols is not None else None
+        return pd.read_parquet(path, columns=columns, filters=filters)
+    elif file_format == "feather":
+        df = pd.read_feather(path, columns=columns)
+    elif file_format == "sqlite":
+        df = read_sqlite(path, path.stem, columns)
+    else:
+        raise ValueError(f"Unsupported file format {file_format}. Expected one of {list(FILE_FORMATS)}")
+    if symbols is not None:
+        df = df[df["symbol"].isin(symbols)].reset_index(drop=True)
+    return df
+
+
+def quote_identifier(name: str) -> str:
+    """Helper function to quote a table or column name for SQLite."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def sqlite_column_type(series: pd.Series) -> str:
+    """Helper function to pick the SQLite column type for a DataFrame column."""
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_integer_dtype(series):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(series):
+        return "REAL"
+    return "TEXT"
+
+
+def save_sqlite(df: pd.DataFrame, db_path: Path, table_name: str, replace: bool = False):
+    """Helper function to append (or with replace, overwrite) a SQLite table in one bulk insert transaction."""
+    table = quote_identifier(table_name)
+    rows = list(zip(*[[None if value is pd.NA else value for value in df[col].tolist()] for col in df.columns]))
+    with closing(sqlite3.connect(db_path)) as conn, conn:
+        if replace:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+        column_definitions = ", ".join(f"{quote_identifier(col)} {sqlite_column_type(df[col])}" for col in df.columns)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({column_definitions})")
+        existing_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for col in df.columns:
+            if col not in existing_columns:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {quote_identifier(col)} {sqlite_column_type(df[col])}")
+        for col in SQLITE_INDEXED_COLUMNS:
+            if col in df.columns:
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {quote_identifier(f'idx_{table_name}_{col}')} ON {table} ({quote_identifier(col)})")
+        columns = ", ".join(quote_identifier(col) for col in df.columns)
+        placeholders = ", ".join("?" for _ in df.columns)
+        conn.executemany(f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", rows)
+
+
+def read_sqlite(
+    db_path: Path,
+    table_name: str,
+    columns: Optional[List[str]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    symbols: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Helper function to read a SQLite table in insert order, filtering on the LoadedWhen window and symbols in SQL."""
+    conditions, params = [], []
+    if start is not None:
+        conditions.append('"LoadedWhen" >= ?')
+        params.append(start.isoformat())
+    if end is not None:
+        conditions.append('"LoadedWhen" <= ?')
+        params.append(end.isoformat())
+    if symbols is not None:
+        conditions.append(f'"symbol" IN ({", ".join("?" for _ in symbols)})')
+        params.extend(symbols)
+    selected = ", ".join(quote_identifier(col) for col in columns) if columns else "*"
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    with closing(sqlite3.connect(db_path)) as conn:
+        return pd.read_sql_query(f"SELECT {selected} FROM {quote_identifier(table_name)}{where} ORDER BY rowid", conn, params=params)
+
+
+def save_csv(df: pd.DataFrame, save_path: Path):
+    """Helper function to standardize saving mechanism for tables"""
+    save_table(df, save_path, "csv")
+
+
+# Every pricing file gets a manifest once it is in place, so a file without one comes from an unfinished run.
+# Manifests are appended to one index per directory, so validating a directory opens one file instead of one per run.
+PRICING_SCHEMA_VERSION = 1
+MANIFEST_INDEX_NAME = "manifests.jsonl"
+MANIFEST_SUFFIX = ".manifest.json"  # Per-file manifests written before the index
+PRICING_VALIDATION_LEVELS = ["manifest", "checksum"]
+# Parsed manifest indexes, read further only when lines have been appended since
+MANIFEST_INDEX_CACHE: Dict[Path, Dict] = {}
+MANIFEST_INDEX_LOCK = threading.Lock()
+
+
+def get_manifest_path(pricing_file: Path) -> Path:
+    """Helper function for where the per-file manifest of a pricing file written before the index is kept."""
+    return pricing_file.with_name(pricing_file.name + MANIFEST_SUFFIX)
+
+
+def get_manifest_index_path(pricing_file: Path) -> Path:
+    """Helper function for the manifest index of the directory a pricing file is in."""
+    return pricing_file.parent / MANIFEST_INDEX_NAME
+
+
+def load_manifest_index_entry(index_path: Path) -> Optional[Dict]:
+    """Helper function to bring a directory's cached manifest index up to date, None when the directory has none."""
+    try:
+        f = open(index_path, "rb")
+    except OSError:
+        return None
+    with MANIFEST_INDEX_LOCK, f:
+        file_stat = os.fstat(f.fileno())
+        cache_key = index_path.resolve()
+        # A directory deleted and recreated can hand the new index the old inode, so its first line is compared too
+        first_line = f.readline()
+        index = MANIFEST_INDEX_CACHE.get(cache_key)
+        if index is None or (index["inode"], index["first_line"]) != (file_stat.st_ino, first_line) or file_stat.st_size < index["offset"]:
+            index = {"inode": file_stat.st_ino, "first_line": first_line, "offset": 0, "manifests": {}}
+            MANIFEST_INDEX_CACHE[cache_key] = index
+        if file_stat.st_size > index["offset"]:
+            f.seek(index["offset"])
+            appended = f.read()
+            complete = appended[: appended.rfind(b"\n") + 1]  # A line still being written is read next time
+            # Appended lines go into a new dict, so views handed out earlier never change under their readers
+            manifests = dict(index["manifests"]) if complete else index["manifests"]
+            for line in complete.splitlines():
+                try:
+                    manifest = json.loads(line)
+                except ValueError:
+                    continue
+                if manifest.get("deleted"):
+                    manifests.pop(manifest["file"], None)
+                else:
+                    manifests[manifest["file"]] = manifest
+            index["manifests"] = manifests
+            index["offset"] += len(complete)
+        return index
+
+
+def load_manifest_index(index_path: Path) -> Mapping[str, Dict]:
+    """Helper function to read a directory's manifests by file name, parsing only the lines appended since the last read.
+    Returns a read-only view of the cached index, so callers can look up many files without copying it."""
+    index = load_manifest_index_entry(index_path)
+    return MappingProxyType(index["manifests"] if index is not None else {})
+
+
+def get_first_manifest_runtime(pricing_data_dir: Path) -> Optional[datetime]:
+    """Helper function to find when the first manifest under a pricing directory was written, None before any was."""
+    runtimes = []
+    for index_path in [pricing_data_dir / MANIFEST_INDEX_NAME, *pricing_data_dir.glob(f"date=*/{MANIFEST_INDEX_NAME}")]:
+        index = load_manifest_index_entry(index_path)
+        try:
+            runtimes.append(datetime.fromisoformat(json.loads(index["first_line"])["runtime"]))
+        except (TypeError, KeyError, ValueError):
+            continue
+    return min(runtimes, default=None)
+
+
+def append_manifest_index(index_path: Path, entries: List[Dict]):
+    """Helper function to append manifests (or deletion markers) to a directory's index and flush them to disk."""
+    is_new_index = not index_path.exists()
+    with open(index_path, "a") as f:
+        f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        f.flush()
+        os.fsync(f.fileno())
+    if is_new_index:
+        fsync_directory(index_path.parent)
+
+
+def remove_pricing_manifests(pricing_files: List[Path]):
+    """Helper function to drop the manifests of deleted pricing files."""
+    files_by_dir: Dict[Path, List[Path]] = {}
+    for pricing_file in pricing_files:
+        files_by_dir.setdefault(pricing_file.parent, []).append(pricing_file)
+        get_manifest_path(pricing_file).unlink(missing_ok=True)
+    for directory, dir_files in files_by_dir.items():
+        index_path = directory / MANIFEST_INDEX_NAME
+        remaining = set(load_manifest_index(index_path)) - {pricing_file.name for pricing_file in dir_files}
+        if remaining:
+            append_manifest_index(index_path, [{"file": pricing_file.name, "deleted": True} for pricing_file in dir_files])
+        else:
+            index_path.unlink(missing_ok=True)
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    """Helper function to hash a file without reading it into memory at once."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(partial(f.read, chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_pricing_manifest(pricing_file: Path, df_pricing: pd.DataFrame, file_format: str, process_runtime: datetime, sources: Optional[List[str]] = None) -> Dict:
+    """Helper function to record a finished run's rows, columns, size, checksum, schema version and runtime."""
+    manifest = {
+        "file": pricing_file.name,
+        "format": file_format,
+        "schema_version": PRICING_SCHEMA_VERSION,
+        "runtime": process_runtime.isoformat(),
+        "rows": len(df_pricing),
+        "columns": [str(col) for col in df_pricing.columns],
+        "bytes": pricing_file.stat().st_size,
+        "sha256": file_sha256(pricing_file),
+    }
+    if sources is not None:
+        manifest["sources"] = sources
+    append_manifest_index(get_manifest_index_path(pricing_file), [manifest])
+    return manifest
+
+
+def read_pricing_manifest(pricing_file: Path, manifests: Optional[Mapping[str, Dict]] = None) -> Optional[Dict]:
+    """Helper function to load a pricing file's manifest, or None when it's missing or unreadable. Pass the directory's
+    load_manifest_index() as manifests when looking up many files."""
+    if manifests is None:
+        manifests = load_manifest_index(get_manifest_index_path(pricing_file))
+    manifest = manifests.get(pricing_file.name)
+    if manifest is not None:
+        return manifest
+    try:
+        with open(get_manifest_path(pricing_file), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_valid_pricing_file(
+    pricing_file: Path,
+    validate: str = "manifest",
+    manifests: Optional[Mapping[str, Dict]] = None,
+    accept_legacy_before: Optional[datetime] = None,
+) -> bool:
+    """Helper function to check a pricing file's size (and with "checksum", its hash) against its manifest. Files without
+    one are accepted when they were written before accept_legacy_before, i.e. before manifests were written at all."""
+    manifest = read_pricing_manifest(pricing_file, manifests)
+    # Names without a run timestamp sort first in list_pricing_files, so they count as old too
+    if manifest is None and accept_legacy_before is not None and (get_pricing_file_runtime(pricing_file) or datetime.min) < accept_legacy_before:
+        return True
+    if manifest is None:
+        reason = "no manifest, the run that wrote it may not have finished"
+    elif manifest.get("schema_version", 0) > PRICING_SCHEMA_VERSION:
+        reason = f"schema version {manifest['schema_version']} is newer than this reader"
+    elif pricing_file.stat().st_size != manifest.get("bytes"):
+        reason = "size doesn't match its manifest"
+    elif validate == "checksum" and file_sha256(pricing_file) != manifest.get("sha256"):
+        reason = "checksum doesn't match its manifest"
+    else:
+        return True
+    print(f"Skipping {pricing_file}: {reason}")
+    return False
+
+
+def get_pricing_file_runtime(pricing_file: Path) -> Optional[datetime]:
+    """Helper function to read the run timestamp back out of a pricing_data__<timestamp> file name."""
+    try:
+        return datetime.strptime(pricing_file.name.split("__", 1)[1].split(".")[0], "%Y_%m_%dT%H_%M_%S_%f")
+    except (IndexError, ValueError):
+        return None
+
+
+def list_pricing_files(
+    pricing_data_dir: Path,
+    file_format: str = "csv",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    validate: Optional[str] = None,
+    exclude: Optional[Set[str]] = None,
+) -> List[Path]:
+    """Helper function to list flat and date partitioned pricing files in run order, pruned to the start/end window.
+    Files in exclude (paths relative to pricing_data_dir, e.g. already ingested ones) are left out before validating."""
+    if validate is not None and validate not in PRICING_VALIDATION_LEVELS:
+        raise ValueError(f"Unsupported validation {validate}. Expected one of {PRICING_VALIDATION_LEVELS}")
+    suffix = FILE_FORMATS[file_format]
+    pricing_files = list(pricing_data_dir.glob(f"*{suffix}"))
+    for partition_dir in pricing_data_dir.glob("date=*"):
+        try:
+            partition_date = datetime.strptime(partition_dir.name, "date=%Y-%m-%d").date()
+        except ValueError:
+            continue
+        if (start is not None and partition_date < start.date()) or (end is not None and partition_date > end.date()):
+            continue
+        pricing_files.extend(partition_dir.glob(f"*{suffix}"))
+
+    runtimes = {pricing_file: get_pricing_file_runtime(pricing_file) for pricing_file in pricing_files}
+    if start is not None or end is not None:
+        pricing_files = [
+            pricing_file
+            for pricing_file, runtime in runtimes.items()
+            if runtime is not None and (start is None or runtime >= start) and (end is None or runtime <= end)
+        ]
+    if exclude:
+        pricing_files = [pricing_file for pricing_file in pricing_files if pricing_file.relative_to(pricing_data_dir).as_posix() not in exclude]
+    pricing_files = sorted(pricing_files, key=lambda pricing_file: (runtimes[pricing_file] or datetime.min, pricing_file.name))
+    if validate is not None:
+        # Files from before the first manifest was written come from older versions, not unfinished runs
+        accept_legacy_before = get_first_manifest_runtime(pricing_data_dir) or datetime.max
+        manifests_by_dir = {directory: load_manifest_index(directory / MANIFEST_INDEX_NAME) for directory in {pricing_file.parent for pricing_file in pricing_files}}
+        pricing_files = [
+            pricing_file
+            for pricing_file in pricing_files
+            if is_valid_pricing_file(pricing_file, validate, manifests_by_dir[pricing_file.parent], accept_legacy_before)
+        ]
+    return pricing_files
+
+
+# Compaction merges each past day's runs into one compressed segment named after its first and last run
+SEGMENTS_DIR_NAME = "segments"
+SEGMENT_SUFFIXES = {"csv": ".csv.gz", "parquet": ".parquet", "feather": ".feather"}
+SEGMENT_COMPRESSION = {"csv": "gzip", "parquet": "zstd", "feather": "zstd"}
+
+
+def get_segment_runtimes(segment_file: Path) -> Optional[Tuple[datetime, datetime]]:
+    """Helper function to read the first and last run timestamps back out of a segment__<first>__<last> file name."""
+    try:
+        _, first, last = segment_file.name.split(".")[0].split("__")
+        return datetime.strptime(first, "%Y_%m_%dT%H_%M_%S_%f"), datetime.strptime(last, "%Y_%m_%dT%H_%M_%S_%f")
+    except ValueError:
+        return None
+
+
+def get_segment_format(segment_file: Path) -> str:
+    """Helper function to infer a segment's table format from its suffix."""
+    for file_format, suffix in SEGMENT_SUFFIXES.items():
+        if segment_file.name.endswith(suffix):
+            return file_format
+    raise ValueError(f"Unsupported segment file {segment_file}")
+
+
+def list_segment_files(pricing_data_dir: Path, start: Optional[datetime] = None, end: Optional[datetime] = None, validate: Optional[str] = None) -> List[Path]:
+    """Helper function to list finished compacted segments in run order, pruned to the start/end window."""
+    segments_dir = pricing_data_dir / SEGMENTS_DIR_NAME
+    segment_files = [path for suffix in SEGMENT_SUFFIXES.values() for path in segments_dir.glob(f"segment__*{suffix}")]
+    runtimes = {segment_file: get_segment_runtimes(segment_file) for segment_file in segment_files}
+    segment_files = [
+        segment_file
+        for segment_file, runtime_range in runtimes.items()
+        if runtime_range is not None
+        and (start is None or runtime_range[1] >= start)
+        and (end is None or runtime_range[0] <= end)
+        and read_pricing_manifest(segment_file) is not None
+    ]
+    segment_files = sorted(segment_files, key=lambda segment_file: runtimes[segment_file])
+    if validate is not None:
+        segment_files = [segment_file for segment_file in segment_files if is_valid_pricing_file(segment_file, validate)]
+    return segment_files
+
+
+def get_compacted_sources(segment_files: List[Path], pricing_files: List[Path]) -> Set[str]:
+    """Helper function to find which pricing files have already been compacted into a segment."""
+    runtimes = [runtime for runtime in map(get_pricing_file_runtime, pricing_files) if runtime is not None]
+    compacted_sources = set()
+    for segment_file in segment_files:
+        first, last = get_segment_runtimes(segment_file)
+        if any(first <= runtime <= last for runtime in runtimes):
+            compacted_sources.update((read_pricing_manifest(segment_file) or {}).get("sources", []))
+    return compacted_sources
+
+
+def read_segment(
+    segment_file: Path,
+    columns: Optional[List[str]] = None,
+    symbols: Optional[List[str]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    sources: Optional[Set[str]] = None,
+) -> List[Tuple[str, pd.DataFrame]]:
+    """Helper function to read a segment back as (source_file, run frame) pairs in run order."""
+    read_columns = None if columns is None else list(dict.fromkeys(list(columns) + ["source_file"]))
+    df_segment = read_table(segment_file, get_segment_format(segment_file), read_columns, symbols)
+    runs = []
+    for source_file, df_run in df_segment.groupby("source_file", sort=False, observed=True):
+        if sources is not None and source_file not in sources:
+            continue
+        runtime = get_pricing_file_runtime(Path(source_file))
+        if (start is not None or end is not None) and (
+            runtime is None or (start is not None and runtime < start) or (end is not None and runtime > end)
+        ):
+            continue
+        df_run = df_run[columns] if columns is not None else df_run.drop(columns="source_file")
+        runs.append((source_file, df_run.reset_index(drop=True)))
+    return runs
+
+
+def compact_pricing_files(
+    pricing_data_dir: Path,
+    file_format: str = "csv",
+    before: Optional[datetime] = None,
+    segment_format: Optional[str] = None,
+    validate: Optional[str] = None,
+) -> List[Path]:
+    """Merge each day's pricing files before `before` (default: today) into one compressed segment, then delete them."""
+    if file_format == "sqlite":
+        raise ValueError("The sqlite backend keeps every run in one table, there are no pricing files to compact")
+    segment_format = segment_format or file_format
+    before = before or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    segments_dir = pricing_data_dir / SEGMENTS_DIR_NAME
+
+    pricing_files = [
+        pricing_file
+        for pricing_file in list_pricing_files(pricing_data_dir, file_format, validate=validate)
+        if (get_pricing_file_runtime(pricing_file) or before) < before
+    ]
+    compacted_sources = get_compacted_sources(list_segment_files(pricing_data_dir), pricing_files)
+    files_by_day: Dict[Any, List[Path]] = {}
+    for pricing_file in pricing_files:
+        if pricing_file.relative_to(pricing_data_dir).as_posix() in compacted_sources:
+            # Left behind by a compaction that stopped before deleting it
+            pricing_file.unlink()
+            remove_pricing_manifests([pricing_file])
+            continue
+        files_by_day.setdefault(get_pricing_file_runtime(pricing_file).date(), []).append(pricing_file)
+
+    segment_files = []
+    for day_files in files_by_day.values():
+        sources = [pricing_file.relative_to(pricing_data_dir).as_posix() for pricing_file in day_files]
+        df_segment = pd.concat(
+            [read_table(pricing_file, file_format).assign(source_file=source) for pricing_file, source in zip(day_files, sources)],
+            ignore_index=True,
+        )
+        first, last = get_pricing_file_runtime(day_files[0]), get_pricing_file_runtime(day_files[-1])
+        segments_dir.mkdir(parents=True, exist_ok=True)
+        segment_file = segments_dir / (
+            f"segment__{first.strftime('%Y_%m_%dT%H_%M_%S_%f')}__{last.strftime('%Y_%m_%dT%H_%M_%S_%f')}{SEGMENT_SUFFIXES[segment_format]}"
+        )
+        save_table(df_segment, segment_file, segment_format, SEGMENT_COMPRESSION[segment_format])
+        write_pricing_manifest(segment_file, df_segment, segment_format, first, sources)
+        for pricing_file in day_files:
+            pricing_file.unlink()
+        remove_pricing_manifests(day_files)
+        for partition_dir in {pricing_file.parent for pricing_file in day_files} - {pricing_data_dir}:
+            if not any(partition_dir.iterdir()):
+                partition_dir.rmdir()
+        segment_files.append(segment_file)
+        print(f"Compacted {len(day_files)} pricing files into {segment_file}")
+    return segment_files
+
+
+def get_pricing_dfs(
+    pricing_data_dir: Path,
+    file_format: str = "csv",
+    columns: Optional[List[str]] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    symbols: Optional[List[str]] = None,
+    workers: Optional[int] = None,
+    chunk_size: int = 64,
+    validate: Optional[str] = None,
+) -> List[pd.DataFrame]:
+    """Helper function in case sourcing for pricing data ever needs to change. Keep BTC in symbols for Part 4."""
+    if file_format == "sqlite":
+        selected_columns = columns if columns is None or "LoadedWhen" in columns else columns + ["LoadedWhen"]
+        df_all = read_sqlite(pricing_data_dir / PRICING_DATABASE_NAME, PRICING_TABLE, selected_columns, start, end, symbols)
+        return [df_run[columns or df_all.columns].reset_index(drop=True) for _, df_run in df_all.groupby("LoadedWhen", sort=True)]
+
+    pricing_df_paths = list_pricing_files(pricing_data_dir, file_format, start, end, validate)
+    segment_files = list_segment_files(pricing_data_dir, start, end, validate)
+    if segment_files:
+        compacted_sources = get_compacted_sources(segment_files, pricing_df_paths)
+        pricing_df_paths = [path for path in pricing_df_paths if path.relative_to(pricing_data_dir).as_posix() not in compacted_sources]
+
+    read_pricing_file = partial(read_table, file_format=file_format, columns=columns, symbols=symbols)
+    if workers is not None and workers > 1 and len(pricing_df_paths) > 1:
+        from concurrent.futures import ProcessPoolExecutor  # Pulls in multiprocessing, only needed for backfills
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            dfs_pricing = list(executor.map(read_pricing_file, pricing_df_paths, chunksize=chunk_size))
+    else:
+        dfs_pricing = [read_pricing_file(f) for f in pricing_df_paths] # This read could be replaced with a "safe_read" helper function to check for propagating nans
+    if not segment_files:
+        return dfs_pricing
+
+    # Segments hold the older runs, but merge on runtime in case runs were written after their day was compacted
+    runs = [(Path(source_file), df_run) for segment_file in segment_files for source_file, df_run in read_segment(segment_file, columns, symbols, start, end)]
+    runs.extend(zip(pricing_df_paths, dfs_pricing))
+    runs.sort(key=lambda run: (get_pricing_file_runtime(run[0]) or datetime.min, run[0].name))
+    return [df_run for _, df_run in runs]
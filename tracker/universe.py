@@ -0,0 +1,322 @@
+"""Part 1: the coin universe table, its reference/market split and compact in-memory snapshots."""
+from __future__ import annotations
+
+from collections import OrderedDict
+from datetime import datetime
+import hashlib
+import math
+from pathlib import Path
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from tracker.lazy import pd
+from tracker.storage import apply_table_schema, atomic_path, encode_nested_columns, get_file_format, read_table, require_pyarrow, save_table
+
+
+# Part 1: Store the entire universe of coins in a csv. This is for security data or coin level data.
+# Numeric fields of each quote currency, flattened into quote_<currency>_<field> float64 columns
+QUOTE_FIELDS = [
+    "price",
+    "volume_24h",
+    "volume_change_24h",
+    "percent_change_1h",
+    "percent_change_24h",
+    "percent_change_7d",
+    "percent_change_30d",
+    "percent_change_60d",
+    "percent_change_90d",
+    "market_cap",
+    "market_cap_dominance",
+    "fully_diluted_market_cap",
+    "tvl",
+]
+
+UNIVERSE_FLOAT_COLUMNS = [
+    "num_market_pairs",
+    "circulating_supply",
+    "total_supply",
+    "max_supply",
+    "self_reported_circulating_supply",
+    "self_reported_market_cap",
+    "percent_change_24h",
+]
+
+# Whole-number universe columns, which UniverseSnapshots stores as the smallest integer type that fits
+UNIVERSE_INTEGER_COLUMNS = ["id", "cmc_rank", "num_market_pairs"]
+FLOAT32_MAX = 3.4028234663852886e38
+
+
+def flatten_quote(quote: Dict, currencies: Optional[List[str]] = None) -> Dict:
+    """Helper function to flatten a coin's nested quote into quote_<currency>_<field> values, NaN for a missing currency."""
+    currencies = currencies or list(quote)
+    return {
+        f"quote_{currency}_{field}": (quote.get(currency) or {}).get(field, math.nan)
+        for currency in currencies
+        for field in QUOTE_FIELDS
+    }
+
+
+def apply_universe_dtypes(df_universe: pd.DataFrame) -> pd.DataFrame:
+    """Helper function to store quote and supply columns as float64 and symbol as a category."""
+    float_columns = [
+        col for col in df_universe.columns if col in UNIVERSE_FLOAT_COLUMNS or col.startswith("quote_")
+    ]
+    df_universe[float_columns] = df_universe[float_columns].apply(pd.to_numeric, errors="coerce").astype("float64")
+    if "symbol" in df_universe.columns:
+        df_universe["symbol"] = df_universe["symbol"].astype("category")
+    return df_universe
+
+
+def universe_row(coin: Dict, currencies: Optional[List[str]] = None) -> Dict:
+    """Helper function to pick the universe columns out of one coin from the API."""
+    # In production, keys for the universe can be handled by dictionary comprehension
+    # or a dataclass. If keys were implicitly defined, then there could be silent changing schemas.
+    return {
+        "id": coin["id"],
+        "name": coin["name"],
+        "symbol": coin["symbol"],
+        "slug": coin["slug"],
+        "cmc_rank": coin["cmc_rank"],
+        "num_market_pairs": coin["num_market_pairs"],
+        "circulating_supply": coin["circulating_supply"],
+        "total_supply": coin["total_supply"],
+        "max_supply": coin["max_supply"],
+        "infinite_supply": coin["infinite_supply"],
+        "last_updated": coin["last_updated"],
+        "date_added": coin["date_added"],
+        "tags": coin["tags"],
+        "platform": coin["platform"],
+        "self_reported_circulating_supply": coin[
+            "self_reported_circulating_supply"
+        ],
+        "self_reported_market_cap": coin["self_reported_market_cap"],
+        **flatten_quote(coin["quote"], currencies),
+        # Adding percent_change_24h from quotes. Parts 3 and 4 compare USD changes, so there's no fallback to another currency
+        "percent_change_24h": (coin["quote"].get("USD") or {}).get("percent_change_24h", math.nan),
+    }
+
+
+# Slowly changing coin fields. Everything else in the universe is per-run market data.
+UNIVERSE_REFERENCE_COLUMNS = ["id", "name", "symbol", "slug", "date_added", "tags", "platform", "max_supply", "infinite_supply"]
+
+
+def get_reference_hash_path(reference_path: Path) -> Path:
+    """Helper function for where the content hash of a reference table is kept."""
+    return reference_path.with_name(reference_path.name + ".sha256")
+
+
+def save_universe_snapshot(df_universe: pd.DataFrame, reference_path: Path, market_path: Path) -> bool:
+    """Save the universe as a reference table, rewritten only when its hash changes, and a per-run market table."""
+    reference_columns = [col for col in UNIVERSE_REFERENCE_COLUMNS if col in df_universe.columns]
+    market_columns = ["id"] + [col for col in df_universe.columns if col not in reference_columns]
+
+    # Sorted by id so a change in rank order alone doesn't count as a reference change
+    df_reference = encode_nested_columns(df_universe[reference_columns]).sort_values("id").reset_index(drop=True)
+    categorical_columns = {col: "object" for col in df_reference.columns if isinstance(df_reference[col].dtype, pd.CategoricalDtype)}
+    row_hashes = pd.util.hash_pandas_object(df_reference.astype(categorical_columns), index=False)
+    reference_hash = hashlib.sha256("|".join(reference_columns).encode() + row_hashes.to_numpy().tobytes()).hexdigest()
+
+    hash_path = get_reference_hash_path(reference_path)
+    reference_changed = not reference_path.exists() or not hash_path.exists() or hash_path.read_text() != reference_hash
+    if reference_changed:
+        save_table(df_reference, reference_path)
+        hash_path.write_text(reference_hash)
+    else:
+        print(f"Coin reference data unchanged, kept {reference_path}")
+    save_table(df_universe[market_columns], market_path)
+    return reference_changed
+
+
+def load_universe_snapshot(reference_path: Path, market_path: Path) -> pd.DataFrame:
+    """Join the market data table back onto the reference table, in market data (rank) order."""
+    df_market = read_table(market_path)
+    df_reference = read_table(reference_path)
+    df_universe = df_market.merge(df_reference, on="id", how="left", sort=False)
+    reference_columns = [col for col in UNIVERSE_REFERENCE_COLUMNS if col in df_universe.columns]
+    return df_universe[reference_columns + [col for col in df_universe.columns if col not in reference_columns]]
+
+
+def build_coin_universe(api_response: dict, currencies: Optional[List[str]] = None) -> pd.DataFrame:
+    """Helper function to turn the API response into the universe table without saving it."""
+    universe = [universe_row(coin, currencies) for coin in api_response]
+    return apply_universe_dtypes(pd.DataFrame(universe))
+
+
+def save_coin_universe(df_universe: pd.DataFrame, save_path: Path, reference_path: Optional[Path] = None):
+    """Helper function to save the universe. With reference_path, save_path only gets the per-run market data."""
+    if reference_path is None:
+        save_table(df_universe, save_path)
+    else:
+        save_universe_snapshot(df_universe, reference_path, save_path)
+    print(f"Coin universe saved to {save_path}")
+
+
+def get_coin_universe(api_response: dict, save_path: Path, currencies: Optional[List[str]] = None, reference_path: Optional[Path] = None) -> pd.DataFrame:
+    """Get the universe of coins from CoinMarketCap."""
+    df_universe = build_coin_universe(api_response, currencies)
+    save_coin_universe(df_universe, save_path, reference_path)
+    return df_universe
+
+
+def merge_currency_universes(dfs_by_currency: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """Helper function to join universes fetched in different convert currencies on coin id."""
+    currencies = list(dfs_by_currency)
+    primary_currency = "USD" if "USD" in dfs_by_currency else currencies[0]
+    df_universe = dfs_by_currency[primary_currency]
+    for currency in currencies:
+        if currency != primary_currency:
+            quote_columns = [f"quote_{currency}_{field}" for field in QUOTE_FIELDS]
+            df_universe = df_universe.merge(dfs_by_currency[currency][["id", *quote_columns]], on="id", how="left")
+    coin_columns = [col for col in df_universe.columns if not col.startswith("quote_") and col != "percent_change_24h"]
+    quote_columns = [f"quote_{currency}_{field}" for currency in currencies for field in QUOTE_FIELDS]
+    return df_universe[coin_columns + quote_columns + ["percent_change_24h"]]
+
+
+def deep_sizeof(value: Any) -> int:
+    """Helper function to size a value together with the strings, lists and dicts nested in it."""
+    if value is None:
+        return 0
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(deep_sizeof(key) + deep_sizeof(item) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(deep_sizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def memory_report(df: pd.DataFrame) -> pd.DataFrame:
+    """Helper function to report the bytes held by each column, counting nested lists and dicts in full."""
+    rows = []
+    for col in df.columns:
+        series = df[col]
+        if series.dtype == object:
+            column_bytes = series.memory_usage(index=False, deep=False) + sum(deep_sizeof(value) for value in series)
+        else:
+            column_bytes = series.memory_usage(index=False, deep=True)
+        rows.append({"column": col, "dtype": str(series.dtype), "bytes": int(column_bytes)})
+    return pd.DataFrame(rows, columns=["column", "dtype", "bytes"])
+
+
+class UniverseSnapshots:
+    """Compact in-memory universe snapshots (interned categoricals, downcast numbers) for comparing coins across runs.
+    Quote prices keep full precision; supplies, volumes and changes trade float_rtol of precision for half the memory."""
+
+    def __init__(self, max_snapshots: Optional[int] = None, float_rtol: float = 1e-6):
+        self.max_snapshots = max_snapshots
+        self.float_rtol = float_rtol
+        self.snapshots: OrderedDict = OrderedDict()
+        self.vocabulary: Dict[str, str] = {}
+
+    def compact(self, df_universe: pd.DataFrame) -> pd.DataFrame:
+        """Build the compact copy of a universe without adding it to the snapshots."""
+        df = encode_nested_columns(df_universe)
+        columns = {}
+        for col in df.columns:
+            series = df[col]
+            if series.dtype == object or isinstance(series.dtype, (pd.CategoricalDtype, pd.StringDtype)):
+                values = [self.vocabulary.setdefault(value, value) if isinstance(value, str) else None for value in series.astype(object)]
+                columns[col] = pd.Categorical(values, categories=list(dict.fromkeys(value for value in values if value is not None)))
+            elif col in UNIVERSE_INTEGER_COLUMNS and pd.api.types.is_numeric_dtype(series) and series.notna().all() and (series % 1 == 0).all():
+                columns[col] = pd.to_numeric(series.astype("int64"), downcast="integer")
+            elif pd.api.types.is_float_dtype(series) and not (col.startswith("quote_") and col.endswith("_price")):
+                # Prices stay float64: a 1e-6 relative error is already several cents on a 100k coin
+                columns[col] = self.downcast_float(series)
+            else:
+                columns[col] = series
+        return pd.DataFrame(columns, index=df.index)
+
+    def downcast_float(self, series: pd.Series) -> pd.Series:
+        """Helper function to store a float column as float32 when every value round-trips within float_rtol."""
+        if series.abs().max() >= FLOAT32_MAX:
+            return series
+        series_float32 = series.astype("float32")
+        round_trip_error = (series_float32.astype("float64") - series).abs()
+        if ((round_trip_error <= self.float_rtol * series.abs()) | series.isna()).all():
+            return series_float32
+        return series
+
+    def add(self, df_universe: pd.DataFrame, loaded_when: Optional[str] = None) -> pd.DataFrame:
+        """Compact a universe and keep it as the snapshot for loaded_when (default: now)."""
+        df_compact = self.compact(df_universe)
+        self.snapshots[loaded_when or datetime.now().isoformat()] = df_compact
+        if self.max_snapshots is not None and len(self.snapshots) > self.max_snapshots:
+            while len(self.snapshots) > self.max_snapshots:
+                self.snapshots.popitem(last=False)
+            # Drop strings only the evicted snapshots used (e.g. their last_updated timestamps)
+            self.vocabulary = {
+                value: value
+                for snapshot in self.snapshots.values()
+                for col in snapshot.columns
+                if isinstance(snapshot[col].dtype, pd.CategoricalDtype)
+                for value in snapshot[col].cat.categories
+            }
+        return df_compact
+
+    def compare(self, column: str) -> pd.DataFrame:
+        """One row per coin id and one column per snapshot, for comparing a field across runs."""
+        return pd.DataFrame({loaded_when: snapshot.set_index("id")[column] for loaded_when, snapshot in self.snapshots.items()})
+
+    def memory_report(self) -> pd.DataFrame:
+        """Bytes per column summed over the snapshots held, with interned strings counted once."""
+        column_bytes: Dict[str, int] = {}
+        column_dtypes: Dict[str, str] = {}
+        for snapshot in self.snapshots.values():
+            for col in snapshot.columns:
+                column_bytes[col] = column_bytes.get(col, 0) + int(snapshot[col].memory_usage(index=False, deep=False))
+                column_dtypes[col] = str(snapshot[col].dtype)
+        rows = [{"column": col, "dtype": column_dtypes[col], "bytes": column_bytes[col]} for col in column_bytes]
+        rows.append({"column": "(shared strings)", "dtype": "str", "bytes": sum(sys.getsizeof(value) for value in self.vocabulary)})
+        return pd.DataFrame(rows, columns=["column", "dtype", "bytes"])
+
+
+def get_coin_universe_streaming(
+    coins: Iterable[Dict],
+    save_path: Path,
+    keep_symbols: Optional[Set[str]] = None,
+    batch_size: int = 1000,
+    currencies: Optional[List[str]] = None,
+) -> pd.DataFrame:
+    """Write the universe to csv or parquet in batches as coins arrive, keeping only the keep_symbols rows. save_path is
+    only replaced once every batch is written."""
+    file_format = get_file_format(save_path)
+    if file_format not in ("csv", "parquet"):
+        raise ValueError(f"Streaming writes support csv and parquet, not {file_format}")
+
+    kept_rows = []
+    batch = []
+    parquet_writer = None
+    rows_written = 0
+
+    def write_batch(tmp_path: Path):
+        nonlocal parquet_writer, rows_written
+        df_batch = encode_nested_columns(apply_universe_dtypes(pd.DataFrame(batch)))
+        if file_format == "csv":
+            df_batch.to_csv(tmp_path, mode="w" if rows_written == 0 else "a", header=rows_written == 0, index=False)
+        else:
+            require_pyarrow(file_format)
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(apply_table_schema(df_batch), preserve_index=False)
+            if parquet_writer is None:
+                parquet_writer = pq.ParquetWriter(tmp_path, table.schema)
+            parquet_writer.write_table(table.cast(parquet_writer.schema))
+        rows_written += len(batch)
+        batch.clear()
+
+    with atomic_path(save_path) as tmp_path:
+        try:
+            for coin in coins:
+                row = universe_row(coin, currencies)
+                batch.append(row)
+                if keep_symbols is not None and row["symbol"] in keep_symbols:
+                    kept_rows.append(row)
+                if len(batch) >= batch_size:
+                    write_batch(tmp_path)
+            if batch or rows_written == 0:
+                write_batch(tmp_path)
+        finally:
+            if parquet_writer is not None:
+                parquet_writer.close()
+
+    print(f"Coin universe streamed to {save_path} ({rows_written} coins)")
+    return apply_universe_dtypes(pd.DataFrame(kept_rows))